@@ -1,20 +1,38 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, current_app, g
+from flask import Flask, render_template, request, jsonify, current_app
 from flask_bootstrap5 import Bootstrap
-from flask_sqlalchemy import SQLAlchemy
-from models import db, Patient, Doctor, Appointment, Billing
-from routes import (
-    patients_bp,
-    doctors_bp,
-    appointments_bp,
-    eye_tests_bp,
-    prescriptions_bp,
-    billings_bp,
-    reports_bp
+from models import db
+from routes import register_blueprints
+from services import (
+    dashboard_stats,
+    activity_feed,
+    describe,
+    reconcile_stats_command,
+    create_indexes_command,
+    check_query_plans_command,
+    purge_patients_command,
+    import_csv_command,
+    set_working_hours_command,
+    rebuild_search_index_command,
+    backfill_logmar_command,
+    report_worker_command,
+    rebuild_billing_rollups_command,
+    compile_templates_command,
+    create_db_command,
+    database_uri,
+    engine_options,
+    install_sqlite_pragmas,
+    install_fork_safety,
+    install_metrics,
+    install_templates,
+    compile_templates,
+    create_database,
+    response_cache,
+    DEFAULT_SQLITE_PRAGMAS
 )
 from datetime import datetime
 import os
 
-def create_app():
+def create_app(config=None):
     app = Flask(__name__,
                static_folder='static',
                template_folder='templates')
@@ -22,56 +40,80 @@ def create_app():
     # Configuration
     app.config.update(
         SECRET_KEY='your-secret-key-here',
-        SQLALCHEMY_DATABASE_URI='sqlite:///eye_management.db',
+        SQLALCHEMY_DATABASE_URI=database_uri(),  # DATABASE_URL overrides, e.g. a postgresql:// URI
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
-        TEMPLATES_AUTO_RELOAD=True,
-        WTF_CSRF_ENABLED=False  # Disable CSRF for testing
+        PRODUCTION=os.environ.get('APP_ENV') == 'production',  # Templates are precompiled and never reloaded
+        TEMPLATE_CACHE_DIR=None,  # Jinja bytecode cache in production; defaults to instance/jinja-cache
+        PER_PAGE=50,  # Default rows per page on list views (?per_page= overrides)
+        MAX_PER_PAGE=200,
+        CHOICES_CACHE_TTL=300,  # Seconds before cached dropdown choices are reloaded
+        CHOICES_INLINE_LIMIT=500,  # Larger dropdowns switch to the typeahead lookup
+        STATS_RECONCILE_INTERVAL=3600,  # Seconds between dashboard counter reconciliations
+        ACTIVITY_FEED_SIZE=50,  # Events kept in the recent activity ring buffer
+        ACTIVITY_REFRESH_INTERVAL=60,  # Seconds before the buffer is reloaded from the database
+        IMPORT_BATCH_SIZE=1000,  # Rows per executemany/commit in CSV imports
+        SLOT_MINUTES=30,  # Appointment length; bookings for a doctor may not overlap
+        WORKING_HOURS={0: ('09:00', '17:00'), 1: ('09:00', '17:00'), 2: ('09:00', '17:00'),
+                       3: ('09:00', '17:00'), 4: ('09:00', '17:00')},  # Weekday (0 = Monday) defaults for doctors without their own
+        SCHEDULE_CACHE_TTL=60,  # Seconds before the free-slot index is reloaded
+        QUEUE_POLL_INTERVAL=2,  # Seconds between checks for appointments changed by other processes (check-in board)
+        QUEUE_KEEPALIVE=15,  # Seconds of silence before a check-in stream sends a keepalive comment
+        QUEUE_BACKLOG=100,  # Diffs buffered per check-in screen before it is sent a fresh snapshot instead
+        RESPONSE_CACHE_SIZE=1000,  # Rendered detail pages kept in memory; 0 disables the cache
+        REPORT_WORKERS=2,  # Report job threads per process; 0 leaves jobs to `flask report-worker`
+        REPORT_POLL_INTERVAL=2.0,  # Seconds between job queue polls for reports queued by other processes
+        REPORT_JOB_TIMEOUT=3600,  # Seconds before a running job is assumed lost and run again
+        N_PLUS_ONE_THRESHOLD=10,  # Same SQL statement run more often than this in one request is logged as a likely N+1
+        PROFILE_SAMPLE_RATE=0.0,  # Fraction of requests run under cProfile; 0 disables profiling
+        PROFILE_SLOW_SECONDS=1.0,  # Profiled requests at least this slow are kept for /metrics/profiles
+        WTF_CSRF_ENABLED=False,  # Disable CSRF for testing
+        SQLITE_PRAGMAS=DEFAULT_SQLITE_PRAGMAS
     )
+    if config:
+        app.config.update(config)
+    # Pool sizing follows the chosen database unless set explicitly
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+    if app.config['TEMPLATES_AUTO_RELOAD'] is None:
+        app.config['TEMPLATES_AUTO_RELOAD'] = not app.config['PRODUCTION']
+    # Before anything creates the Jinja environment
+    install_templates(app)
 
     # Initialize extensions with app context
     with app.app_context():
         db.init_app(app)
+        install_sqlite_pragmas(db.engine, app.config['SQLITE_PRAGMAS'])
+        install_fork_safety(db.engine)
         bootstrap = Bootstrap(app)
-
-        # Ensure templates can access url_for
-        @app.context_processor
-        def inject_template_globals():
-            from flask import url_for
-            return dict(url_for=url_for)
-
-        # Create database tables
-        db.create_all()
+        # Schema changes are left to `flask create-db`, so starting a worker reads nothing from the database
+        install_metrics(app, db.engine)
 
     # Add template context processors
     @app.context_processor
     def inject_now():
         return {'now': datetime.utcnow()}
 
-    @app.context_processor
-    def utility_processor():
-        def format_currency(amount):
-            if amount is None:
-                return '$0.00'
-            return '${:,.2f}'.format(amount)
-
-        def format_date(date, format='%Y-%m-%d'):
-            if date is None:
-                return ''
-            return date.strftime(format)
-
-        return dict(
-            format_currency=format_currency,
-            format_date=format_date
-        )
-
     # Register blueprints
-    app.register_blueprint(patients_bp, url_prefix='/patients')
-    app.register_blueprint(doctors_bp, url_prefix='/doctors')
-    app.register_blueprint(appointments_bp, url_prefix='/appointments')
-    app.register_blueprint(eye_tests_bp, url_prefix='/eye_tests')
-    app.register_blueprint(prescriptions_bp, url_prefix='/prescriptions')
-    app.register_blueprint(billings_bp, url_prefix='/billings')
-    app.register_blueprint(reports_bp, url_prefix='/reports')
+    register_blueprints(app)
+    app.add_url_rule('/', 'index', index)
+    app.add_url_rule('/activity', 'activity', activity)
+    app.add_url_rule('/cache/stats', 'cache_stats', cache_stats)
+
+    app.cli.add_command(reconcile_stats_command)
+    app.cli.add_command(create_indexes_command)
+    app.cli.add_command(check_query_plans_command)
+    app.cli.add_command(purge_patients_command)
+    app.cli.add_command(import_csv_command)
+    app.cli.add_command(set_working_hours_command)
+    app.cli.add_command(rebuild_search_index_command)
+    app.cli.add_command(backfill_logmar_command)
+    app.cli.add_command(report_worker_command)
+    app.cli.add_command(rebuild_billing_rollups_command)
+    app.cli.add_command(compile_templates_command)
+    app.cli.add_command(create_db_command)
+
+    if app.config['PRODUCTION']:
+        # Compiled (or loaded from the bytecode cache) now rather than on each template's first request
+        compile_templates(app)
 
     # Test route to check template rendering
     @app.route('/test')
@@ -80,53 +122,17 @@ def create_app():
 
     return app
 
-# Create the application instance
-app = create_app()
-
-@app.route('/')
 def index():
     try:
         # Dashboard with statistics
-        patient_count = Patient.query.count()
-        doctor_count = Doctor.query.count()
-        appointment_count = Appointment.query.count()
-        billing_total = db.session.query(db.func.sum(Billing.amount)).filter(Billing.status == 'paid').scalar() or 0
-
-        # Get recent activities (last 5 of each type)
-        recent_appointments = Appointment.query.order_by(Appointment.created_at.desc()).limit(3).all()
-        recent_billings = Billing.query.order_by(Billing.created_at.desc()).limit(3).all()
-        recent_patients = Patient.query.order_by(Patient.created_at.desc()).limit(3).all()
+        stats = dashboard_stats()
+        patient_count = int(stats['patients'])
+        doctor_count = int(stats['doctors'])
+        appointment_count = int(stats['appointments'])
+        billing_total = stats['revenue']
 
-        # Combine and sort all recent activities
-        activities = []
-
-        for apt in recent_appointments:
-            activities.append({
-                'type': 'appointment',
-                'description': f"Appointment scheduled for {apt.patient.first_name} {apt.patient.last_name}",
-                'date': apt.created_at,
-                'url': url_for('appointments.view_appointment', id=apt.id)
-            })
-
-        for bill in recent_billings:
-            activities.append({
-                'type': 'billing',
-                'description': f"Billing created for {bill.patient.first_name} {bill.patient.last_name} - ${bill.amount}",
-                'date': bill.created_at,
-                'url': url_for('billings.view_billing', id=bill.id)
-            })
-
-        for pat in recent_patients:
-            activities.append({
-                'type': 'patient',
-                'description': f"New patient registered: {pat.first_name} {pat.last_name}",
-                'date': pat.created_at,
-                'url': url_for('patients.view_patient', id=pat.id)
-            })
-
-        # Sort activities by date (most recent first)
-        activities.sort(key=lambda x: x['date'], reverse=True)
-        recent_activities = activities[:5]  # Take top 5 most recent
+        # Recent activity comes from the in-memory feed (one UNION ALL query on refresh)
+        recent_activities = [describe(a) for a in activity_feed.recent(limit=5)]
 
         return render_template('index.html',
                             patient_count=patient_count,
@@ -135,13 +141,29 @@ def index():
                             billing_total=billing_total,
                             recent_activities=recent_activities)
     except Exception as e:
-        app.logger.error(f"Error in index route: {str(e)}")
+        current_app.logger.error(f"Error in index route: {str(e)}")
         return render_template('error.html', error="An error occurred while loading the dashboard."), 500
 
+def activity():
+    # Incremental polling: ?since=<ISO timestamp> returns only newer events
+    since = request.args.get('since')
+    try:
+        since = datetime.fromisoformat(since) if since else None
+    except ValueError:
+        return jsonify(error='Invalid since timestamp'), 400
+    events = [describe(a) for a in activity_feed.recent(since=since)]
+    for e in events:
+        e['date'] = e['date'].isoformat()
+    return jsonify(activities=events)
+
+def cache_stats():
+    return jsonify(response_cache.stats())
+
 if __name__ == '__main__':
+    app = create_app()
     with app.app_context():
         try:
-            db.create_all()
+            create_database(db.engine, db.metadata)
         except Exception as e:
             print(f"Error creating database tables: {str(e)}")
     app.run(debug=True, port=5001)
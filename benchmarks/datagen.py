@@ -0,0 +1,235 @@
+"""Deterministic synthetic clinic data for benchmarks.
+
+Fills patients, doctors, appointments, eye tests, prescriptions and
+billings with bulk inserts; the same ``--scale`` and ``--seed`` always
+give the same rows. ``--scale`` is the approximate total row count.
+
+    python -m benchmarks.datagen --database /tmp/bench.db --scale 100000
+"""
+import argparse
+import os
+import random
+import time
+from datetime import date, datetime, time as clock, timedelta
+
+from sqlalchemy import insert
+
+FIRST_NAMES = ['James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David', 'Elizabeth',
+               'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Priya', 'Wei',
+               'Ahmed', 'Fatima', 'Carlos', 'Sofia', 'Kenji', 'Aiko', 'Olu', 'Amara', 'Ivan', 'Olga']
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+              'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Patel', 'Chen',
+              'Khan', 'Nguyen', 'Kim', 'Sato', 'Okafor', 'Ivanova', 'Muller', 'Rossi', 'Silva', 'Cohen']
+HISTORY = [None, None, None, 'Diabetes', 'Hypertension', 'Glaucoma in family', 'Cataract surgery', 'Myopia since childhood']
+ACUITY = ['20/20', '20/25', '20/30', '20/40', '20/60', '20/80', '20/200', '6/6', '6/9', '6/12', '0.5', '0.8', 'CF']
+SPECIALTIES = ['Optometry', 'Ophthalmology', 'Retina', 'Glaucoma', 'Cornea', 'Pediatric Ophthalmology']
+METHODS = ['cash', 'card', 'insurance']
+
+FIRST_DAY = date(2022, 1, 3)  # a Monday; appointments fill weekdays from here
+SLOTS_PER_DAY = 16  # 09:00-17:00 in 30 minute slots, matching the default working hours
+STATUS_WEIGHTS = {'completed': 60, 'scheduled': 25, 'cancelled': 15}
+# Chance that an appointment that was not cancelled has each kind of child row
+EYE_TEST_RATE, PRESCRIPTION_RATE, BILLING_RATE = 0.6, 0.4, 0.9
+BATCH_SIZE = 10000
+
+
+def plan(scale):
+    """Row counts for a scale: appointments make up most rows, children hang off them."""
+    kept = 1 - STATUS_WEIGHTS['cancelled'] / sum(STATUS_WEIGHTS.values())
+    children = kept * (EYE_TEST_RATE + PRESCRIPTION_RATE + BILLING_RATE)
+    # One patient per three appointments
+    appointments = max(30, int(scale / (1 + 1 / 3 + children)))
+    return {
+        'patients': max(10, appointments // 3),
+        'doctors': max(3, scale // 10000),
+        'appointments': appointments
+    }
+
+
+def _workday(n):
+    weeks, weekday = divmod(n, 5)
+    return FIRST_DAY + timedelta(weeks=weeks, days=weekday)
+
+
+def _patients(rng, count):
+    for i in range(1, count + 1):
+        created = datetime.combine(FIRST_DAY, clock(8)) - timedelta(days=rng.randint(0, 1500), minutes=rng.randint(0, 600))
+        yield {
+            'id': i,
+            'first_name': rng.choice(FIRST_NAMES),
+            'last_name': rng.choice(LAST_NAMES),
+            'date_of_birth': date(1935, 1, 1) + timedelta(days=rng.randint(0, 80 * 365)),
+            'gender': rng.choice(['Male', 'Female', 'Other']),
+            'phone': f'555{rng.randint(0, 9999999):07d}',
+            'email': f'patient{i}@example.com',
+            'address': f'{rng.randint(1, 9999)} {rng.choice(LAST_NAMES)} Street',
+            'medical_history': rng.choice(HISTORY),
+            'created_at': created,
+            'updated_at': created
+        }
+
+
+def _doctors(rng, count):
+    for i in range(1, count + 1):
+        created = datetime.combine(FIRST_DAY, clock(8)) - timedelta(days=rng.randint(30, 3000))
+        yield {
+            'id': i,
+            'first_name': rng.choice(FIRST_NAMES),
+            'last_name': rng.choice(LAST_NAMES),
+            'specialty': rng.choice(SPECIALTIES),
+            'phone': f'556{rng.randint(0, 9999999):07d}',
+            'email': f'doctor{i}@example.com',
+            'license_number': f'LIC-{i:07d}',
+            'created_at': created,
+            'updated_at': created
+        }
+
+
+def _appointment_rows(rng, counts):
+    """Yield ``(model name, row)`` for each appointment followed by its children."""
+    from services.charts import snellen_to_logmar
+    logmar = {value: snellen_to_logmar(value) for value in ACUITY}
+    doctors = counts['doctors']
+    eye_test_id = prescription_id = billing_id = 0
+    for k in range(counts['appointments']):
+        # Slots are dealt round-robin over doctors, so no doctor is ever double-booked
+        slot = k // doctors
+        day = _workday(slot // SLOTS_PER_DAY)
+        minutes = 9 * 60 + 30 * (slot % SLOTS_PER_DAY)
+        appointment_id, patient_id, doctor_id = k + 1, rng.randint(1, counts['patients']), k % doctors + 1
+        booked = datetime.combine(day, clock(8)) - timedelta(days=rng.randint(1, 60), minutes=rng.randint(0, 600))
+        status = rng.choices(list(STATUS_WEIGHTS), weights=list(STATUS_WEIGHTS.values()))[0]
+        yield 'appointment', {
+            'id': appointment_id, 'patient_id': patient_id, 'doctor_id': doctor_id,
+            'appointment_date': day, 'appointment_time': clock(minutes // 60, minutes % 60),
+            'status': status, 'notes': None, 'created_at': booked, 'updated_at': booked
+        }
+        if status == 'cancelled':
+            continue
+        seen = datetime.combine(day, clock(minutes // 60, minutes % 60))
+        if rng.random() < EYE_TEST_RATE:
+            eye_test_id += 1
+            left, right = rng.choice(ACUITY), rng.choice(ACUITY)
+            yield 'eye_test', {
+                'id': eye_test_id, 'appointment_id': appointment_id, 'patient_id': patient_id, 'test_date': day,
+                'visual_acuity_left': left, 'visual_acuity_right': right,
+                'logmar_left': logmar[left], 'logmar_right': logmar[right],
+                'intraocular_pressure_left': round(rng.gauss(16, 3.5), 1),
+                'intraocular_pressure_right': round(rng.gauss(16, 3.5), 1),
+                'fundus_examination': 'Normal', 'other_findings': None,
+                'created_at': seen, 'updated_at': seen
+            }
+        if rng.random() < PRESCRIPTION_RATE:
+            prescription_id += 1
+            yield 'prescription', {
+                'id': prescription_id, 'patient_id': patient_id, 'doctor_id': doctor_id, 'prescription_date': day,
+                'sphere_left': rng.randint(-24, 12) * 0.25, 'cylinder_left': rng.randint(-8, 0) * 0.25,
+                'axis_left': rng.randint(0, 180),
+                'sphere_right': rng.randint(-24, 12) * 0.25, 'cylinder_right': rng.randint(-8, 0) * 0.25,
+                'axis_right': rng.randint(0, 180),
+                'pupillary_distance': round(rng.uniform(56, 72), 1), 'duration_months': rng.choice([6, 12, 24]),
+                'notes': None, 'created_at': seen, 'updated_at': seen
+            }
+        if rng.random() < BILLING_RATE:
+            billing_id += 1
+            paid = status == 'completed' and rng.random() < 0.8
+            yield 'billing', {
+                'id': billing_id, 'appointment_id': appointment_id, 'patient_id': patient_id,
+                'amount': float(rng.choice([45, 60, 75, 90, 120, 150, 220])),
+                'status': 'paid' if paid else 'pending',
+                'payment_date': day if paid else None,
+                'payment_method': rng.choice(METHODS) if paid else None,
+                'notes': None, 'created_at': seen, 'updated_at': seen
+            }
+
+
+def generate(scale, seed=0, batch_size=BATCH_SIZE):
+    """Fill the current app's database; returns rows inserted per table.
+
+    Rows go in with ORM bulk inserts, which skip the mapper hooks, so the
+    dashboard counters, billing rollups and search index are rebuilt at
+    the end.
+    """
+    from models import db
+    from services.rollups import rebuild_billing_rollups
+    from services.search import search_index_suspended
+    from services.stats import reconcile_stats
+
+    with search_index_suspended():
+        inserted = _insert_all(scale, seed, batch_size)
+    reconcile_stats()
+    with db.engine.begin() as connection:
+        rebuild_billing_rollups(connection)
+    return inserted
+
+
+def _insert_all(scale, seed, batch_size):
+    from models import db, Patient, Doctor, Appointment, EyeTestResult, Prescription, Billing
+
+    rng = random.Random(seed)
+    counts = plan(scale)
+    models = {'appointment': Appointment, 'eye_test': EyeTestResult, 'prescription': Prescription, 'billing': Billing}
+    inserted = dict.fromkeys(['patients', 'doctors', 'appointment', 'eye_test', 'prescription', 'billing'], 0)
+
+    def flush(model, rows):
+        if rows:
+            db.session.execute(insert(model), rows)
+            rows.clear()
+
+    for key, model, rows in (('patients', Patient, _patients(rng, counts['patients'])),
+                             ('doctors', Doctor, _doctors(rng, counts['doctors']))):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            inserted[key] += 1
+            if len(batch) >= batch_size:
+                flush(model, batch)
+        flush(model, batch)
+        db.session.commit()
+
+    batches = {name: [] for name in models}
+    for name, row in _appointment_rows(rng, counts):
+        batches[name].append(row)
+        inserted[name] += 1
+        if len(batches['appointment']) >= batch_size:
+            # Parents first, so the children's foreign keys resolve
+            for name_, model in models.items():
+                flush(model, batches[name_])
+            db.session.commit()
+    for name, model in models.items():
+        flush(model, batches[name])
+    db.session.commit()
+    return {
+        'patients': inserted['patients'], 'doctors': inserted['doctors'],
+        'appointments': inserted['appointment'], 'eye_tests': inserted['eye_test'],
+        'prescriptions': inserted['prescription'], 'billings': inserted['billing']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', required=True, help='SQLite file to create (must not exist) or a database URL.')
+    parser.add_argument('--scale', type=int, default=10000, help='Approximate total rows, e.g. 10000 to 10000000.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    uri = args.database if '://' in args.database else 'sqlite:///' + os.path.abspath(args.database)
+    if '://' not in args.database and os.path.exists(args.database):
+        parser.error(f'{args.database} already exists')
+    from app import create_app
+    from models import db
+    from services import create_database
+    app = create_app({'SQLALCHEMY_DATABASE_URI': uri})
+    started = time.perf_counter()
+    with app.app_context():
+        create_database(db.engine, db.metadata)
+        counts = generate(args.scale, args.seed, args.batch_size)
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    print(f"Inserted {total} rows in {elapsed:.1f}s ({total / elapsed:.0f} rows/s): "
+          + ', '.join(f'{key}={value}' for key, value in counts.items()))
+
+
+if __name__ == '__main__':
+    main()
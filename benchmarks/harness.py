@@ -0,0 +1,241 @@
+"""Latency, query count and memory of every GET endpoint, through the Flask test client.
+
+Point it at a database filled by ``benchmarks.datagen``. Each endpoint is
+requested a few times to warm up and then ``--requests`` times; the JSON
+written to ``--output`` can be passed as ``--compare`` to a later run,
+which then exits non-zero if an endpoint got slower than ``--tolerance``
+times its old p95 or runs more queries per request.
+
+    python -m benchmarks.datagen --database /tmp/bench.db --scale 100000
+    python -m benchmarks.harness --database /tmp/bench.db --output before.json
+    python -m benchmarks.harness --database /tmp/bench.db --compare before.json
+"""
+import argparse
+import importlib.metadata
+import json
+import os
+import platform
+import re
+import resource
+import sys
+import time
+from datetime import datetime
+
+WARMUP = 3
+REQUESTS = 30
+# Static files, the harness's own instrumentation, and event streams that never end
+UNMEASURED = {'static', 'metrics', 'metrics_profiles', 'appointments.today_stream'}
+
+# Model whose ids fill the <int:id> of each blueprint's routes
+ID_MODELS = {
+    'patients': 'Patient', 'doctors': 'Doctor', 'appointments': 'Appointment',
+    'eye_tests': 'EyeTestResult', 'prescriptions': 'Prescription', 'billings': 'Billing', 'reports': 'Report'
+}
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of sorted ``values``."""
+    if not values:
+        return None
+    rank = max(1, -(-q * len(values) // 100))
+    return values[int(rank) - 1]
+
+
+def _peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _sample_ids():
+    """A mid-table id per model, so runs over the same data request the same rows."""
+    import models
+    from models import db
+    from sqlalchemy import func, select
+
+    ids = {}
+    for blueprint, name in ID_MODELS.items():
+        model = getattr(models, name)
+        count = db.session.scalar(select(func.count()).select_from(model))
+        if count:
+            ids[blueprint] = db.session.scalar(select(model.id).order_by(model.id).offset(count // 2).limit(1))
+    return ids
+
+
+def _ensure_report():
+    from models import db, Report
+    from services.jobs import request_report, run_queued_jobs
+
+    if db.session.query(Report.id).first() is None:
+        request_report('appointment_summary', {}, 'benchmark')
+        run_queued_jobs()
+
+
+def _query_args(endpoint, ids):
+    from models import db, Appointment
+
+    if endpoint == 'appointments.availability':
+        appointment = db.session.get(Appointment, ids['appointments'])
+        return {'doctor_id': appointment.doctor_id, 'date': appointment.appointment_date.isoformat()}
+    if endpoint.endswith('.lookup_patients') or endpoint == 'patients.search':
+        return {'q': 'smi'}
+    if endpoint.endswith('.lookup_doctors'):
+        return {'q': 'a'}
+    if endpoint.endswith('.lookup_appointments'):
+        return {'q': str(ids.get('appointments', ''))}
+    if endpoint == 'appointments.bulk_status':
+        # Preview of closing a doctor's day
+        return dict(_query_args('appointments.availability', ids), status='completed')
+    if endpoint == 'billings.bulk_status':
+        return {'status': 'paid', 'ids': list(range(ids['billings'], ids['billings'] + 200))}
+    if endpoint == 'api.list_resource':
+        return {'resource': 'appointments', 'include': 'patient,doctor'}
+    if endpoint == 'api.view_resource':
+        return {'resource': 'appointments', 'include': 'patient,doctor,eye_tests,billings'}
+    return {}
+
+
+def endpoints(app, ids):
+    """``(endpoint, url)`` for every GET route, and the endpoints skipped for want of an id."""
+    from flask import url_for
+
+    found, skipped = [], []
+    with app.test_request_context():
+        for rule in sorted(app.url_map.iter_rules(), key=lambda rule: rule.endpoint):
+            if rule.endpoint in UNMEASURED or 'GET' not in rule.methods:
+                continue
+            values = _query_args(rule.endpoint, ids)
+            # API ids belong to the resource named in the URL
+            blueprint = values.get('resource') or rule.endpoint.partition('.')[0]
+            if 'id' in rule.arguments:
+                if blueprint not in ids:
+                    skipped.append(rule.endpoint)
+                    continue
+                values['id'] = ids[blueprint]
+            found.append((rule.endpoint, url_for(rule.endpoint, **values)))
+    return found, skipped
+
+
+def measure(client, url, requests, warmup, statements):
+    for _ in range(warmup):
+        client.get(url).get_data()
+    timings, queries, statuses = [], [], set()
+    rss_before = _peak_rss_kb()
+    for _ in range(requests):
+        before = statements[0]
+        started = time.perf_counter()
+        response = client.get(url)
+        # Streamed responses (the CSV exports) only do their work as the body is read
+        response.get_data()
+        response.close()
+        timings.append(time.perf_counter() - started)
+        queries.append(statements[0] - before)
+        statuses.add(response.status_code)
+    timings.sort()
+    return {
+        'url': url,
+        'status': sorted(statuses),
+        'requests': requests,
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+        **{f'p{q}_ms': round(percentile(timings, q) * 1000, 3) for q in (50, 95, 99)},
+        'queries_per_request': round(sum(queries) / len(queries), 2),
+        'peak_rss_kb': _peak_rss_kb(),
+        'rss_growth_kb': _peak_rss_kb() - rss_before
+    }
+
+
+def run(app, requests=REQUESTS, warmup=WARMUP, only=None, skip=None):
+    import models
+    from models import db
+    from sqlalchemy import event, func, select
+
+    statements = [0]
+
+    def count(*args):
+        statements[0] += 1
+
+    with app.app_context():
+        _ensure_report()
+        ids = _sample_ids()
+        found, skipped = endpoints(app, ids)
+        rows = {name: db.session.scalar(select(func.count()).select_from(getattr(models, name)))
+                for name in ID_MODELS.values()}
+        db.session.remove()
+        event.listen(db.engine, 'before_cursor_execute', count)
+
+    results = {}
+    client = app.test_client()
+    for endpoint, url in found:
+        if (only and not re.search(only, endpoint)) or (skip and re.search(skip, endpoint)):
+            continue
+        results[endpoint] = measure(client, url, requests, warmup, statements)
+        print(f"{endpoint:40} p50 {results[endpoint]['p50_ms']:9.2f} ms  p95 {results[endpoint]['p95_ms']:9.2f} ms  "
+              f"{results[endpoint]['queries_per_request']:6.1f} queries  status {results[endpoint]['status']}",
+              file=sys.stderr)
+    return {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+            'database': app.config['SQLALCHEMY_DATABASE_URI'],
+            'rows': rows,
+            'python': platform.python_version(),
+            'flask': importlib.metadata.version('flask'),
+            'sqlalchemy': importlib.metadata.version('sqlalchemy'),
+            'requests': requests,
+            'warmup': warmup,
+            'skipped': skipped
+        },
+        'endpoints': results
+    }
+
+
+def compare(result, baseline, tolerance):
+    """Print the change against ``baseline`` per endpoint; returns the endpoints that regressed."""
+    regressed = []
+    for endpoint, now in result['endpoints'].items():
+        before = baseline['endpoints'].get(endpoint)
+        if before is None:
+            continue
+        ratio = now['p95_ms'] / before['p95_ms'] if before['p95_ms'] else 1.0
+        extra_queries = now['queries_per_request'] - before['queries_per_request']
+        worse = ratio > tolerance or extra_queries > 0
+        if worse:
+            regressed.append(endpoint)
+        print(f"{'REGRESSED' if worse else 'ok':9} {endpoint:40} p95 {before['p95_ms']:9.2f} -> {now['p95_ms']:9.2f} ms "
+              f"(x{ratio:.2f})  queries {before['queries_per_request']} -> {now['queries_per_request']}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', required=True, help='SQLite file or database URL, e.g. from benchmarks.datagen.')
+    parser.add_argument('--requests', type=int, default=REQUESTS, help='Timed requests per endpoint.')
+    parser.add_argument('--warmup', type=int, default=WARMUP)
+    parser.add_argument('--only', help='Regex; benchmark only the endpoints it matches.')
+    parser.add_argument('--skip', help='Regex; leave out the endpoints it matches.')
+    parser.add_argument('--output', help='Write the results here as JSON (default stdout).')
+    parser.add_argument('--compare', help='Results JSON of an earlier run to compare against.')
+    parser.add_argument('--tolerance', type=float, default=1.2, help='Allowed p95 ratio against --compare.')
+    args = parser.parse_args()
+
+    uri = args.database if '://' in args.database else 'sqlite:///' + os.path.abspath(args.database)
+    if '://' not in args.database and not os.path.exists(args.database):
+        parser.error(f'{args.database} does not exist')
+    from app import create_app
+    # Reports are built inline by the harness, not by background threads
+    app = create_app({'SQLALCHEMY_DATABASE_URI': uri, 'REPORT_WORKERS': 0})
+    result = run(app, args.requests, args.warmup, args.only, args.skip)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    else:
+        print(json.dumps(result, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(result, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
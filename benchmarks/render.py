@@ -0,0 +1,74 @@
+"""Render time of appointments/list.html, in development and production template modes.
+
+Rows are built in memory (no database reads), so the figures are the
+template's own cost: per-row formatting and url_for calls, the context
+processors, and for the first render, compiling or loading the template.
+
+    python -m benchmarks.render --rows 10000 --repeat 10
+"""
+import argparse
+import json
+import statistics
+import tempfile
+import time
+from datetime import date, datetime, time as clock, timedelta
+
+MODES = {
+    'development': {'PRODUCTION': False},
+    'production': {'PRODUCTION': True},
+}
+
+
+def _appointments(rows):
+    from models import Appointment, Doctor, Patient
+
+    doctors = [Doctor(id=i, first_name='Doctor', last_name=str(i)) for i in range(1, 21)]
+    patients = [Patient(id=i, first_name='Patient', last_name=str(i)) for i in range(1, rows // 3 + 2)]
+    statuses = ['scheduled', 'completed', 'cancelled']
+    return [
+        Appointment(id=i, patient=patients[i % len(patients)], doctor=doctors[i % len(doctors)],
+                    appointment_date=date(2024, 1, 1) + timedelta(days=i // 320),
+                    appointment_time=clock(9 + i % 8, 30 * (i % 2)), status=statuses[i % 3])
+        for i in range(1, rows + 1)
+    ]
+
+
+def measure(mode, rows, repeat, cache_dir):
+    from flask import render_template
+    from app import create_app
+    from services import KeysetPage
+
+    app = create_app(dict(MODES[mode], SQLALCHEMY_DATABASE_URI='sqlite://', TEMPLATE_CACHE_DIR=cache_dir))
+    page = KeysetPage(_appointments(rows), rows, next_cursor='x')
+    timings = []
+    with app.test_request_context('/appointments/'):
+        for _ in range(repeat + 1):
+            started = time.perf_counter()
+            render_template('appointments/list.html', appointments=page, page=page)
+            timings.append(time.perf_counter() - started)
+    first, rest = timings[0], timings[1:]
+    return {
+        'first_render_ms': round(first * 1000, 2),
+        'median_ms': round(statistics.median(rest) * 1000, 2),
+        'min_ms': round(min(rest) * 1000, 2),
+        'per_row_us': round(statistics.median(rest) / rows * 1e6, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=10, help='Timed renders after the first.')
+    parser.add_argument('--mode', choices=sorted(MODES), action='append',
+                        help='Template mode to measure (default: all).')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for mode in args.mode or sorted(MODES):
+            results[mode] = measure(mode, args.rows, args.repeat, cache_dir)
+    print(json.dumps({'rows': args.rows, 'repeat': args.repeat, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
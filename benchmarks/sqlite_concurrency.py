@@ -0,0 +1,129 @@
+"""Concurrent read/write throughput against SQLite, default engine vs the tuned profile.
+
+Each worker is a separate process with its own app and engine, the way
+gunicorn workers are. Writers insert appointments one commit at a time;
+readers fetch the first page of the appointments list.
+
+    python -m benchmarks.sqlite_concurrency --readers 4 --writers 2 --seconds 10
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from datetime import date, time as clock, timedelta
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import joinedload
+
+PROFILES = {
+    # What create_app used before the tuning profile existed
+    'default': {'SQLITE_PRAGMAS': {}, 'SQLALCHEMY_ENGINE_OPTIONS': {}},
+    # Whatever create_app configures today
+    'tuned': {}
+}
+
+
+def _make_app(uri, profile):
+    from app import create_app
+    return create_app(dict(PROFILES[profile], SQLALCHEMY_DATABASE_URI=uri))
+
+
+def _seed(uri, profile):
+    from models import db, Patient, Doctor
+    from services import create_database
+    app = _make_app(uri, profile)
+    with app.app_context():
+        create_database(db.engine, db.metadata)
+        db.session.add(Doctor(first_name='Bench', last_name='Doctor', specialty='Optometry',
+                              phone='5550000000', email='bench@example.com', license_number='BENCH-1'))
+        db.session.add_all([
+            Patient(first_name='Bench', last_name=str(i), date_of_birth=date(1980, 1, 1), gender='Other',
+                    phone='5550000000', email=f'bench{i}@example.com', address='Bench')
+            for i in range(100)
+        ])
+        db.session.commit()
+        db.engine.dispose()
+
+
+def _slot(writer, n):
+    # A fresh slot per insert, and a separate range of days per writer; appointment slots are unique
+    day = date(2024, 1, 1) + timedelta(days=writer * 10000 + n // 16)
+    return day, clock(9 + n % 16 // 2, 30 * (n % 2))
+
+
+def _worker(uri, profile, role, index, seconds, results):
+    from models import db, Appointment
+    app = _make_app(uri, profile)
+    ops = errors = 0
+    latencies = []
+    with app.app_context():
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                if role == 'writer':
+                    day, at = _slot(index, ops)
+                    db.session.add(Appointment(patient_id=ops % 100 + 1, doctor_id=1,
+                                               appointment_date=day, appointment_time=at))
+                    db.session.commit()
+                else:
+                    (Appointment.query
+                     .options(joinedload(Appointment.patient), joinedload(Appointment.doctor))
+                     .order_by(Appointment.appointment_date.desc(), Appointment.id.desc())
+                     .limit(50).all())
+                    db.session.rollback()
+                ops += 1
+                latencies.append(time.perf_counter() - started)
+            except OperationalError:
+                # "database is locked"
+                db.session.rollback()
+                errors += 1
+    latencies.sort()
+    results.put({
+        'role': role,
+        'ops': ops,
+        'errors': errors,
+        'p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 2) if latencies else None
+    })
+
+
+def run(profile, readers, writers, seconds):
+    directory = tempfile.mkdtemp(prefix='eye-bench-')
+    uri = 'sqlite:///' + os.path.join(directory, 'bench.db')
+    _seed(uri, profile)
+
+    results = multiprocessing.Queue()
+    roles = ['reader'] * readers + ['writer'] * writers
+    processes = [multiprocessing.Process(target=_worker, args=(uri, profile, role, index, seconds, results))
+                 for index, role in enumerate(roles)]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    summary = {'profile': profile}
+    for role in ('reader', 'writer'):
+        rows = [r for r in collected if r['role'] == role]
+        summary[f'{role}_ops_per_s'] = round(sum(r['ops'] for r in rows) / seconds, 1)
+        summary[f'{role}_errors'] = sum(r['errors'] for r in rows)
+        summary[f'{role}_p99_ms'] = max((r['p99_ms'] or 0) for r in rows) if rows else None
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--profile', choices=sorted(PROFILES), action='append')
+    args = parser.parse_args()
+
+    for profile in args.profile or ['default', 'tuned']:
+        print(json.dumps(run(profile, args.readers, args.writers, args.seconds)))
+
+
+if __name__ == '__main__':
+    main()
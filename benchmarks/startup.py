@@ -0,0 +1,76 @@
+"""Cold start time: importing app, building it with create_app, and serving the first request.
+
+Each run is a fresh interpreter, the way a gunicorn worker or a
+``flask`` CLI command starts, against a database that already has its
+schema (created once beforehand with ``flask create-db``'s code path).
+
+    python -m benchmarks.startup --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Run in the child interpreter; prints one JSON line of timings in ms
+CHILD = """
+import json, time
+started = time.perf_counter()
+import app as module
+imported = time.perf_counter()
+application = module.create_app()
+built = time.perf_counter()
+response = application.test_client().get('/')
+served = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({'import_ms': (imported - started) * 1000, 'create_app_ms': (built - imported) * 1000,
+                  'first_request_ms': (served - built) * 1000}))
+"""
+
+CREATE = """
+from app import create_app
+from models import db
+from services import create_database
+with create_app().app_context():
+    create_database(db.engine, db.metadata)
+"""
+
+
+def _run(code, uri):
+    env = dict(os.environ, DATABASE_URL=uri)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.run([sys.executable, '-c', code], env=env, cwd=root, check=True,
+                          capture_output=True, text=True).stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--database', help='Existing SQLite file or database URL (default: a new empty database).')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.database:
+            uri = args.database if '://' in args.database else 'sqlite:///' + os.path.abspath(args.database)
+        else:
+            uri = 'sqlite:///' + os.path.join(tmp, 'startup.db')
+            _run(CREATE, uri)
+        runs = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            timings = json.loads(_run(CHILD, uri).strip().splitlines()[-1])
+            timings['process_ms'] = (time.perf_counter() - started) * 1000
+            runs.append(timings)
+
+    print(json.dumps({
+        'runs': args.runs,
+        'median': {key: round(statistics.median(run[key] for run in runs), 1) for key in runs[0]},
+        'min': {key: round(min(run[key] for run in runs), 1) for key in runs[0]},
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -73,7 +73,8 @@ class ReportForm(FlaskForm):
         ('patient_history', 'Patient History'),
         ('appointment_summary', 'Appointment Summary'),
         ('billing_summary', 'Billing Summary'),
-        ('doctor_performance', 'Doctor Performance')
+        ('doctor_performance', 'Doctor Performance'),
+        ('clinical_analytics', 'Clinical Analytics')
     ], validators=[DataRequired()])
     start_date = DateField('Start Date')
     end_date = DateField('End Date')
@@ -1,5 +1,7 @@
-from app import app, db
+from app import create_app
+from models import db
+from services import create_database
 
-with app.app_context():
-    db.create_all()
+with create_app().app_context():
+    create_database(db.engine, db.metadata)
     print("Database tables created successfully!")
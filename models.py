@@ -14,11 +14,16 @@ class Patient(db.Model):
     address = db.Column(db.Text, nullable=False)
     medical_history = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-    appointments = db.relationship('Appointment', backref='patient', lazy=True)
-    prescriptions = db.relationship('Prescription', backref='patient', lazy=True)
-    billings = db.relationship('Billing', backref='patient', lazy=True)
-    eye_tests = db.relationship('EyeTestResult', backref='patient', lazy=True)
+    appointments = db.relationship('Appointment', backref='patient', lazy=True, cascade='all', passive_deletes=True)
+    prescriptions = db.relationship('Prescription', backref='patient', lazy=True, cascade='all', passive_deletes=True)
+    billings = db.relationship('Billing', backref='patient', lazy=True, cascade='all', passive_deletes=True)
+    eye_tests = db.relationship('EyeTestResult', backref='patient', lazy=True, cascade='all', passive_deletes=True)
+
+    __table_args__ = (
+        db.Index('ix_patient_created_at_id', 'created_at', 'id'),
+    )
 
     def __repr__(self):
         return f'<Patient {self.first_name} {self.last_name}>'
@@ -32,49 +37,92 @@ class Doctor(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     license_number = db.Column(db.String(50), unique=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    appointments = db.relationship('Appointment', backref='doctor', lazy=True, cascade='all', passive_deletes=True)
+    prescriptions = db.relationship('Prescription', backref='doctor', lazy=True, cascade='all', passive_deletes=True)
+    working_hours = db.relationship('WorkingHours', backref='doctor', lazy=True, cascade='all', passive_deletes=True)
 
-    appointments = db.relationship('Appointment', backref='doctor', lazy=True)
-    prescriptions = db.relationship('Prescription', backref='doctor', lazy=True)
+    __table_args__ = (
+        db.Index('ix_doctor_created_at_id', 'created_at', 'id'),
+    )
 
     def __repr__(self):
         return f'<Doctor {self.first_name} {self.last_name}>'
 
+class WorkingHours(db.Model):
+    # Doctors without rows here use the WORKING_HOURS config; equal start and end times mark a day off
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id', ondelete='CASCADE'), nullable=False)
+    weekday = db.Column(db.Integer, nullable=False)  # 0 = Monday
+    start_time = db.Column(db.Time, nullable=False)
+    end_time = db.Column(db.Time, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('doctor_id', 'weekday', name='uq_working_hours_doctor_weekday'),
+    )
+
+    def __repr__(self):
+        return f'<WorkingHours {self.doctor_id} {self.weekday} {self.start_time}-{self.end_time}>'
+
 class Appointment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
-    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id', ondelete='CASCADE'), nullable=False, index=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id', ondelete='CASCADE'), nullable=False)
     appointment_date = db.Column(db.Date, nullable=False)
     appointment_time = db.Column(db.Time, nullable=False)
     status = db.Column(db.String(20), default='scheduled')  # scheduled, completed, cancelled
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-    eye_tests = db.relationship('EyeTestResult', backref='appointment', lazy=True)
-    billings = db.relationship('Billing', backref='appointment', lazy=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    eye_tests = db.relationship('EyeTestResult', backref='appointment', lazy=True, cascade='all', passive_deletes=True)
+    billings = db.relationship('Billing', backref='appointment', lazy=True, cascade='all', passive_deletes=True)
+
+    __table_args__ = (
+        # doctor_id leads, so this also serves foreign key lookups on doctor
+        db.Index('ix_appointment_doctor_schedule', 'doctor_id', 'appointment_date', 'appointment_time'),
+        # No two live appointments for the same doctor at the same time; cancelled ones free the slot
+        db.Index('uq_appointment_doctor_slot', 'doctor_id', 'appointment_date', 'appointment_time', unique=True,
+                 sqlite_where=db.text("status != 'cancelled'"), postgresql_where=db.text("status != 'cancelled'")),
+        db.Index('ix_appointment_schedule', 'appointment_date', 'appointment_time', 'id'),
+        db.Index('ix_appointment_status_created_at', 'status', 'created_at'),
+        db.Index('ix_appointment_created_at_id', 'created_at', 'id'),
+    )
 
     def __repr__(self):
         return f'<Appointment {self.id} - {self.appointment_date}>'
 
 class EyeTestResult(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), nullable=False)
-    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id', ondelete='CASCADE'), nullable=False, index=True)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id', ondelete='CASCADE'), nullable=False)
     test_date = db.Column(db.Date, nullable=False)
     visual_acuity_left = db.Column(db.String(20))
     visual_acuity_right = db.Column(db.String(20))
+    # Numeric logMAR parsed from the acuity strings on save (services/charts.py)
+    logmar_left = db.Column(db.Float)
+    logmar_right = db.Column(db.Float)
     intraocular_pressure_left = db.Column(db.Float)
     intraocular_pressure_right = db.Column(db.Float)
     fundus_examination = db.Column(db.Text)
     other_findings = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_eye_test_result_test_date_id', 'test_date', 'id'),
+        # patient_id leads, so this also serves foreign key lookups on patient
+        db.Index('ix_eye_test_result_patient_date', 'patient_id', 'test_date'),
+    )
 
     def __repr__(self):
         return f'<EyeTestResult {self.id} - {self.test_date}>'
 
 class Prescription(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
-    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id', ondelete='CASCADE'), nullable=False)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id', ondelete='CASCADE'), nullable=False, index=True)
     prescription_date = db.Column(db.Date, nullable=False)
     # Left eye prescription
     sphere_left = db.Column(db.Float)
@@ -88,21 +136,34 @@ class Prescription(db.Model):
     pupillary_distance = db.Column(db.Float)
     duration_months = db.Column(db.Integer, nullable=False)
     notes = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_prescription_date_id', 'prescription_date', 'id'),
+        # patient_id leads, so this also serves foreign key lookups on patient
+        db.Index('ix_prescription_patient_date', 'patient_id', 'prescription_date'),
+    )
 
     def __repr__(self):
         return f'<Prescription {self.id} - {self.prescription_date}>'
 
 class Billing(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), nullable=False)
-    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id', ondelete='CASCADE'), nullable=False, index=True)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id', ondelete='CASCADE'), nullable=False, index=True)
     amount = db.Column(db.Float, nullable=False)
     status = db.Column(db.String(20), default='pending')  # pending, paid, cancelled
     payment_date = db.Column(db.Date)
     payment_method = db.Column(db.String(50))
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_billing_status_created_at', 'status', 'created_at'),
+        db.Index('ix_billing_created_at_id', 'created_at', 'id'),
+    )
 
     def __repr__(self):
         return f'<Billing {self.id} - ${self.amount}>'
@@ -113,7 +174,50 @@ class Report(db.Model):
     generated_by = db.Column(db.String(100), nullable=False)
     generated_at = db.Column(db.DateTime, default=datetime.utcnow)
     parameters = db.Column(db.Text)  # JSON string of report parameters
-    data = db.Column(db.Text)  # JSON string of report data
+    data = db.Column(db.Text)  # JSON string of report data (reports generated before data_gz)
+    params_hash = db.Column(db.String(64))  # sha256 of report type + normalised parameters
+    source_versions = db.Column(db.Text)  # JSON {table: change counter} the data was built from
+    data_gz = db.Column(db.LargeBinary)  # zlib-compressed JSON report data
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, running, done, failed
+    progress = db.Column(db.Integer, nullable=False, default=0)  # percent, while running
+    started_at = db.Column(db.DateTime)
+    duration = db.Column(db.Float)  # seconds the builder took
+    error = db.Column(db.Text)
+
+    __table_args__ = (
+        db.Index('ix_report_generated_at_id', 'generated_at', 'id'),
+        db.Index('uq_report_params_hash', 'params_hash', unique=True),
+        db.Index('ix_report_status_id', 'status', 'id'),  # job queue: oldest pending first
+    )
 
     def __repr__(self):
         return f'<Report {self.report_type} - {self.generated_at}>'
+
+class BillingRollup(db.Model):
+    # Billing count and amount per day and per month, maintained by services/rollups.py
+    grain = db.Column(db.String(5), primary_key=True)  # day, month
+    period_start = db.Column(db.Date, primary_key=True)  # the day, or the first day of the month
+    status = db.Column(db.String(20), primary_key=True)
+    payment_method = db.Column(db.String(50), primary_key=True)  # '' when not recorded
+    doctor_id = db.Column(db.Integer, primary_key=True)  # from the billing's appointment
+    count = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Float, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<BillingRollup {self.grain} {self.period_start} {self.status} {self.amount}>'
+
+class DashboardStat(db.Model):
+    key = db.Column(db.String(50), primary_key=True)  # patients, doctors, appointments, revenue
+    value = db.Column(db.Float, nullable=False, default=0)
+    reconciled_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<DashboardStat {self.key}={self.value}>'
+
+class TableVersion(db.Model):
+    # Bumped by every transaction that writes to the table (services/changes.py)
+    table_name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<TableVersion {self.table_name}={self.version}>'
@@ -1,7 +1,26 @@
-from .patients import patients_bp
-from .doctors import doctors_bp
-from .appointments import appointments_bp
-from .eye_tests import eye_tests_bp
-from .prescriptions import prescriptions_bp
-from .billings import billings_bp
-from .reports import reports_bp
+from importlib import import_module
+
+# (module, blueprint, URL prefix); modules are imported when an app registers them, not with this package
+BLUEPRINTS = [
+    ('patients', 'patients_bp', '/patients'),
+    ('doctors', 'doctors_bp', '/doctors'),
+    ('appointments', 'appointments_bp', '/appointments'),
+    ('eye_tests', 'eye_tests_bp', '/eye_tests'),
+    ('prescriptions', 'prescriptions_bp', '/prescriptions'),
+    ('billings', 'billings_bp', '/billings'),
+    ('reports', 'reports_bp', '/reports'),
+    ('api', 'api_bp', '/api/v1'),
+]
+
+
+def register_blueprints(app):
+    for module, name, url_prefix in BLUEPRINTS:
+        app.register_blueprint(getattr(import_module(f'.{module}', __name__), name), url_prefix=url_prefix)
+
+
+def __getattr__(name):
+    # `from routes import patients_bp` still works
+    for module, blueprint, _ in BLUEPRINTS:
+        if blueprint == name:
+            return getattr(import_module(f'.{module}', __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,47 @@
+import json
+
+from flask import Blueprint, Response, request, jsonify
+
+from services import ApiFetch
+
+api_bp = Blueprint('api', __name__)
+
+
+def _json(payload):
+    # Compact and unsorted; the dicts are already in column order
+    return Response(json.dumps(payload, separators=(',', ':')), mimetype='application/json')
+
+
+def _fetch(resource):
+    try:
+        return ApiFetch(resource, request.args), None
+    except LookupError:
+        return None, (jsonify(error=f'Unknown resource: {resource}'), 404)
+    except ValueError as e:
+        return None, (jsonify(error=str(e)), 400)
+
+
+@api_bp.route('/<resource>')
+def list_resource(resource):
+    # ?fields=a,b  ?include=patient,doctor  ?fields[patient]=a,b  ?ids=1,2,3  ?after=<cursor>&per_page=
+    # and ?<column>=value on the resource's filter columns
+    fetch, error = _fetch(resource)
+    if error:
+        return error
+    try:
+        if request.args.get('ids'):
+            return _json(fetch.by_ids(request.args['ids']))
+        return _json(fetch.page(request.args))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+
+@api_bp.route('/<resource>/<int:id>')
+def view_resource(resource, id):
+    fetch, error = _fetch(resource)
+    if error:
+        return error
+    item = fetch.one(id)
+    if item is None:
+        return jsonify(error=f'No {resource} with id {id}'), 404
+    return _json({'data': item})
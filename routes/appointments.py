@@ -1,21 +1,110 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, Response, render_template, redirect, url_for, flash, request, jsonify, stream_with_context
 from models import db, Appointment, Patient, Doctor
 from forms import AppointmentForm
+from services import keyset_paginate, bind_choices, patient_choices, doctor_choices, appointment_choices, delete_appointments, stream_query, import_upload, slot_index, slot_conflict, cached_view, today_queue, appointment_selection, count_selected, parse_day, set_appointment_status
+from sqlalchemy.orm import joinedload
 from sqlalchemy.exc import IntegrityError
+from datetime import datetime
 
 appointments_bp = Blueprint('appointments', __name__)
 
 @appointments_bp.route('/')
 def list_appointments():
-    appointments = Appointment.query.all()
-    return render_template('appointments/list.html', appointments=appointments)
+    query = Appointment.query.options(joinedload(Appointment.patient), joinedload(Appointment.doctor))
+    appointments = keyset_paginate(query, [Appointment.appointment_date, Appointment.appointment_time, Appointment.id])
+    return render_template('appointments/list.html', appointments=appointments, page=appointments)
+
+@appointments_bp.route('/export')
+def export_appointments():
+    # ?format=csv|ndjson, ?gzip=1
+    statement = (db.select(
+                     *Appointment.__table__.columns,
+                     (Patient.first_name + ' ' + Patient.last_name).label('patient_name'),
+                     (Doctor.first_name + ' ' + Doctor.last_name).label('doctor_name'))
+                 .join(Patient, Appointment.patient_id == Patient.id)
+                 .join(Doctor, Appointment.doctor_id == Doctor.id)
+                 .order_by(Appointment.id))
+    return stream_query('appointments', statement)
+
+@appointments_bp.route('/import', methods=['GET', 'POST'])
+def import_appointments():
+    return import_upload('appointments', 'Appointments', 'appointments.list_appointments')
+
+@appointments_bp.route('/lookup')
+def lookup_appointments():
+    return jsonify(results=appointment_choices.search(request.args.get('q')))
+
+@appointments_bp.route('/availability')
+def availability():
+    # ?doctor_id=&date=YYYY-MM-DD&time=HH:MM checks one slot;
+    # without time, returns the next ?count= free slots from date (default now)
+    doctor_id = request.args.get('doctor_id', type=int)
+    if doctor_id is None or db.session.get(Doctor, doctor_id) is None:
+        return jsonify(error='Unknown doctor'), 404
+    try:
+        day = datetime.strptime(request.args['date'], '%Y-%m-%d').date() if request.args.get('date') else None
+        at = datetime.strptime(request.args['time'], '%H:%M').time() if request.args.get('time') else None
+    except ValueError:
+        return jsonify(error='Invalid date or time'), 400
+
+    if at is not None:
+        if day is None:
+            return jsonify(error='date is required with time'), 400
+        conflict = slot_conflict(doctor_id, day, at, exclude_id=request.args.get('exclude', type=int))
+        return jsonify(doctor_id=doctor_id, date=day.isoformat(), time=at.strftime('%H:%M'),
+                       free=conflict is None, reason=conflict)
+
+    count = max(1, min(request.args.get('count', 10, type=int), 100))
+    after = datetime.combine(day, datetime.min.time()) if day else datetime.now()
+    slots = slot_index.next_free(doctor_id, after, count)
+    return jsonify(doctor_id=doctor_id, slot_minutes=slot_index.slot_minutes(),
+                   slots=[{'date': s.date().isoformat(), 'time': s.strftime('%H:%M')} for s in slots])
+
+@appointments_bp.route('/today')
+def today():
+    # Check-in board; rows arrive over the stream below
+    return render_template('appointments/today.html', doctor_id=request.args.get('doctor_id', type=int))
+
+@appointments_bp.route('/today/stream')
+def today_stream():
+    # Server-sent events: today's queue by doctor, then diffs as appointments are booked or change status
+    return Response(stream_with_context(today_queue.stream(request.args.get('doctor_id', type=int))),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@appointments_bp.route('/status', methods=['GET', 'POST'])
+def bulk_status():
+    # ?status=completed|cancelled with ids= (repeated, e.g. checkboxes) or doctor_id=&date=YYYY-MM-DD;
+    # GET previews how many scheduled appointments would change, POST changes them in one UPDATE
+    status = request.values.get('status')
+    try:
+        criteria = appointment_selection(status, ids=request.values.getlist('ids', type=int),
+                                         doctor_id=request.values.get('doctor_id', type=int),
+                                         day=parse_day(request.values.get('date')))
+    except ValueError as e:
+        if request.method == 'GET' or request.accept_mimetypes.best == 'application/json':
+            return jsonify(error=str(e)), 400
+        flash(str(e), 'error')
+        return redirect(request.referrer or url_for('appointments.list_appointments'))
+
+    if request.method == 'GET':
+        return jsonify(status=status, count=count_selected(Appointment, criteria))
+    changed = set_appointment_status(status, criteria)
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(status=status, changed=changed)
+    flash(f'{changed} appointment(s) marked {status}.', 'success')
+    return redirect(request.referrer or url_for('appointments.list_appointments'))
 
 @appointments_bp.route('/add', methods=['GET', 'POST'])
 def add_appointment():
     form = AppointmentForm()
-    form.patient_id.choices = [(p.id, f"{p.first_name} {p.last_name}") for p in Patient.query.all()]
-    form.doctor_id.choices = [(d.id, f"{d.first_name} {d.last_name}") for d in Doctor.query.all()]
+    bind_choices(form.patient_id, patient_choices)
+    bind_choices(form.doctor_id, doctor_choices)
     if form.validate_on_submit():
+        conflict = slot_conflict(form.doctor_id.data, form.appointment_date.data, form.appointment_time.data, form.status.data)
+        if conflict:
+            flash(conflict, 'error')
+            return render_template('appointments/add.html', form=form)
         appointment = Appointment(
             patient_id=form.patient_id.data,
             doctor_id=form.doctor_id.data,
@@ -25,7 +114,13 @@ def add_appointment():
             notes=form.notes.data
         )
         db.session.add(appointment)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Booked by someone else since the check above
+            db.session.rollback()
+            flash('This time slot has just been booked. Please choose another.', 'error')
+            return render_template('appointments/add.html', form=form)
         flash('Appointment added successfully!', 'success')
         return redirect(url_for('appointments.list_appointments'))
     return render_template('appointments/add.html', form=form)
@@ -34,11 +129,24 @@ def add_appointment():
 def edit_appointment(id):
     appointment = Appointment.query.get_or_404(id)
     form = AppointmentForm(obj=appointment)
-    form.patient_id.choices = [(p.id, f"{p.first_name} {p.last_name}") for p in Patient.query.all()]
-    form.doctor_id.choices = [(d.id, f"{d.first_name} {d.last_name}") for d in Doctor.query.all()]
+    bind_choices(form.patient_id, patient_choices)
+    bind_choices(form.doctor_id, doctor_choices)
     if form.validate_on_submit():
+        slot = (form.doctor_id.data, form.appointment_date.data, form.appointment_time.data)
+        # Only re-check the schedule when the slot changes or a cancelled appointment is revived
+        if slot != (appointment.doctor_id, appointment.appointment_date, appointment.appointment_time) \
+                or appointment.status == 'cancelled':
+            conflict = slot_conflict(*slot, status=form.status.data, exclude_id=appointment.id)
+            if conflict:
+                flash(conflict, 'error')
+                return render_template('appointments/edit.html', form=form, appointment=appointment)
         form.populate_obj(appointment)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash('This time slot has just been booked. Please choose another.', 'error')
+            return render_template('appointments/edit.html', form=form, appointment=appointment)
         flash('Appointment updated successfully!', 'success')
         return redirect(url_for('appointments.list_appointments'))
     return render_template('appointments/edit.html', form=form, appointment=appointment)
@@ -47,17 +155,8 @@ def edit_appointment(id):
 def delete_appointment(id):
     appointment = Appointment.query.get_or_404(id)
     try:
-        # Delete related billings first (since appointment_id is NOT NULL)
-        for billing in appointment.billings:
-            db.session.delete(billing)
-
-        # Delete related eye tests (since appointment_id is NOT NULL)
-        for eye_test in appointment.eye_tests:
-            db.session.delete(eye_test)
-
-        # Delete the appointment
-        db.session.delete(appointment)
-        db.session.commit()
+        # Removes related billings and eye tests (appointment_id is NOT NULL) in the same transaction
+        delete_appointments([appointment.id])
         flash('Appointment deleted successfully!', 'success')
     except IntegrityError as e:
         db.session.rollback()
@@ -68,6 +167,7 @@ def delete_appointment(id):
     return redirect(url_for('appointments.list_appointments'))
 
 @appointments_bp.route('/view/<int:id>')
+@cached_view(Appointment, 'patient', 'doctor')
 def view_appointment(id):
     appointment = Appointment.query.get_or_404(id)
     return render_template('appointments/view.html', appointment=appointment)
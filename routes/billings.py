@@ -1,19 +1,57 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from models import db, Billing, Appointment, Patient
 from forms import BillingForm
+from services import keyset_paginate, bind_choices, patient_choices, appointment_choices, stream_query, cached_view, billing_selection, count_selected, parse_day, set_billing_status
+from sqlalchemy.orm import joinedload
 
 billings_bp = Blueprint('billings', __name__)
 
 @billings_bp.route('/')
 def list_billings():
-    billings = Billing.query.all()
-    return render_template('billings/list.html', billings=billings)
+    query = Billing.query.options(joinedload(Billing.patient))
+    billings = keyset_paginate(query, [Billing.created_at, Billing.id])
+    return render_template('billings/list.html', billings=billings, page=billings)
+
+@billings_bp.route('/export')
+def export_billings():
+    # ?format=csv|ndjson, ?gzip=1
+    statement = (db.select(
+                     *Billing.__table__.columns,
+                     (Patient.first_name + ' ' + Patient.last_name).label('patient_name'))
+                 .join(Patient, Billing.patient_id == Patient.id)
+                 .order_by(Billing.id))
+    return stream_query('billings', statement)
+
+@billings_bp.route('/status', methods=['GET', 'POST'])
+def bulk_status():
+    # ?status=paid|cancelled&ids= (repeated, e.g. checkboxes), plus payment_date=YYYY-MM-DD and payment_method for paid;
+    # GET previews how many pending billings would change, POST changes them in one UPDATE
+    status = request.values.get('status')
+    payment_method = (request.values.get('payment_method') or '').strip()
+    try:
+        payment_date = parse_day(request.values.get('payment_date'), 'payment date')
+        if len(payment_method) > 50:
+            raise ValueError('Payment method must be at most 50 characters.')
+        criteria = billing_selection(status, request.values.getlist('ids', type=int))
+    except ValueError as e:
+        if request.method == 'GET' or request.accept_mimetypes.best == 'application/json':
+            return jsonify(error=str(e)), 400
+        flash(str(e), 'error')
+        return redirect(request.referrer or url_for('billings.list_billings'))
+
+    if request.method == 'GET':
+        return jsonify(status=status, count=count_selected(Billing, criteria))
+    changed = set_billing_status(status, criteria, payment_date=payment_date, payment_method=payment_method)
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(status=status, changed=changed)
+    flash(f'{changed} billing record(s) marked {status}.', 'success')
+    return redirect(request.referrer or url_for('billings.list_billings'))
 
 @billings_bp.route('/add', methods=['GET', 'POST'])
 def add_billing():
     form = BillingForm()
-    form.appointment_id.choices = [(0, 'No Appointment')] + [(a.id, f"Appointment {a.id} - {a.patient.first_name} {a.patient.last_name}") for a in Appointment.query.all()]
-    form.patient_id.choices = [(p.id, f"{p.first_name} {p.last_name}") for p in Patient.query.all()]
+    bind_choices(form.appointment_id, appointment_choices, blank=(0, 'No Appointment'))
+    bind_choices(form.patient_id, patient_choices)
     if form.validate_on_submit():
         billing = Billing(
             appointment_id=form.appointment_id.data if form.appointment_id.data != 0 else None,
@@ -34,8 +72,8 @@ def add_billing():
 def edit_billing(id):
     billing = Billing.query.get_or_404(id)
     form = BillingForm(obj=billing)
-    form.appointment_id.choices = [(0, 'No Appointment')] + [(a.id, f"Appointment {a.id} - {a.patient.first_name} {a.patient.last_name}") for a in Appointment.query.all()]
-    form.patient_id.choices = [(p.id, f"{p.first_name} {p.last_name}") for p in Patient.query.all()]
+    bind_choices(form.appointment_id, appointment_choices, blank=(0, 'No Appointment'))
+    bind_choices(form.patient_id, patient_choices)
     if form.validate_on_submit():
         billing.appointment_id = form.appointment_id.data if form.appointment_id.data != 0 else None
         billing.patient_id = form.patient_id.data
@@ -58,6 +96,7 @@ def delete_billing(id):
     return redirect(url_for('billings.list_billings'))
 
 @billings_bp.route('/view/<int:id>')
+@cached_view(Billing, 'patient')
 def view_billing(id):
     billing = Billing.query.get_or_404(id)
     return render_template('billings/view.html', billing=billing)
@@ -1,5 +1,6 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from models import db, Doctor
+from services import keyset_paginate, doctor_choices, delete_doctors, cached_view
 from forms import DoctorForm
 from sqlalchemy.exc import IntegrityError
 
@@ -7,8 +8,12 @@ doctors_bp = Blueprint('doctors', __name__)
 
 @doctors_bp.route('/')
 def list_doctors():
-    doctors = Doctor.query.all()
-    return render_template('doctors/list.html', doctors=doctors)
+    doctors = keyset_paginate(Doctor.query, [Doctor.created_at, Doctor.id])
+    return render_template('doctors/list.html', doctors=doctors, page=doctors)
+
+@doctors_bp.route('/lookup')
+def lookup_doctors():
+    return jsonify(results=doctor_choices.search(request.args.get('q')))
 
 @doctors_bp.route('/add', methods=['GET', 'POST'])
 def add_doctor():
@@ -52,22 +57,8 @@ def edit_doctor(id):
 def delete_doctor(id):
     doctor = Doctor.query.get_or_404(id)
     try:
-        # Delete related prescriptions first
-        for prescription in doctor.prescriptions:
-            db.session.delete(prescription)
-
-        # Delete related appointments (which will cascade to delete billings and eye_tests)
-        for appointment in doctor.appointments:
-            # Delete billings and eye_tests for each appointment
-            for billing in appointment.billings:
-                db.session.delete(billing)
-            for eye_test in appointment.eye_tests:
-                db.session.delete(eye_test)
-            db.session.delete(appointment)
-
-        # Delete the doctor
-        db.session.delete(doctor)
-        db.session.commit()
+        # Removes prescriptions, appointments and their billings/eye tests with set-based deletes
+        delete_doctors([doctor.id])
         flash('Doctor deleted successfully!', 'success')
     except IntegrityError as e:
         db.session.rollback()
@@ -78,6 +69,7 @@ def delete_doctor(id):
     return redirect(url_for('doctors.list_doctors'))
 
 @doctors_bp.route('/view/<int:id>')
+@cached_view(Doctor)
 def view_doctor(id):
     doctor = Doctor.query.get_or_404(id)
     return render_template('doctors/view.html', doctor=doctor)
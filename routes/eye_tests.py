@@ -1,26 +1,41 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from models import db, EyeTestResult, Appointment, Patient
 from forms import EyeTestResultForm
+from services import keyset_paginate, bind_choices, patient_choices, appointment_choices, stream_query, import_upload, cached_view
+from sqlalchemy.orm import joinedload
 from sqlalchemy.exc import IntegrityError
 
 eye_tests_bp = Blueprint('eye_tests', __name__)
 
 @eye_tests_bp.route('/')
 def list_eye_tests():
-    eye_tests = EyeTestResult.query.all()
-    return render_template('eye_tests/list.html', eye_tests=eye_tests)
+    query = EyeTestResult.query.options(joinedload(EyeTestResult.patient))
+    eye_tests = keyset_paginate(query, [EyeTestResult.test_date, EyeTestResult.id])
+    return render_template('eye_tests/list.html', eye_tests=eye_tests, page=eye_tests)
+
+@eye_tests_bp.route('/export')
+def export_eye_tests():
+    # ?format=csv|ndjson, ?gzip=1
+    statement = (db.select(
+                     *EyeTestResult.__table__.columns,
+                     (Patient.first_name + ' ' + Patient.last_name).label('patient_name'))
+                 .join(Patient, EyeTestResult.patient_id == Patient.id)
+                 .order_by(EyeTestResult.id))
+    return stream_query('eye_tests', statement)
+
+@eye_tests_bp.route('/import', methods=['GET', 'POST'])
+def import_eye_tests():
+    return import_upload('eye_tests', 'Eye Test Results', 'eye_tests.list_eye_tests')
 
 @eye_tests_bp.route('/add', methods=['GET', 'POST'])
 def add_eye_test():
     form = EyeTestResultForm()
-    appointments = Appointment.query.all()
-    patients = Patient.query.all()
-    form.appointment_id.choices = [(a.id, f"Appointment {a.id} - {a.patient.first_name} {a.patient.last_name}") for a in appointments]
-    form.patient_id.choices = [(p.id, f"{p.first_name} {p.last_name}") for p in patients]
+    bind_choices(form.appointment_id, appointment_choices)
+    bind_choices(form.patient_id, patient_choices)
 
-    if not appointments:
+    if not appointment_choices.labels():
         flash('No appointments available. Please create an appointment first.', 'warning')
-    if not patients:
+    if not patient_choices.labels():
         flash('No patients available. Please add a patient first.', 'warning')
 
     if form.validate_on_submit():
@@ -58,8 +73,8 @@ def add_eye_test():
 def edit_eye_test(id):
     eye_test = EyeTestResult.query.get_or_404(id)
     form = EyeTestResultForm(obj=eye_test)
-    form.appointment_id.choices = [(a.id, f"Appointment {a.id} - {a.patient.first_name} {a.patient.last_name}") for a in Appointment.query.all()]
-    form.patient_id.choices = [(p.id, f"{p.first_name} {p.last_name}") for p in Patient.query.all()]
+    bind_choices(form.appointment_id, appointment_choices)
+    bind_choices(form.patient_id, patient_choices)
     if form.validate_on_submit():
         form.populate_obj(eye_test)
         db.session.commit()
@@ -76,6 +91,7 @@ def delete_eye_test(id):
     return redirect(url_for('eye_tests.list_eye_tests'))
 
 @eye_tests_bp.route('/view/<int:id>')
+@cached_view(EyeTestResult, 'patient')
 def view_eye_test(id):
     eye_test = EyeTestResult.query.get_or_404(id)
     return render_template('eye_tests/view.html', eye_test=eye_test)
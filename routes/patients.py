@@ -1,5 +1,6 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, abort
 from models import db, Patient
+from services import keyset_paginate, patient_choices, delete_patients, stream_query, import_upload, search_patients, cached_view, patient_chart
 from forms import PatientForm
 from sqlalchemy.exc import IntegrityError
 
@@ -7,8 +8,29 @@ patients_bp = Blueprint('patients', __name__)
 
 @patients_bp.route('/')
 def list_patients():
-    patients = Patient.query.all()
-    return render_template('patients/list.html', patients=patients)
+    patients = keyset_paginate(Patient.query, [Patient.created_at, Patient.id])
+    return render_template('patients/list.html', patients=patients, page=patients)
+
+@patients_bp.route('/export')
+def export_patients():
+    # ?format=csv|ndjson, ?gzip=1
+    return stream_query('patients', db.select(*Patient.__table__.columns).order_by(Patient.id))
+
+@patients_bp.route('/import', methods=['GET', 'POST'])
+def import_patients():
+    return import_upload('patients', 'Patients', 'patients.list_patients')
+
+@patients_bp.route('/lookup')
+def lookup_patients():
+    return jsonify(results=patient_choices.search(request.args.get('q')))
+
+@patients_bp.route('/search')
+def search():
+    # ?q= matches name/email/address/history/clinical notes by word prefix and phone by any 3+ digit fragment
+    results = search_patients(request.args.get('q', ''), request.args.get('limit', 20, type=int))
+    for result in results:
+        result['url'] = url_for('patients.view_patient', id=result['id'])
+    return jsonify(results=results)
 
 @patients_bp.route('/add', methods=['GET', 'POST'])
 def add_patient():
@@ -52,22 +74,8 @@ def edit_patient(id):
 def delete_patient(id):
     patient = Patient.query.get_or_404(id)
     try:
-        # Delete related prescriptions first
-        for prescription in patient.prescriptions:
-            db.session.delete(prescription)
-
-        # Delete related appointments (which will cascade to delete billings and eye_tests)
-        for appointment in patient.appointments:
-            # Delete billings and eye_tests for each appointment
-            for billing in appointment.billings:
-                db.session.delete(billing)
-            for eye_test in appointment.eye_tests:
-                db.session.delete(eye_test)
-            db.session.delete(appointment)
-
-        # Delete the patient
-        db.session.delete(patient)
-        db.session.commit()
+        # Removes prescriptions, appointments and their billings/eye tests with set-based deletes
+        delete_patients([patient.id])
         flash('Patient deleted successfully!', 'success')
     except IntegrityError as e:
         db.session.rollback()
@@ -77,7 +85,18 @@ def delete_patient(id):
         flash('An error occurred while deleting the patient.', 'error')
     return redirect(url_for('patients.list_patients'))
 
+@patients_bp.route('/<int:id>/chart')
+def patient_chart_data(id):
+    # Columnar eye test/prescription history for the chart on the patient page
+    if db.session.get(Patient, id) is None:
+        abort(404)
+    response = jsonify(patient_chart(id))
+    response.add_etag()
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 @patients_bp.route('/view/<int:id>')
+@cached_view(Patient)
 def view_patient(id):
     patient = Patient.query.get_or_404(id)
     return render_template('patients/view.html', patient=patient)
@@ -1,26 +1,39 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from models import db, Prescription, Patient, Doctor
 from forms import PrescriptionForm
+from services import keyset_paginate, bind_choices, patient_choices, doctor_choices, stream_query, cached_view
+from sqlalchemy.orm import joinedload
 from sqlalchemy.exc import IntegrityError
 
 prescriptions_bp = Blueprint('prescriptions', __name__)
 
 @prescriptions_bp.route('/')
 def list_prescriptions():
-    prescriptions = Prescription.query.all()
-    return render_template('prescriptions/list.html', prescriptions=prescriptions)
+    query = Prescription.query.options(joinedload(Prescription.patient), joinedload(Prescription.doctor))
+    prescriptions = keyset_paginate(query, [Prescription.prescription_date, Prescription.id])
+    return render_template('prescriptions/list.html', prescriptions=prescriptions, page=prescriptions)
+
+@prescriptions_bp.route('/export')
+def export_prescriptions():
+    # ?format=csv|ndjson, ?gzip=1
+    statement = (db.select(
+                     *Prescription.__table__.columns,
+                     (Patient.first_name + ' ' + Patient.last_name).label('patient_name'),
+                     (Doctor.first_name + ' ' + Doctor.last_name).label('doctor_name'))
+                 .join(Patient, Prescription.patient_id == Patient.id)
+                 .join(Doctor, Prescription.doctor_id == Doctor.id)
+                 .order_by(Prescription.id))
+    return stream_query('prescriptions', statement)
 
 @prescriptions_bp.route('/add', methods=['GET', 'POST'])
 def add_prescription():
     form = PrescriptionForm()
-    patients = Patient.query.all()
-    doctors = Doctor.query.all()
-    form.patient_id.choices = [(p.id, f"{p.first_name} {p.last_name}") for p in patients]
-    form.doctor_id.choices = [(d.id, f"{d.first_name} {d.last_name}") for d in doctors]
+    bind_choices(form.patient_id, patient_choices)
+    bind_choices(form.doctor_id, doctor_choices)
 
-    if not patients:
+    if not patient_choices.labels():
         flash('No patients available. Please add a patient first.', 'warning')
-    if not doctors:
+    if not doctor_choices.labels():
         flash('No doctors available. Please add a doctor first.', 'warning')
 
     if form.validate_on_submit():
@@ -61,8 +74,8 @@ def add_prescription():
 def edit_prescription(id):
     prescription = Prescription.query.get_or_404(id)
     form = PrescriptionForm(obj=prescription)
-    form.patient_id.choices = [(p.id, f"{p.first_name} {p.last_name}") for p in Patient.query.all()]
-    form.doctor_id.choices = [(d.id, f"{d.first_name} {d.last_name}") for d in Doctor.query.all()]
+    bind_choices(form.patient_id, patient_choices)
+    bind_choices(form.doctor_id, doctor_choices)
     if form.validate_on_submit():
         form.populate_obj(prescription)
         db.session.commit()
@@ -79,6 +92,7 @@ def delete_prescription(id):
     return redirect(url_for('prescriptions.list_prescriptions'))
 
 @prescriptions_bp.route('/view/<int:id>')
+@cached_view(Prescription, 'patient', 'doctor')
 def view_prescription(id):
     prescription = Prescription.query.get_or_404(id)
     return render_template('prescriptions/view.html', prescription=prescription)
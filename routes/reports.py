@@ -1,134 +1,95 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
-from models import db, Report, Patient, Doctor, Appointment, Billing
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
+from models import db, Report
 from forms import ReportForm
+from services import keyset_paginate, bind_choices, patient_choices, doctor_choices, report_types, request_report, report_data, report_sections, report_workers, stream_rows
+from sqlalchemy.orm import defer, load_only
 import json
-from datetime import datetime
 
 reports_bp = Blueprint('reports', __name__)
 
 @reports_bp.route('/')
 def index():
     form = ReportForm()
-    form.patient_id.choices = [(0, 'All Patients')] + [(p.id, f"{p.first_name} {p.last_name}") for p in Patient.query.all()]
-    form.doctor_id.choices = [(0, 'All Doctors')] + [(d.id, f"{d.first_name} {d.last_name}") for d in Doctor.query.all()]
+    bind_choices(form.patient_id, patient_choices, blank=(0, 'All Patients'))
+    bind_choices(form.doctor_id, doctor_choices, blank=(0, 'All Doctors'))
+    # Report types with optional dependencies are only offered when installed
+    form.report_type.choices = [c for c in form.report_type.choices if c[0] in report_types()]
     return render_template('reports/index.html', form=form)
 
 @reports_bp.route('/generate', methods=['GET', 'POST'])
 def generate_report():
     form = ReportForm()
-    form.patient_id.choices = [(0, 'All Patients')] + [(p.id, f"{p.first_name} {p.last_name}") for p in Patient.query.all()]
-    form.doctor_id.choices = [(0, 'All Doctors')] + [(d.id, f"{d.first_name} {d.last_name}") for d in Doctor.query.all()]
+    bind_choices(form.patient_id, patient_choices, blank=(0, 'All Patients'))
+    bind_choices(form.doctor_id, doctor_choices, blank=(0, 'All Doctors'))
+    # Report types with optional dependencies are only offered when installed
+    form.report_type.choices = [c for c in form.report_type.choices if c[0] in report_types()]
 
-    if request.method == 'POST':
-        print("POST request received")
-        print("Form data:", request.form)
-        if form.validate_on_submit():
-            print("Form validated successfully")
-            print("Report type:", form.report_type.data)
-            print("Start date:", form.start_date.data)
-            print("End date:", form.end_date.data)
-            print("Patient ID:", form.patient_id.data)
-            print("Doctor ID:", form.doctor_id.data)
-            report_data = {}
+    if form.validate_on_submit():
+        params = {
+            'start_date': form.start_date.data,
+            'end_date': form.end_date.data,
+            'patient_id': form.patient_id.data if form.patient_id.data != 0 else None,
+            'doctor_id': form.doctor_id.data if form.doctor_id.data != 0 else None
+        }
+        # Queued for the report workers unless the stored report for these parameters is current
+        report, reused = request_report(form.report_type.data, params,
+                                        generated_by='System User')  # In a real app, this would be the current user
 
-            if form.report_type.data == 'patient_history':
-                patient_id = form.patient_id.data if form.patient_id.data != 0 else None
-                query = Patient.query
-                if patient_id:
-                    query = query.filter_by(id=patient_id)
-                patients = query.all()
-                report_data = {
-                    'patients': [
-                        {
-                            'id': p.id,
-                            'name': f"{p.first_name} {p.last_name}",
-                            'appointments': len(p.appointments),
-                            'prescriptions': len(p.prescriptions),
-                            'billings': len(p.billings)
-                        } for p in patients
-                    ]
-                }
-
-            elif form.report_type.data == 'appointment_summary':
-                start_date = form.start_date.data
-                end_date = form.end_date.data
-                query = Appointment.query
-                if start_date:
-                    query = query.filter(Appointment.appointment_date >= start_date)
-                if end_date:
-                    query = query.filter(Appointment.appointment_date <= end_date)
-                appointments = query.all()
-                report_data = {
-                    'total_appointments': len(appointments),
-                    'scheduled': len([a for a in appointments if a.status == 'scheduled']),
-                    'completed': len([a for a in appointments if a.status == 'completed']),
-                    'cancelled': len([a for a in appointments if a.status == 'cancelled'])
-                }
-
-            elif form.report_type.data == 'billing_summary':
-                start_date = form.start_date.data
-                end_date = form.end_date.data
-                query = Billing.query
-                if start_date:
-                    query = query.filter(Billing.created_at >= start_date)
-                if end_date:
-                    query = query.filter(Billing.created_at <= end_date)
-                billings = query.all()
-                total_amount = sum(b.amount for b in billings if b.status == 'paid')
-                report_data = {
-                    'total_billings': len(billings),
-                    'paid': len([b for b in billings if b.status == 'paid']),
-                    'pending': len([b for b in billings if b.status == 'pending']),
-                    'total_amount': total_amount
-                }
-
-            elif form.report_type.data == 'doctor_performance':
-                doctors = Doctor.query.all()
-                report_data = {
-                    'doctors': [
-                        {
-                            'id': d.id,
-                            'name': f"{d.first_name} {d.last_name}",
-                            'appointments': len(d.appointments),
-                            'prescriptions': len(d.prescriptions)
-                        } for d in doctors
-                    ]
-                }
-
-            # Save report to database
-            report = Report(
-                report_type=form.report_type.data,
-                generated_by='System User',  # In a real app, this would be the current user
-                parameters=json.dumps({
-                    'start_date': str(form.start_date.data) if form.start_date.data else None,
-                    'end_date': str(form.end_date.data) if form.end_date.data else None,
-                    'patient_id': form.patient_id.data if form.patient_id.data != 0 else None,
-                    'doctor_id': form.doctor_id.data if form.doctor_id.data != 0 else None
-                }),
-                data=json.dumps(report_data)
-            )
-            db.session.add(report)
-            db.session.commit()
-
-            flash('Report generated successfully!', 'success')
-            return redirect(url_for('reports.view_report', id=report.id))
+        if not reused:
+            flash('Report queued; it will appear here when ready.', 'success')
+        elif report.status == 'done':
+            flash('No changes since this report was generated; showing the saved report.', 'info')
         else:
-            print("Form validation failed")
-            print("Form errors:", form.errors)
+            flash('This report is already being generated.', 'info')
+        return redirect(url_for('reports.view_report', id=report.id))
 
     return render_template('reports/generate.html', form=form)
 
 @reports_bp.route('/view/<int:id>')
 def view_report(id):
     report = Report.query.get_or_404(id)
-    data = json.loads(report.data)
+    if report.status in ('pending', 'running'):
+        # Resumes jobs left queued by a restart
+        report_workers.start(current_app._get_current_object())
+    data = report_data(report)
     parameters = json.loads(report.parameters)
     return render_template('reports/view.html', report=report, data=data, parameters=parameters)
 
+@reports_bp.route('/view/<int:id>/status')
+def report_status(id):
+    report = Report.query.options(
+        load_only(Report.status, Report.progress, Report.duration, Report.error)
+    ).get_or_404(id)
+    return jsonify(status=report.status, progress=report.progress,
+                   duration=report.duration, error=report.error)
+
+@reports_bp.route('/view/<int:id>/export')
+def export_report(id):
+    report = Report.query.get_or_404(id)
+    data = report_data(report)
+    if data is None:
+        flash('This report is still being generated.', 'warning')
+        return redirect(url_for('reports.view_report', id=id))
+    sections = report_sections(data)
+    if len(sections) == 1:
+        # Per-row reports and plain summaries export as one table
+        rows = sections[0][1]
+    else:
+        # Several tables (e.g. clinical analytics) go in one file, each row tagged with its section;
+        # a row's own 'section' value is kept as 'section_value'
+        rows = [{'section': name, **{'section_value' if key == 'section' else key: value for key, value in row.items()}}
+                for name, section_rows in sections for row in section_rows]
+    # Rows may omit keys (e.g. statistics of an empty group), so take the union in order
+    header = list(dict.fromkeys(key for row in rows for key in row))
+    return stream_rows(f"report-{report.id}-{report.report_type}", header,
+                       ([row.get(key) for key in header] for row in rows))
+
 @reports_bp.route('/list')
 def list_reports():
-    reports = Report.query.order_by(Report.generated_at.desc()).all()
-    return render_template('reports/list.html', reports=reports)
+    # The list never shows report data, so leave the blobs unloaded
+    reports = keyset_paginate(Report.query.options(defer(Report.data), defer(Report.data_gz)),
+                              [Report.generated_at, Report.id])
+    return render_template('reports/list.html', reports=reports, page=reports)
 
 @reports_bp.route('/delete/<int:id>', methods=['POST'])
 def delete_report(id):
@@ -0,0 +1,35 @@
+from importlib.util import find_spec
+
+# Imported eagerly: most of these modules register mapper and session hooks, report builders or
+# column backfills on import, which have to be in place before the first write or `flask create-db`,
+# and create_app's commands and blueprints use nearly all of them anyway. Together they add about
+# 20 ms to startup; slow optional dependencies load on first use instead (numpy, below).
+from models import Patient, Appointment, EyeTestResult, Prescription
+from .pagination import KeysetPage, keyset_paginate
+from .choices import bind_choices, patient_choices, doctor_choices, appointment_choices
+from .reports import report_builder, lazy_report_builder, build_report, report_types, report_data, report_sections
+from .stats import dashboard_stats, reconcile_stats, reconcile_stats_command
+from .activity import feed as activity_feed, describe
+from .indexes import create_indexes, check_query_plans, create_indexes_command, check_query_plans_command
+from .deletion import delete_patients, delete_doctors, delete_appointments, purge_inactive_patients, purge_patients_command
+from .engine import database_uri, engine_options, install_sqlite_pragmas, install_fork_safety, DEFAULT_SQLITE_PRAGMAS
+from .export import stream_rows, stream_query
+from .imports import import_csv, import_upload, import_csv_command
+from .scheduling import slot_index, slot_conflict, set_working_hours_command
+from .search import install_search, search_patients, rebuild_search_index_command
+from .schema import add_missing_columns, create_database, create_db_command
+from .cache import response_cache, cached_view
+from .charts import patient_chart, snellen_to_logmar, backfill_logmar_command
+from .jobs import request_report, report_workers, report_worker_command
+from .rollups import billing_totals, install_billing_rollups, rebuild_billing_rollups_command
+from .metrics import metrics, install_metrics
+from .api import Fetch as ApiFetch
+from .checkin import today_queue
+from .transitions import (appointment_selection, billing_selection, count_selected, parse_day,
+                          set_appointment_status, set_billing_status)
+from .templating import format_currency, format_date, install_templates, compile_templates, compile_templates_command
+
+if find_spec('numpy') is not None:
+    # numpy takes longer to import than the rest of the app, so analytics loads on its first report
+    lazy_report_builder('clinical_analytics', '.analytics',
+                        sources=(EyeTestResult, Prescription, Patient, Appointment))
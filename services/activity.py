@@ -0,0 +1,175 @@
+import threading
+import time
+from collections import deque
+
+from flask import current_app, url_for
+from sqlalchemy import event, literal, null, select, union_all
+from sqlalchemy.orm import Session, object_session
+
+from models import db, Patient, Appointment, Billing
+
+DEFAULT_FEED_SIZE = 50
+DEFAULT_REFRESH_INTERVAL = 60
+
+
+def _branch(kind, model, amount):
+    query = select(
+        literal(kind).label('type'),
+        model.id.label('id'),
+        model.created_at.label('date'),
+        Patient.first_name,
+        Patient.last_name,
+        amount.label('amount')
+    )
+    if model is not Patient:
+        query = query.join(Patient, model.patient_id == Patient.id)
+    return query.order_by(model.created_at.desc())
+
+
+def load_recent(limit):
+    # Each branch is limited on its own so SQLite can stop after ``limit`` rows per table
+    branches = [
+        _branch('appointment', Appointment, null()),
+        _branch('billing', Billing, Billing.amount),
+        _branch('patient', Patient, null())
+    ]
+    subqueries = [select(b.limit(limit).subquery()) for b in branches]
+    feed = union_all(*subqueries).subquery()
+    query = select(feed).order_by(feed.c.date.desc()).limit(limit)
+    return [dict(row._mapping) for row in db.session.execute(query)]
+
+
+class ActivityFeed:
+    """Ring buffer of the newest create events across patients, appointments and billings.
+
+    Commits made by this process are appended as they happen; the buffer is
+    reloaded from the database every ACTIVITY_REFRESH_INTERVAL seconds to pick
+    up writes from other workers.
+    """
+
+    def __init__(self):
+        self._events = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def _size(self):
+        return current_app.config.get('ACTIVITY_FEED_SIZE', DEFAULT_FEED_SIZE)
+
+    def _ensure_loaded(self):
+        interval = current_app.config.get('ACTIVITY_REFRESH_INTERVAL', DEFAULT_REFRESH_INTERVAL)
+        if self._events is not None and time.monotonic() - self._loaded_at < interval:
+            return
+        size = self._size()
+        events = load_recent(size)
+        with self._lock:
+            self._events = deque(reversed(events), maxlen=size)
+            self._loaded_at = time.monotonic()
+
+    def push(self, events):
+        with self._lock:
+            if self._events is not None:
+                self._events.extend(sorted(events, key=lambda e: e['date']))
+
+    def invalidate(self):
+        with self._lock:
+            self._events = None
+
+    def discard(self, keys):
+        with self._lock:
+            if self._events is not None:
+                kept = [e for e in self._events if (e['type'], e['id']) not in keys]
+                self._events = deque(kept, maxlen=self._events.maxlen)
+
+    def recent(self, limit=None, since=None):
+        self._ensure_loaded()
+        with self._lock:
+            events = sorted(self._events, key=lambda e: e['date'], reverse=True)
+        if since is not None:
+            events = [e for e in events if e['date'] > since]
+        return events[:limit] if limit else events
+
+
+feed = ActivityFeed()
+
+
+def _record(kind, patient_name, amount=None):
+    def after_insert(mapper, connection, target):
+        session = object_session(target)
+        if session is None:
+            return
+        first_name, last_name = patient_name(connection, target)
+        session.info.setdefault('pending_activity', []).append({
+            'type': kind,
+            'id': target.id,
+            'date': target.created_at,
+            'first_name': first_name,
+            'last_name': last_name,
+            'amount': amount(target) if amount else None
+        })
+    return after_insert
+
+
+def _own_name(connection, target):
+    return target.first_name, target.last_name
+
+
+def _patient_name(connection, target):
+    if 'patient' in target.__dict__ and target.patient is not None:
+        return target.patient.first_name, target.patient.last_name
+    row = connection.execute(
+        select(Patient.first_name, Patient.last_name).where(Patient.id == target.patient_id)
+    ).first()
+    return tuple(row) if row else ('', '')
+
+
+def _forget(kind):
+    def after_delete(mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault('deleted_activity', set()).add((kind, target.id))
+    return after_delete
+
+
+for _kind, _model, _name, _amount in [
+    ('patient', Patient, _own_name, None),
+    ('appointment', Appointment, _patient_name, None),
+    ('billing', Billing, _patient_name, lambda b: b.amount)
+]:
+    event.listen(_model, 'after_insert', _record(_kind, _name, _amount))
+    event.listen(_model, 'after_delete', _forget(_kind))
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish(session):
+    events = session.info.pop('pending_activity', None)
+    if events:
+        feed.push(events)
+    deleted = session.info.pop('deleted_activity', None)
+    if deleted:
+        feed.discard(deleted)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard(session):
+    session.info.pop('pending_activity', None)
+    session.info.pop('deleted_activity', None)
+
+
+def describe(activity):
+    """Render a feed entry the way the dashboard displays it."""
+    name = f"{activity['first_name']} {activity['last_name']}"
+    if activity['type'] == 'appointment':
+        description = f"Appointment scheduled for {name}"
+        url = url_for('appointments.view_appointment', id=activity['id'])
+    elif activity['type'] == 'billing':
+        description = f"Billing created for {name} - ${activity['amount']}"
+        url = url_for('billings.view_billing', id=activity['id'])
+    else:
+        description = f"New patient registered: {name}"
+        url = url_for('patients.view_patient', id=activity['id'])
+    return {
+        'type': activity['type'],
+        'description': description,
+        'date': activity['date'],
+        'url': url
+    }
@@ -0,0 +1,205 @@
+import numpy as np
+from sqlalchemy import String, cast, select
+
+from models import db, Patient, Appointment, EyeTestResult, Prescription
+from .reports import report_builder
+
+FETCH_PARTITION = 100000
+IOP_THRESHOLD = 21.0  # mmHg; ocular hypertension screening cut-off
+AGE_BANDS = [(0, 18), (18, 40), (40, 60), (60, 75), (75, 200)]
+PERCENTILES = [5, 25, 50, 75, 95]
+SPHERE_RANGE, SPHERE_STEP = (-20.0, 20.0), 0.5
+CYLINDER_RANGE, CYLINDER_STEP = (-8.0, 8.0), 0.25
+
+
+def fetch_columns(statement, kinds):
+    """Run ``statement`` and return ``{column name: ndarray}``.
+
+    ``kinds`` gives each selected column's array type: ``'float'`` (NULL
+    becomes NaN), ``'int'`` or ``'date'`` (ISO strings to datetime64[D],
+    NULL becomes NaT). Rows come straight from the DBAPI cursor, skipping
+    SQLAlchemy's per-row Row construction, and each partition is converted
+    with one 2-D object array rather than per-value Python work.
+    """
+    names = [column.name for column in statement.selected_columns]
+    dtypes = {'float': np.float64, 'int': np.int64, 'date': 'datetime64[D]'}
+    chunks = {name: [] for name in names}
+    connection = db.session.connection()
+    # Parameters are dates and ids taken from the validated report form
+    sql = str(statement.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True}))
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(sql)
+        while True:
+            rows = cursor.fetchmany(FETCH_PARTITION)
+            if not rows:
+                break
+            block = np.array(rows, dtype=object)
+            for i, name in enumerate(names):
+                chunks[name].append(np.array(block[:, i], dtype=dtypes[kinds[name]]))
+    finally:
+        cursor.close()
+    return {name: np.concatenate(parts) if parts else np.array([], dtype=dtypes[kinds[name]])
+            for name, parts in chunks.items()}
+
+
+def _summary(values):
+    values = values[~np.isnan(values)]
+    if not values.size:
+        return {'n': 0}
+    return {
+        'n': int(values.size),
+        'mean': round(float(values.mean()), 2),
+        'std': round(float(values.std()), 2),
+        **{f'p{q}': value for q, value in zip(PERCENTILES, np.round(np.percentile(values, PERCENTILES), 2).tolist())}
+    }
+
+
+def _histogram(values, value_range, step):
+    values = values[~np.isnan(values)]
+    edges = np.arange(value_range[0], value_range[1] + step, step)
+    # Out-of-range values land in the end bins rather than being dropped
+    counts, edges = np.histogram(np.clip(values, value_range[0], value_range[1]), bins=edges)
+    nonzero = np.flatnonzero(counts)
+    if not nonzero.size:
+        return {'edges': [], 'counts': []}
+    lo, hi = nonzero[0], nonzero[-1] + 1
+    return {'edges': edges[lo:hi + 1].tolist(), 'counts': counts[lo:hi].tolist()}
+
+
+def _date_filters(query, column, params):
+    if params.get('start_date'):
+        query = query.where(column >= params['start_date'])
+    if params.get('end_date'):
+        query = query.where(column <= params['end_date'])
+    return query
+
+
+def _eye_tests(params):
+    query = select(EyeTestResult.patient_id,
+                   cast(EyeTestResult.test_date, String).label('test_date'),
+                   EyeTestResult.intraocular_pressure_left.label('iop_left'),
+                   EyeTestResult.intraocular_pressure_right.label('iop_right'))
+    query = _date_filters(query, EyeTestResult.test_date, params)
+    if params.get('patient_id'):
+        query = query.where(EyeTestResult.patient_id == params['patient_id'])
+    if params.get('doctor_id'):
+        query = (query.join(Appointment, EyeTestResult.appointment_id == Appointment.id)
+                 .where(Appointment.doctor_id == params['doctor_id']))
+    tests = fetch_columns(query, {'patient_id': 'int', 'test_date': 'date', 'iop_left': 'float', 'iop_right': 'float'})
+    tests['date_of_birth'] = _birth_dates(params)[tests['patient_id']]
+    return tests
+
+
+def _birth_dates(params):
+    """Date of birth indexed by patient id (NaT for gaps).
+
+    Far fewer patients than tests, so one pass over patients plus an array
+    lookup is much cheaper than joining every test row to its patient.
+    """
+    query = select(Patient.id, cast(Patient.date_of_birth, String).label('date_of_birth'))
+    if params.get('patient_id'):
+        query = query.where(Patient.id == params['patient_id'])
+    patients = fetch_columns(query, {'id': 'int', 'date_of_birth': 'date'})
+    lookup = np.full(int(patients['id'].max(initial=0)) + 1, np.datetime64('NaT'), dtype='datetime64[D]')
+    lookup[patients['id']] = patients['date_of_birth']
+    return lookup
+
+
+def _prescriptions(params):
+    query = select(Prescription.patient_id,
+                   cast(Prescription.prescription_date, String).label('prescription_date'),
+                   Prescription.sphere_left, Prescription.sphere_right,
+                   Prescription.cylinder_left, Prescription.cylinder_right)
+    query = _date_filters(query, Prescription.prescription_date, params)
+    if params.get('patient_id'):
+        query = query.where(Prescription.patient_id == params['patient_id'])
+    if params.get('doctor_id'):
+        query = query.where(Prescription.doctor_id == params['doctor_id'])
+    return fetch_columns(query, {'patient_id': 'int', 'prescription_date': 'date',
+                                 'sphere_left': 'float', 'sphere_right': 'float',
+                                 'cylinder_left': 'float', 'cylinder_right': 'float'})
+
+
+def _iop_statistics(tests):
+    # Dividing timedeltas (rather than casting) turns NaT into NaN
+    age = (tests['test_date'] - tests['date_of_birth']) / np.timedelta64(1, 'D') / 365.25
+    # Both eyes pooled: one value per eye per test
+    iop = np.concatenate([tests['iop_left'], tests['iop_right']])
+    eye_age = np.concatenate([age, age])
+
+    bands = []
+    for low, high in AGE_BANDS:
+        in_band = iop[(eye_age >= low) & (eye_age < high)]
+        band = {'age_band': f'{low}+' if high >= 200 else f'{low}-{high - 1}'}
+        band.update(_summary(in_band))
+        measured = in_band[~np.isnan(in_band)]
+        band['fraction_above_threshold'] = round(float((measured > IOP_THRESHOLD).mean()), 4) if measured.size else None
+        bands.append(band)
+
+    # A patient is flagged if any eye on any test in range measured above the threshold
+    highest = np.fmax(tests['iop_left'], tests['iop_right'])
+    measured = ~np.isnan(highest)
+    patients = np.unique(tests['patient_id'][measured])
+    flagged = np.unique(tests['patient_id'][measured & (highest > IOP_THRESHOLD)])
+    return bands, {
+        'patients_measured': int(patients.size),
+        'patients_above_threshold': int(flagged.size),
+        'fraction_above_threshold': round(flagged.size / patients.size, 4) if patients.size else None,
+        'threshold_mmhg': IOP_THRESHOLD
+    }
+
+
+def _refraction_drift(rx):
+    """Per-patient least-squares slope of spherical equivalent (D/year), summarised over patients."""
+    # Spherical equivalent, averaged over the eyes recorded on each prescription
+    se = np.stack([rx['sphere_left'] + np.nan_to_num(rx['cylinder_left']) / 2,
+                   rx['sphere_right'] + np.nan_to_num(rx['cylinder_right']) / 2])
+    counted = (~np.isnan(se)).sum(axis=0)
+    keep = counted > 0
+    se = np.nansum(se[:, keep], axis=0) / counted[keep]
+    patient = rx['patient_id'][keep]
+    years = (rx['prescription_date'][keep] - np.datetime64('1970-01-01')) / np.timedelta64(1, 'D') / 365.25
+    if not patient.size:
+        return {'patients': 0}
+
+    order = np.argsort(patient, kind='stable')
+    patient, years, se = patient[order], years[order], se[order]
+    starts = np.flatnonzero(np.r_[True, patient[1:] != patient[:-1]])
+    n = np.diff(np.r_[starts, patient.size]).astype(np.float64)
+    # With time centred per patient the least-squares slope is sum(t*y) / sum(t*t)
+    years = years - np.repeat(np.add.reduceat(years, starts) / n, n.astype(np.int64))
+    sum_tt = np.add.reduceat(years * years, starts)
+    sum_ty = np.add.reduceat(years * se, starts)
+    usable = (n >= 2) & (sum_tt > 0)
+    slopes = sum_ty[usable] / sum_tt[usable]
+
+    drift = {'patients': int(usable.sum())}
+    drift.update({key: value for key, value in _summary(slopes).items() if key != 'n'})
+    if slopes.size:
+        drift['fraction_myopic_progression'] = round(float((slopes <= -0.5).mean()), 4)
+    return drift
+
+
+@report_builder('clinical_analytics', sources=(EyeTestResult, Prescription, Patient, Appointment))
+def clinical_analytics(params):
+    """IOP by age band, ocular hypertension prevalence, refraction histograms and drift.
+
+    Rows are fetched as plain tuples in partitions and turned into one NumPy
+    array per column; every aggregate after that is vectorized.
+    """
+    tests = _eye_tests(params)
+    rx = _prescriptions(params)
+    iop_by_age, ocular_hypertension = _iop_statistics(tests)
+    sphere = np.concatenate([rx['sphere_left'], rx['sphere_right']])
+    cylinder = np.concatenate([rx['cylinder_left'], rx['cylinder_right']])
+    return {
+        # First list in the report, so it is what the CSV export writes
+        'iop_by_age': iop_by_age,
+        'eye_tests': int(tests['patient_id'].size),
+        'prescriptions': int(rx['patient_id'].size),
+        'ocular_hypertension': ocular_hypertension,
+        'sphere_histogram': _histogram(sphere, SPHERE_RANGE, SPHERE_STEP),
+        'cylinder_histogram': _histogram(cylinder, CYLINDER_RANGE, CYLINDER_STEP),
+        'refraction_drift': _refraction_drift(rx)
+    }
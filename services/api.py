@@ -0,0 +1,187 @@
+from datetime import date, datetime, time
+
+from sqlalchemy import inspect, select
+
+from models import db, Patient, Doctor, Appointment, EyeTestResult, Prescription, Billing
+from .pagination import decode_cursor, encode_cursor, get_per_page
+
+MAX_IDS = 200
+
+# API name of each model, and the columns that may be filtered on with ?column=value
+RESOURCES = {
+    'patients': (Patient, ('gender',)),
+    'doctors': (Doctor, ('specialty',)),
+    'appointments': (Appointment, ('patient_id', 'doctor_id', 'appointment_date', 'status')),
+    'eye_tests': (EyeTestResult, ('patient_id', 'appointment_id', 'test_date')),
+    'prescriptions': (Prescription, ('patient_id', 'doctor_id', 'prescription_date')),
+    'billings': (Billing, ('patient_id', 'appointment_id', 'status')),
+}
+_MODELS = {model for model, _ in RESOURCES.values()}
+
+
+def _isoformat(value):
+    return value.isoformat()
+
+
+def _converter(column):
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return None
+    return _isoformat if python_type in (date, datetime, time) else None
+
+
+def _includes(model):
+    """``{name: (target model, local column, remote column, many)}`` from the model's relationships."""
+    includes = {}
+    for relationship in inspect(model).relationships:
+        target = relationship.mapper.class_
+        if target not in _MODELS or len(relationship.local_remote_pairs) != 1:
+            continue
+        (local, remote), = relationship.local_remote_pairs
+        includes[relationship.key] = (target, local, remote, relationship.uselist)
+    return includes
+
+
+def _split(value):
+    return [part.strip() for part in value.split(',') if part.strip()] if value else []
+
+
+def _fields(table, requested, label):
+    columns = table.columns
+    names = _split(requested) or list(columns.keys())
+    unknown = [name for name in names if name not in columns]
+    if unknown:
+        raise ValueError(f"Unknown field(s) for {label}: {', '.join(unknown)}")
+    # The id is always returned; cursors and included rows are keyed on it
+    if 'id' not in names:
+        names.insert(0, 'id')
+    return [columns[name] for name in names]
+
+
+def _parse(column, value):
+    try:
+        python_type = column.type.python_type
+        if python_type in (date, datetime, time):
+            return python_type.fromisoformat(value)
+        return python_type(value)
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid value for {column.name}: {value}")
+
+
+def _plan(columns, start=0):
+    return [(column.name, start + i, _converter(column)) for i, column in enumerate(columns)]
+
+
+def _as_dict(row, plan):
+    return {key: convert(row[i]) if convert and row[i] is not None else row[i] for key, i, convert in plan}
+
+
+class Fetch:
+    """One API read: the resource's columns, joined to-one includes and batched to-many ones.
+
+    Rows come back as Core tuples and are turned into dicts with a
+    precomputed ``(key, position, converter)`` plan, so no ORM objects are
+    built and only date/time values need converting for JSON.
+    """
+
+    def __init__(self, resource, args):
+        if resource not in RESOURCES:
+            raise LookupError(resource)
+        model, self.filters = RESOURCES[resource]
+        self.table = model.__table__
+        includes = _includes(model)
+        names = _split(args.get('include'))
+        unknown = [name for name in names if name not in includes]
+        if unknown:
+            raise ValueError(f"Unknown include(s) for {resource}: {', '.join(unknown)}; "
+                             f"available: {', '.join(sorted(includes))}")
+
+        columns = _fields(self.table, args.get('fields'), resource)
+        self.plan = _plan(columns)
+        selected = list(columns)
+        self.joins = []  # (name, plan) of to-one includes
+        self.batches = []  # (name, local column, remote column, columns) of to-many includes
+        source = self.table
+        for name in names:
+            target, local, remote, many = includes[name]
+            target_columns = _fields(target.__table__, args.get(f'fields[{name}]'), name)
+            if many:
+                # Keyed on the parent's id, which is always selected
+                self.batches.append((name, local, remote, target_columns))
+                continue
+            # To-one includes come back in the same query through a LEFT JOIN
+            alias = target.__table__.alias(f'include_{name}')
+            self.joins.append((name, _plan(target_columns, len(selected))))
+            selected.extend(alias.c[column.name] for column in target_columns)
+            source = source.outerjoin(alias, alias.c[remote.name] == local)
+        self.statement = select(*selected).select_from(source)
+
+    def _dicts(self, rows):
+        plan, joins = self.plan, self.joins
+        items = []
+        for row in rows:
+            item = _as_dict(row, plan)
+            for name, join_plan in joins:
+                # The joined id (always first) is NULL when there is no related row
+                item[name] = None if row[join_plan[0][1]] is None else _as_dict(row, join_plan)
+            items.append(item)
+        return items
+
+    def _load_batches(self, items):
+        # One IN query per to-many include, whatever the number of parent rows
+        for name, local, remote, target_columns in self.batches:
+            keys = {item[local.name] for item in items if item[local.name] is not None}
+            for item in items:
+                item[name] = []
+            if not keys:
+                continue
+            target = remote.table
+            selected = list(target_columns)
+            if remote not in selected:
+                selected.append(remote)
+            plan = _plan(target_columns)
+            position = selected.index(remote)
+            children = {}
+            rows = db.session.execute(select(*selected).where(remote.in_(keys)).order_by(remote, target.c.id))
+            for row in rows:
+                children.setdefault(row[position], []).append(_as_dict(row, plan))
+            for item in items:
+                item[name] = children.get(item[local.name], [])
+        return items
+
+    def _run(self, statement):
+        return self._load_batches(self._dicts(db.session.execute(statement)))
+
+    def one(self, id):
+        items = self._run(self.statement.where(self.table.c.id == id))
+        return items[0] if items else None
+
+    def by_ids(self, text):
+        try:
+            ids = [int(part) for part in _split(text)]
+        except ValueError:
+            raise ValueError("ids must be comma-separated integers")
+        if len(ids) > MAX_IDS:
+            raise ValueError(f"At most {MAX_IDS} ids per request")
+        found = {item['id']: item for item in self._run(self.statement.where(self.table.c.id.in_(ids)))}
+        # In the order asked for; unknown ids are listed rather than failing the batch
+        return {'data': [found[id] for id in dict.fromkeys(ids) if id in found],
+                'missing': [id for id in dict.fromkeys(ids) if id not in found]}
+
+    def page(self, args):
+        """Rows in id order after the ``after`` cursor, filtered by ``?column=value``."""
+        statement = self.statement
+        for name in self.filters:
+            if args.get(name):
+                column = self.table.c[name]
+                statement = statement.where(column == _parse(column, args[name]))
+        if args.get('after'):
+            values = decode_cursor(args['after'], [self.table.c.id])
+            if values is None:
+                raise ValueError("Invalid cursor")
+            statement = statement.where(self.table.c.id > values[0])
+        per_page = get_per_page()
+        items = self._dicts(db.session.execute(statement.order_by(self.table.c.id).limit(per_page + 1)))
+        next_cursor = encode_cursor([items[per_page - 1]['id']]) if len(items) > per_page else None
+        return {'data': self._load_batches(items[:per_page]), 'next_cursor': next_cursor}
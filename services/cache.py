@@ -0,0 +1,170 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import timezone
+from functools import wraps
+
+from flask import abort, current_app, make_response, request, session
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, configure_mappers
+
+from models import db
+
+DEFAULT_SIZE = 1000
+
+
+class ResponseCache:
+    """LRU of rendered detail pages, one entry per ``(table name, id)``.
+
+    Each entry remembers the ``updated_at`` values it was rendered from;
+    a lookup whose current values differ is a miss, so a change committed
+    by another worker process is never served stale. Entries for rows
+    updated or deleted through the ORM are also evicted on commit.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.not_modified = self.evictions = 0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, body):
+        size = current_app.config.get('RESPONSE_CACHE_SIZE', DEFAULT_SIZE)
+        with self._lock:
+            self._entries[key] = (version, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+    def count_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def evict(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None
+            }
+
+
+response_cache = ResponseCache()
+
+_cached_models = set()
+
+
+def _queue_eviction(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('evict_responses', set()).add((target.__tablename__, target.id))
+
+
+@event.listens_for(Session, 'after_commit')
+def _evict_committed(session):
+    for key in session.info.pop('evict_responses', ()):
+        response_cache.evict(key)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_evictions(session):
+    session.info.pop('evict_responses', None)
+
+
+def _version_query(model, related):
+    query = select(model.updated_at).select_from(model)
+    for relationship in related:
+        target = relationship.property.mapper.class_
+        query = query.outerjoin(relationship).add_columns(target.updated_at)
+    return query
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified is not None:
+        # HTTP dates have whole-second precision; updated_at is naive UTC
+        return request.if_modified_since >= last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+    return False
+
+
+def cached_view(model, *related):
+    """Serve a ``view_*(id)`` page from ``response_cache`` with ETag/Last-Modified.
+
+    The version is the ``updated_at`` of the ``model`` row plus the rows
+    reached through the ``related`` relationship names (e.g. the patient whose name
+    the page shows), read with one primary key query. Responses carry
+    ``Cache-Control: no-cache`` so browsers revalidate and get a 304 while
+    the version is unchanged.
+    """
+    def decorator(view):
+        version_query = []
+
+        @wraps(view)
+        def wrapper(id):
+            if not version_query:
+                # Built on first use: backref relationships only exist once the mappers are configured,
+                # which a detail page hit before any other query would not have done yet
+                configure_mappers()
+                version_query.append(_version_query(model, [getattr(model, name) for name in related]))
+            key = (model.__tablename__, id)
+            versions = db.session.execute(version_query[0].where(model.id == id)).first()
+            if versions is None:
+                response_cache.evict(key)
+                abort(404)
+            versions = tuple(versions)
+            etag = hashlib.sha1(f'{key}:{versions}'.encode()).hexdigest()[:20]
+            modified = [v for v in versions if v is not None]
+            # Pending flash messages are rendered into the page, so bypass the cache
+            use_cache = current_app.config.get('RESPONSE_CACHE_SIZE', DEFAULT_SIZE) > 0 and '_flashes' not in session
+
+            if use_cache and _not_modified(etag, max(modified) if modified else None):
+                # The browser's copy is current: skip the cache lookup and rendering altogether
+                response_cache.count_not_modified()
+                response = make_response('', 304)
+            else:
+                body = response_cache.get(key, versions) if use_cache else None
+                if body is None:
+                    response = make_response(view(id))
+                    if response.status_code != 200:
+                        return response
+                    if use_cache:
+                        response_cache.put(key, versions, response.get_data())
+                else:
+                    response = make_response(body)
+
+            response.set_etag(etag)
+            if modified:
+                response.last_modified = max(modified)
+            response.cache_control.no_cache = True
+            response.cache_control.private = True
+            return response
+
+        if model not in _cached_models:
+            _cached_models.add(model)
+            event.listen(model, 'after_update', _queue_eviction)
+            event.listen(model, 'after_delete', _queue_eviction)
+        return wrapper
+    return decorator
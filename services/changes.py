@@ -0,0 +1,81 @@
+from itertools import chain
+
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.orm import Session
+
+from models import TableVersion
+
+# Callbacks invoked with the set of model classes touched by a committed transaction
+_subscribers = []
+
+
+def subscribe(callback):
+    _subscribers.append(callback)
+    return callback
+
+
+def mark_changed(session, *models):
+    # For raw SQL that bypasses both the unit of work and ORM-enabled bulk statements
+    session.info.setdefault('changed_models', set()).update(models)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_flushed(session, flush_context):
+    changed = {type(obj) for obj in chain(session.new, session.dirty, session.deleted)}
+    if changed:
+        mark_changed(session, *changed)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk(orm_execute_state):
+    # Set-based insert/update/delete statements never reach after_flush
+    state = orm_execute_state
+    if not (state.is_insert or state.is_update or state.is_delete):
+        return
+    if state.bind_mapper is not None:
+        mark_changed(state.session, state.bind_mapper.class_)
+
+
+def table_versions(connection, *models):
+    """``{table name: change counter}`` for the tables of ``models``; 0 for never-changed tables."""
+    names = sorted({model.__tablename__ for model in models})
+    versions = dict.fromkeys(names, 0)
+    versions.update(connection.execute(
+        select(TableVersion.table_name, TableVersion.version).where(TableVersion.table_name.in_(names))
+    ).all())
+    return versions
+
+
+def _bump_versions(connection, names):
+    table = TableVersion.__table__
+    bumped = connection.execute(
+        update(table).where(table.c.table_name.in_(names)).values(version=table.c.version + 1)
+    ).rowcount
+    if bumped < len(names):
+        existing = set(connection.execute(select(table.c.table_name).where(table.c.table_name.in_(names))).scalars())
+        connection.execute(insert(table), [{'table_name': name, 'version': 1} for name in names if name not in existing])
+
+
+@event.listens_for(Session, 'before_commit')
+def _count_changes(session):
+    # Flush first so pending objects are counted; the bump commits atomically with the changes,
+    # which lets every worker process tell whether data it derived from a table is still current
+    session.flush()
+    changed = session.info.get('changed_models')
+    if changed:
+        names = sorted({model.__tablename__ for model in changed if model is not TableVersion})
+        if names:
+            _bump_versions(session.connection(), names)
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish(session):
+    changed = session.info.pop('changed_models', None)
+    if changed:
+        for callback in _subscribers:
+            callback(changed)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard(session):
+    session.info.pop('changed_models', None)
@@ -0,0 +1,138 @@
+import math
+import re
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, event, literal, null, select, union_all, update
+
+from models import db, EyeTestResult, Prescription
+from .schema import register_backfill
+
+# Conventional logMAR values for vision below the chart
+LOW_VISION = {
+    'CF': 1.9,  # counting fingers
+    'HM': 2.3,  # hand motion
+    'LP': 2.7,  # light perception
+    'PL': 2.7,
+    'NLP': 3.0,  # no light perception
+    'NPL': 3.0
+}
+
+_SNELLEN = re.compile(r'^(\d+(?:\.\d+)?)\s*/\s*(\d+(?:\.\d+)?)\s*(?:([+-])\s*(\d+))?$')
+_DECIMAL = re.compile(r'^\d*\.\d+$|^[01]$')
+LETTER_LOGMAR = 0.02  # each letter on a 5-letter logMAR line
+
+
+def snellen_to_logmar(value):
+    """logMAR for a recorded acuity: Snellen (``20/40``, ``6/9``, ``20/40-2``), decimal (``0.5``) or CF/HM/LP/NLP.
+
+    Returns None for blanks and anything unrecognised.
+    """
+    if not value:
+        return None
+    value = value.strip().upper()
+    if value in LOW_VISION:
+        return LOW_VISION[value]
+    match = _SNELLEN.match(value)
+    if match:
+        distance, size, sign, letters = match.groups()
+        if float(distance) == 0 or float(size) == 0:
+            return None
+        logmar = math.log10(float(size) / float(distance))
+        if letters:
+            # 20/40-2: two letters of the line missed; 20/40+1: one letter of the next read
+            logmar += int(letters) * LETTER_LOGMAR * (1 if sign == '-' else -1)
+        return round(logmar, 2)
+    if _DECIMAL.match(value) and float(value) > 0:
+        return round(math.log10(1 / float(value)), 2)
+    return None
+
+
+@event.listens_for(EyeTestResult, 'before_insert')
+@event.listens_for(EyeTestResult, 'before_update')
+def _set_logmar(mapper, connection, target):
+    target.logmar_left = snellen_to_logmar(target.visual_acuity_left)
+    target.logmar_right = snellen_to_logmar(target.visual_acuity_right)
+
+
+def backfill_logmar(connection):
+    """Fill logmar_left/right for existing eye tests; returns the number of rows updated.
+
+    ``updated_at`` is kept as it was: the values are derived, not an edit.
+    """
+    table = EyeTestResult.__table__
+    rows = connection.execute(
+        select(table.c.id, table.c.visual_acuity_left, table.c.visual_acuity_right)
+        .where((table.c.visual_acuity_left.isnot(None)) | (table.c.visual_acuity_right.isnot(None)))
+    ).all()
+    if rows:
+        connection.execute(
+            update(table).where(table.c.id == bindparam('row_id')).values(updated_at=table.c.updated_at),
+            [{'row_id': row.id,
+              'logmar_left': snellen_to_logmar(row.visual_acuity_left),
+              'logmar_right': snellen_to_logmar(row.visual_acuity_right)} for row in rows]
+        )
+    return len(rows)
+
+
+# Runs once logmar_right, the later of the two columns, has been added
+register_backfill('eye_test_result', 'logmar_right', backfill_logmar)
+
+
+EYE_TEST_SERIES = ['id', 'date', 'acuity_left', 'acuity_right', 'logmar_left', 'logmar_right', 'iop_left', 'iop_right']
+PRESCRIPTION_SERIES = ['id', 'date', 'sphere_left', 'cylinder_left', 'axis_left',
+                       'sphere_right', 'cylinder_right', 'axis_right', 'duration_months']
+
+
+def _chart_query(patient_id):
+    # Both histories in one statement; each branch is a range scan of its (patient_id, date) index.
+    # Columns are labelled so the NULL padding is not collapsed into a single column.
+    eye_test_columns = [
+        EyeTestResult.visual_acuity_left, EyeTestResult.visual_acuity_right,
+        EyeTestResult.logmar_left, EyeTestResult.logmar_right,
+        EyeTestResult.intraocular_pressure_left, EyeTestResult.intraocular_pressure_right
+    ]
+    prescription_columns = [
+        Prescription.sphere_left, Prescription.cylinder_left, Prescription.axis_left,
+        Prescription.sphere_right, Prescription.cylinder_right, Prescription.axis_right,
+        Prescription.duration_months
+    ]
+    eye_tests = select(
+        literal('eye_test').label('kind'), EyeTestResult.id.label('id'), EyeTestResult.test_date.label('date'),
+        *[column.label(name) for column, name in zip(eye_test_columns, EYE_TEST_SERIES[2:])],
+        *[null().label(name) for name in PRESCRIPTION_SERIES[2:]]
+    ).where(EyeTestResult.patient_id == patient_id)
+    prescriptions = select(
+        literal('prescription'), Prescription.id, Prescription.prescription_date,
+        *[null().label(name) for name in EYE_TEST_SERIES[2:]],
+        *[column.label(name) for column, name in zip(prescription_columns, PRESCRIPTION_SERIES[2:])]
+    ).where(Prescription.patient_id == patient_id)
+    combined = union_all(eye_tests, prescriptions).subquery()
+    return select(combined).order_by(combined.c.date, combined.c.id)
+
+
+def patient_chart(patient_id):
+    """Eye test and prescription history of one patient as columnar series.
+
+    Each series is a dict of equal-length arrays in date order, e.g.
+    ``{'date': [...], 'iop_left': [...], ...}``, which is what client-side
+    plotting libraries take and much smaller than a list of objects.
+    """
+    eye_tests = {name: [] for name in EYE_TEST_SERIES}
+    prescriptions = {name: [] for name in PRESCRIPTION_SERIES}
+    for row in db.session.execute(_chart_query(patient_id)).mappings():
+        series = eye_tests if row['kind'] == 'eye_test' else prescriptions
+        for name, values in series.items():
+            values.append(row[name])
+    for series in (eye_tests, prescriptions):
+        series['date'] = [day.isoformat() for day in series['date']]
+    return {'patient_id': patient_id, 'eye_tests': eye_tests, 'prescriptions': prescriptions}
+
+
+@click.command('backfill-logmar')
+@with_appcontext
+def backfill_logmar_command():
+    """Recompute the cached logMAR columns from the recorded visual acuity strings."""
+    with db.engine.begin() as connection:
+        count = backfill_logmar(connection)
+    click.echo(f"Updated {count} eye test(s).")
@@ -0,0 +1,277 @@
+import json
+import queue
+import threading
+import time
+from datetime import date
+
+from flask import current_app
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, aliased, object_session
+
+from models import db, Patient, Doctor, Appointment
+from .changes import table_versions
+
+DEFAULT_POLL_INTERVAL = 2
+DEFAULT_KEEPALIVE = 15
+DEFAULT_BACKLOG = 100
+
+# Tables whose rows appear on the board; a change counter bump on any of them means another process wrote
+WATCHED = (Appointment, Patient, Doctor)
+
+
+def _entry(row):
+    return {
+        'id': row.id,
+        'doctor_id': row.doctor_id,
+        'doctor': f'{row.doctor_first_name} {row.doctor_last_name}',
+        'patient': f'{row.patient_first_name} {row.patient_last_name}',
+        'time': row.appointment_time.strftime('%H:%M'),
+        'status': row.status
+    }
+
+
+def _names():
+    doctor = aliased(Doctor)
+    patient = aliased(Patient)
+    return select(
+        Appointment.id, Appointment.doctor_id, Appointment.appointment_date, Appointment.appointment_time,
+        Appointment.status,
+        doctor.first_name.label('doctor_first_name'), doctor.last_name.label('doctor_last_name'),
+        patient.first_name.label('patient_first_name'), patient.last_name.label('patient_last_name')
+    ).join(doctor, Appointment.doctor_id == doctor.id).join(patient, Appointment.patient_id == patient.id)
+
+
+def load_day(connection, day):
+    """``{doctor_id: {appointment id: entry}}`` for every appointment on ``day``."""
+    doctors = {}
+    for row in connection.execute(_names().where(Appointment.appointment_date == day)):
+        doctors.setdefault(row.doctor_id, {})[row.id] = _entry(row)
+    return doctors
+
+
+class TodayQueue:
+    """Today's appointments by doctor, with pub/sub of changes for the check-in board.
+
+    Commits made by this process are applied and published as they happen
+    (see the mapper hooks below). Every QUEUE_POLL_INTERVAL seconds one
+    waiting stream compares the table change counters, and if another
+    process wrote, reloads the day and publishes the difference; the same
+    reload handles the day rolling over.
+
+    Each listener gets a bounded queue of diffs. A screen that falls
+    QUEUE_BACKLOG diffs behind is sent a fresh snapshot instead.
+    """
+
+    def __init__(self):
+        self._day = None
+        self._doctors = None
+        self._versions = None
+        self._version = 0
+        self._checked_at = 0
+        self._listeners = set()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def _reload(self):
+        # Its own short-lived connection, so a stream never holds a read transaction open
+        with db.engine.connect() as connection:
+            day = date.today()
+            versions = table_versions(connection, *WATCHED)
+            doctors = load_day(connection, day)
+        with self._lock:
+            if self._doctors is None:
+                self._day, self._doctors, self._versions = day, doctors, versions
+                return
+            old = {entry['id']: entry for entries in self._doctors.values() for entry in entries.values()}
+            new = {entry['id']: entry for entries in doctors.values() for entry in entries.values()}
+            self._day, self._doctors, self._versions = day, doctors, versions
+            self._publish([entry for id, entry in new.items() if old.get(id) != entry],
+                          [id for id in old if id not in new])
+
+    def _ensure_loaded(self):
+        if self._doctors is not None:
+            return
+        with self._load_lock:
+            if self._doctors is None:
+                self._reload()
+                self._checked_at = time.monotonic()
+
+    def poll(self):
+        """Reload if the day changed or another process wrote; cheap when called often."""
+        self._ensure_loaded()
+        interval = current_app.config.get('QUEUE_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)
+        if time.monotonic() - self._checked_at < interval or not self._load_lock.acquire(blocking=False):
+            return
+        try:
+            self._checked_at = time.monotonic()
+            if date.today() != self._day:
+                self._reload()
+                return
+            with db.engine.connect() as connection:
+                versions = table_versions(connection, *WATCHED)
+            if versions != self._versions:
+                self._reload()
+        finally:
+            self._load_lock.release()
+
+    def expire(self):
+        # Next poll reloads and publishes whatever changed
+        self._versions = None
+        self._checked_at = 0
+
+    def snapshot(self, doctor_id=None):
+        self._ensure_loaded()
+        with self._lock:
+            doctors = {id: sorted(entries.values(), key=lambda e: (e['time'], e['id']))
+                       for id, entries in self._doctors.items() if doctor_id in (None, id)}
+            return {'version': self._version, 'day': self._day.isoformat(), 'doctors': doctors}
+
+    def has(self, id):
+        with self._lock:
+            return self._doctors is not None and any(id in entries for entries in self._doctors.values())
+
+    def apply(self, upserted, removed):
+        """Record committed changes, ``(day, entry)`` pairs and deleted ids, and publish them."""
+        with self._lock:
+            if self._doctors is None:
+                return
+            index = {id: doctor_id for doctor_id, entries in self._doctors.items() for id in entries}
+            changed, gone = [], []
+            for id in removed:
+                if id in index:
+                    del self._doctors[index.pop(id)][id]
+                    gone.append(id)
+            for entry_day, entry in upserted:
+                id = entry['id']
+                previous = self._doctors[index[id]].pop(id) if id in index else None
+                if entry_day == self._day:
+                    self._doctors.setdefault(entry['doctor_id'], {})[id] = entry
+                    if entry != previous:
+                        changed.append(entry)
+                elif previous is not None:
+                    gone.append(id)
+            self._publish(changed, gone)
+
+    def _publish(self, changed, removed):
+        # Called with self._lock held
+        if not changed and not removed:
+            return
+        self._version += 1
+        diff = {'version': self._version, 'day': self._day.isoformat(), 'changed': changed, 'removed': removed}
+        # Encoded once for every unfiltered screen
+        message = (diff, _event('diff', diff))
+        for listener in self._listeners:
+            try:
+                listener.put_nowait(message)
+            except queue.Full:
+                # Too far behind to catch up with diffs; the stream resends a snapshot
+                listener.lagging = True
+
+    def listen(self):
+        listener = queue.Queue(maxsize=current_app.config.get('QUEUE_BACKLOG', DEFAULT_BACKLOG))
+        listener.lagging = False
+        with self._lock:
+            self._listeners.add(listener)
+        return listener
+
+    def unlisten(self, listener):
+        with self._lock:
+            self._listeners.discard(listener)
+
+    def stream(self, doctor_id=None):
+        """Server-sent events: a ``snapshot``, then a ``diff`` for each change, filtered to ``doctor_id`` if given."""
+        listener = self.listen()
+        keepalive = current_app.config.get('QUEUE_KEEPALIVE', DEFAULT_KEEPALIVE)
+        interval = current_app.config.get('QUEUE_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)
+        try:
+            snapshot = self.snapshot(doctor_id)
+            yield _event('snapshot', snapshot)
+            version = snapshot['version']
+            written = time.monotonic()
+            while True:
+                try:
+                    diff, encoded = listener.get(timeout=min(interval, keepalive))
+                except queue.Empty:
+                    diff = None
+                if listener.lagging:
+                    with listener.mutex:
+                        listener.queue.clear()
+                    listener.lagging = False
+                    snapshot = self.snapshot(doctor_id)
+                    version = snapshot['version']
+                    yield _event('snapshot', snapshot)
+                    written = time.monotonic()
+                    continue
+                if diff is not None and diff['version'] > version:
+                    version = diff['version']
+                    if doctor_id is not None:
+                        # An appointment moved to another doctor leaves this screen
+                        diff = dict(diff, changed=[e for e in diff['changed'] if e['doctor_id'] == doctor_id],
+                                    removed=diff['removed'] + [e['id'] for e in diff['changed'] if e['doctor_id'] != doctor_id])
+                        encoded = _event('diff', diff)
+                    yield encoded
+                    written = time.monotonic()
+                elif time.monotonic() - written >= keepalive:
+                    # Comment line; keeps proxies from closing an idle connection
+                    yield ': keepalive\n\n'
+                    written = time.monotonic()
+                self.poll()
+        finally:
+            self.unlisten(listener)
+
+def _event(kind, data):
+    return f"event: {kind}\nid: {data['version']}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+today_queue = TodayQueue()
+
+
+def _pending(target):
+    session = object_session(target)
+    return session.info.setdefault('pending_queue', ([], set())) if session is not None else None
+
+
+def _record(mapper, connection, target):
+    pending = _pending(target)
+    if pending is None or today_queue._doctors is None:
+        return
+    if target.appointment_date != today_queue._day and not today_queue.has(target.id):
+        return
+    row = connection.execute(_names().where(Appointment.id == target.id)).first()
+    if row is not None:
+        pending[0].append((row.appointment_date, _entry(row)))
+
+
+def _forget(mapper, connection, target):
+    pending = _pending(target)
+    if pending is not None:
+        pending[1].add(target.id)
+
+
+event.listen(Appointment, 'after_insert', _record)
+event.listen(Appointment, 'after_update', _record)
+event.listen(Appointment, 'after_delete', _forget)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk(orm_execute_state):
+    # Set-based statements skip the mapper hooks; the next poll reloads instead
+    state = orm_execute_state
+    if (state.is_update or state.is_delete) and state.bind_mapper is not None \
+            and state.bind_mapper.class_ in WATCHED:
+        state.session.info['queue_expired'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish(session):
+    pending = session.info.pop('pending_queue', None)
+    if pending and (pending[0] or pending[1]):
+        today_queue.apply(*pending)
+    if session.info.pop('queue_expired', None):
+        today_queue.expire()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard(session):
+    session.info.pop('pending_queue', None)
+    session.info.pop('queue_expired', None)
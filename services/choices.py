@@ -0,0 +1,119 @@
+import threading
+import time
+
+from flask import current_app, url_for
+from wtforms.validators import AnyOf
+
+from models import db, Patient, Doctor, Appointment
+from .changes import subscribe
+
+DEFAULT_TTL = 300
+DEFAULT_INLINE_LIMIT = 500
+LOOKUP_LIMIT = 20
+
+
+class ChoiceProvider:
+    """In-process cache of ``(id, label)`` pairs for a SelectField.
+
+    Only the columns needed for the label are selected. The cache is dropped
+    whenever a transaction touching one of ``depends_on`` commits, and a TTL
+    bounds staleness for changes committed by other worker processes.
+    """
+
+    def __init__(self, name, build_query, format_label, depends_on, lookup_endpoint):
+        self.name = name
+        self.build_query = build_query
+        self.format_label = format_label
+        self.depends_on = set(depends_on)
+        self.lookup_endpoint = lookup_endpoint
+        self._labels = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def labels(self):
+        ttl = current_app.config.get('CHOICES_CACHE_TTL', DEFAULT_TTL)
+        labels = self._labels
+        if labels is not None and time.monotonic() - self._loaded_at < ttl:
+            return labels
+        with self._lock:
+            if self._labels is None or time.monotonic() - self._loaded_at >= ttl:
+                rows = db.session.execute(self.build_query())
+                self._labels = {row[0]: self.format_label(row) for row in rows}
+                self._loaded_at = time.monotonic()
+            return self._labels
+
+    def choices(self):
+        return list(self.labels().items())
+
+    def search(self, term, limit=LOOKUP_LIMIT):
+        term = (term or '').strip().lower()
+        results = []
+        for id, label in self.labels().items():
+            if not term or term == str(id) or term in label.lower():
+                results.append({'id': id, 'text': label})
+                if len(results) >= limit:
+                    break
+        return results
+
+    def invalidate(self):
+        with self._lock:
+            self._labels = None
+
+
+patient_choices = ChoiceProvider(
+    'patients',
+    lambda: db.select(Patient.id, Patient.first_name, Patient.last_name).order_by(Patient.id),
+    lambda row: f"{row.first_name} {row.last_name}",
+    [Patient],
+    'patients.lookup_patients'
+)
+
+doctor_choices = ChoiceProvider(
+    'doctors',
+    lambda: db.select(Doctor.id, Doctor.first_name, Doctor.last_name).order_by(Doctor.id),
+    lambda row: f"{row.first_name} {row.last_name}",
+    [Doctor],
+    'doctors.lookup_doctors'
+)
+
+appointment_choices = ChoiceProvider(
+    'appointments',
+    lambda: db.select(Appointment.id, Patient.first_name, Patient.last_name)
+                .join(Patient, Appointment.patient_id == Patient.id)
+                .order_by(Appointment.id),
+    lambda row: f"Appointment {row.id} - {row.first_name} {row.last_name}",
+    [Appointment, Patient],
+    'appointments.lookup_appointments'
+)
+
+PROVIDERS = [patient_choices, doctor_choices, appointment_choices]
+
+
+@subscribe
+def _invalidate_changed(changed_models):
+    for provider in PROVIDERS:
+        if provider.depends_on & changed_models:
+            provider.invalidate()
+
+
+def bind_choices(field, provider, blank=None):
+    """Populate ``field.choices`` from ``provider``.
+
+    Small lists are inlined as ``<option>`` elements. Past
+    ``CHOICES_INLINE_LIMIT`` only the current selection is rendered and the
+    select is tagged with a ``data-lookup-url`` for the typeahead, while
+    validation still checks the submitted id against the cached labels.
+    """
+    labels = provider.labels()
+    prefix = [blank] if blank else []
+    limit = current_app.config.get('CHOICES_INLINE_LIMIT', DEFAULT_INLINE_LIMIT)
+    if len(labels) <= limit:
+        field.choices = prefix + list(labels.items())
+        return
+
+    selected = [(field.data, labels[field.data])] if field.data in labels else []
+    field.choices = prefix + selected
+    field.validate_choice = False
+    allowed = set(labels) | ({blank[0]} if blank else set())
+    field.validators = list(field.validators) + [AnyOf(allowed, message='Not a valid choice.')]
+    field.render_kw = dict(field.render_kw or {}, **{'data-lookup-url': url_for(provider.lookup_endpoint)})
@@ -0,0 +1,137 @@
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, select
+
+from models import db, Patient, Doctor, Appointment, EyeTestResult, Prescription, Billing, WorkingHours
+from .activity import feed as activity_feed
+from .rollups import subtract_billings
+from .stats import adjust_stats, counter_key
+
+# Keeps IN (...) lists under SQLite's bound parameter limit
+PURGE_BATCH_SIZE = 500
+
+
+def _delete(model, *criteria):
+    result = db.session.execute(
+        delete(model).where(*criteria).execution_options(synchronize_session=False)
+    )
+    key = counter_key(model)
+    if key and result.rowcount:
+        adjust_stats(**{key: -result.rowcount})
+    return result.rowcount
+
+
+def _delete_billings(*criteria):
+    # The rollups and revenue are adjusted in the same transaction, so they never disagree with the billings
+    subtract_billings(*criteria)
+    paid = db.session.scalar(select(func.sum(Billing.amount)).where(Billing.status == 'paid', *criteria))
+    if paid:
+        adjust_stats(revenue=-paid)
+    return _delete(Billing, *criteria)
+
+
+def _after_bulk_delete():
+    # Set-based deletes bypass the mapper hooks that maintain the feed
+    activity_feed.invalidate()
+
+
+def _delete_appointment_children(appointment_ids):
+    return {
+        'billings': _delete_billings(Billing.appointment_id.in_(appointment_ids)),
+        'eye_tests': _delete(EyeTestResult, EyeTestResult.appointment_id.in_(appointment_ids))
+    }
+
+
+def delete_patients(ids, commit=True):
+    """Delete patients and everything that hangs off them in a fixed number of statements.
+
+    Children are removed explicitly rather than relying on ON DELETE
+    CASCADE, so databases created before the cascades were declared (or
+    connections without foreign key enforcement) are handled the same way.
+    Returns the number of rows removed per table.
+    """
+    ids = list(ids)
+    appointment_ids = select(Appointment.id).where(Appointment.patient_id.in_(ids)).scalar_subquery()
+    counts = _delete_appointment_children(appointment_ids)
+    counts['billings'] += _delete_billings(Billing.patient_id.in_(ids))
+    counts['eye_tests'] += _delete(EyeTestResult, EyeTestResult.patient_id.in_(ids))
+    counts['prescriptions'] = _delete(Prescription, Prescription.patient_id.in_(ids))
+    counts['appointments'] = _delete(Appointment, Appointment.patient_id.in_(ids))
+    counts['patients'] = _delete(Patient, Patient.id.in_(ids))
+    if commit:
+        db.session.commit()
+        _after_bulk_delete()
+    return counts
+
+
+def delete_doctors(ids, commit=True):
+    """Delete doctors with their appointments (and those appointments' billings and eye tests), prescriptions and working hours."""
+    ids = list(ids)
+    appointment_ids = select(Appointment.id).where(Appointment.doctor_id.in_(ids)).scalar_subquery()
+    counts = _delete_appointment_children(appointment_ids)
+    counts['prescriptions'] = _delete(Prescription, Prescription.doctor_id.in_(ids))
+    counts['appointments'] = _delete(Appointment, Appointment.doctor_id.in_(ids))
+    counts['working_hours'] = _delete(WorkingHours, WorkingHours.doctor_id.in_(ids))
+    counts['doctors'] = _delete(Doctor, Doctor.id.in_(ids))
+    if commit:
+        db.session.commit()
+        _after_bulk_delete()
+    return counts
+
+
+def delete_appointments(ids, commit=True):
+    ids = list(ids)
+    counts = _delete_appointment_children(ids)
+    counts['appointments'] = _delete(Appointment, Appointment.id.in_(ids))
+    if commit:
+        db.session.commit()
+        _after_bulk_delete()
+    return counts
+
+
+def inactive_patient_ids(cutoff):
+    """Patients registered before ``cutoff`` with no appointment on or after it."""
+    recent = select(Appointment.id).where(
+        Appointment.patient_id == Patient.id,
+        Appointment.appointment_date >= cutoff.date()
+    ).exists()
+    return select(Patient.id).where(Patient.created_at < cutoff, ~recent).order_by(Patient.id)
+
+
+def purge_inactive_patients(cutoff, batch_size=PURGE_BATCH_SIZE):
+    """Delete inactive patients in batches, one transaction per batch.
+
+    Yields the running total after each batch so callers can report progress.
+    """
+    total = 0
+    while True:
+        ids = db.session.scalars(inactive_patient_ids(cutoff).limit(batch_size)).all()
+        if not ids:
+            break
+        delete_patients(ids, commit=False)
+        db.session.commit()
+        total += len(ids)
+        yield total
+    if total:
+        _after_bulk_delete()
+
+
+@click.command('purge-patients')
+@click.option('--before', 'cutoff', required=True, type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Purge patients with no appointment on or after this date.')
+@click.option('--batch-size', default=PURGE_BATCH_SIZE, show_default=True)
+@click.option('--dry-run', is_flag=True, help='Only report how many patients would be purged.')
+@with_appcontext
+def purge_patients_command(cutoff, batch_size, dry_run):
+    """Retention purge: delete inactive patients and all their records."""
+    if dry_run:
+        count = db.session.scalar(select(func.count()).select_from(inactive_patient_ids(cutoff).subquery()))
+        click.echo(f"{count} patient(s) would be purged.")
+        return
+    started = datetime.utcnow()
+    total = 0
+    for total in purge_inactive_patients(cutoff, batch_size):
+        click.echo(f"Purged {total} patient(s)...")
+    click.echo(f"Purged {total} patient(s) in {(datetime.utcnow() - started).total_seconds():.1f}s.")
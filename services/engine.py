@@ -0,0 +1,78 @@
+import os
+import weakref
+
+from sqlalchemy import event
+
+DEFAULT_DATABASE_URI = 'sqlite:///eye_management.db'
+
+# Applied to every new SQLite connection; set SQLITE_PRAGMAS to {} to use SQLite's defaults
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',  # readers no longer block on the writer
+    'synchronous': 'NORMAL',  # durable across application crashes, fsync only at checkpoints
+    'busy_timeout': 5000,  # ms to wait for the write lock instead of failing with "database is locked"
+    'foreign_keys': 'ON',
+    'cache_size': -65536,  # negative means KiB: 64 MiB page cache per connection
+    'mmap_size': 268435456,  # 256 MiB memory-mapped reads
+    'temp_store': 'MEMORY'
+}
+
+
+def _is_file_sqlite(uri):
+    return uri.startswith('sqlite') and ':memory:' not in uri and uri not in ('sqlite://', 'sqlite:///')
+
+
+def database_uri(environ=os.environ):
+    return environ.get('DATABASE_URL', DEFAULT_DATABASE_URI)
+
+
+def engine_options(uri, environ=os.environ):
+    """SQLALCHEMY_ENGINE_OPTIONS for ``uri``, with pool sizing overridable from the environment."""
+    if uri.startswith('sqlite'):
+        if not _is_file_sqlite(uri):
+            # In-memory databases live on a single connection; keep Flask-SQLAlchemy's defaults
+            return {}
+        return {
+            'pool_size': int(environ.get('DB_POOL_SIZE', 5)),
+            'max_overflow': int(environ.get('DB_MAX_OVERFLOW', 10)),
+            'pool_timeout': int(environ.get('DB_POOL_TIMEOUT', 30)),
+            # The lock wait is the busy_timeout pragma (SQLITE_PRAGMAS), which would override a timeout here
+            'connect_args': {'check_same_thread': False}
+        }
+    return {
+        'pool_size': int(environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True
+    }
+
+
+def install_sqlite_pragmas(engine, pragmas):
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+
+def install_fork_safety(engine):
+    """Give each forked process (gunicorn --preload workers) its own connection pool.
+
+    A connection opened before the fork would otherwise be shared by
+    every worker. ``close=False`` drops the inherited connections without
+    closing them, since they still belong to the parent.
+    """
+    ref = weakref.ref(engine)
+
+    def after_fork():
+        forked = ref()
+        if forked is not None:
+            forked.dispose(close=False)
+
+    os.register_at_fork(after_in_child=after_fork)
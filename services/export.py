@@ -0,0 +1,98 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+
+from flask import Response, abort, request, stream_with_context
+
+from models import db
+
+YIELD_PER = 1000  # rows fetched per round-trip and written per chunk
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson'
+}
+
+
+def _csv_chunks(header, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % YIELD_PER == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_chunks(header, rows):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(header, row)), default=str))
+        if len(lines) == YIELD_PER:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def _gzip(chunks):
+    # wbits=31 writes a gzip header/trailer rather than a raw zlib stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _encode(chunks):
+    for chunk in chunks:
+        yield chunk.encode()
+
+
+def stream_rows(name, header, rows):
+    """Stream ``rows`` as CSV (default) or NDJSON, gzip-compressed when ``?gzip=1``.
+
+    ``rows`` may be a lazy iterable; nothing is materialised beyond one chunk.
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in FORMATS:
+        abort(400)
+    compress = request.args.get('gzip', type=int) == 1
+
+    chunks = _csv_chunks(header, rows) if fmt == 'csv' else _ndjson_chunks(header, rows)
+    filename = f"{name}-{datetime.utcnow():%Y%m%d-%H%M%S}.{fmt}"
+    if compress:
+        body, mimetype, filename = _gzip(chunks), 'application/gzip', filename + '.gz'
+    else:
+        body, mimetype = _encode(chunks), FORMATS[fmt]
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+
+def stream_query(name, statement):
+    """Stream a Core ``select`` without building ORM objects.
+
+    ``yield_per`` makes the driver fetch in batches from a server-side
+    cursor, so memory stays flat however many rows the table has and the
+    first bytes go out as soon as the first batch is read.
+    """
+    header = [column.name for column in statement.selected_columns]
+
+    def rows():
+        result = db.session.execute(statement.execution_options(yield_per=YIELD_PER))
+        try:
+            for row in result:
+                yield tuple(row)
+        finally:
+            result.close()
+
+    return stream_rows(name, header, rows())
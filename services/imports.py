@@ -0,0 +1,285 @@
+import csv
+import io
+import sys
+import time
+
+import click
+from flask import current_app, flash, render_template, request, url_for
+from flask.cli import with_appcontext
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from werkzeug.datastructures import MultiDict
+from wtforms import Form, SelectField, SubmitField
+from wtforms.fields.core import UnboundField
+
+from forms import PatientForm, AppointmentForm, EyeTestResultForm
+from models import db, Patient, Doctor, Appointment, EyeTestResult
+from .activity import feed as activity_feed
+from .charts import snellen_to_logmar
+from .scheduling import slot_conflict
+from .stats import adjust_stats, counter_key
+
+DEFAULT_BATCH_SIZE = 1000
+TIME_FORMATS = ['%H:%M', '%H:%M:%S']  # exports write seconds, the form only accepts %H:%M
+
+
+def _row_form(form_class):
+    """A plain (request-free) wtforms Form carrying ``form_class``'s fields and validators.
+
+    One instance is reused for every row via ``process()``. Foreign key
+    selects skip the choice check; the importer resolves ids itself.
+    """
+    fields = {}
+    for name in dir(form_class):
+        attr = getattr(form_class, name)
+        if isinstance(attr, UnboundField) and attr.field_class is not SubmitField:
+            fields[name] = attr
+    form = type(form_class.__name__ + 'Row', (Form,), fields)()
+    for field in form:
+        if isinstance(field, SelectField) and field.name.endswith('_id'):
+            field.validate_choice = False
+        if field.type == 'TimeField':
+            field.format = TIME_FORMATS
+            field.strptime_format = TIME_FORMATS
+    return form
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.errors = []  # (line number, {field: [messages]})
+        self.seconds = 0.0
+
+    @property
+    def rejected(self):
+        return len(self.errors)
+
+    def reject(self, line, errors):
+        self.errors.append((line, errors))
+
+
+class Importer:
+    model = None
+    form_class = None
+
+    def load_context(self):
+        return {}
+
+    def prepare(self, row, context):
+        """Resolve natural keys in the raw row; return ``{field: [messages]}`` on failure."""
+        return {}
+
+    def resolve(self, values, context):
+        return {}
+
+
+class PatientImporter(Importer):
+    model = Patient
+    form_class = PatientForm
+
+    def load_context(self):
+        emails = db.session.scalars(select(Patient.email))
+        return {'emails': {email.lower() for email in emails}}
+
+    def resolve(self, values, context):
+        email = values['email'].lower()
+        if email in context['emails']:
+            return {'email': ['A patient with this email already exists.']}
+        context['emails'].add(email)
+        return {}
+
+
+class AppointmentImporter(Importer):
+    model = Appointment
+    form_class = AppointmentForm
+
+    def load_context(self):
+        return {
+            'patients': dict(db.session.execute(select(Patient.email, Patient.id)).all()),
+            'patient_ids': set(db.session.scalars(select(Patient.id))),
+            'doctors': dict(db.session.execute(select(Doctor.license_number, Doctor.id)).all()),
+            'doctor_ids': set(db.session.scalars(select(Doctor.id))),
+            'booked': set()  # (doctor_id, date, time) of live rows accepted so far, not yet in the slot index
+        }
+
+    def prepare(self, row, context):
+        # patient_email / doctor_license may stand in for the numeric ids
+        errors = {}
+        if not row.get('patient_id') and row.get('patient_email'):
+            patient_id = context['patients'].get(row['patient_email'])
+            if patient_id is None:
+                errors['patient_email'] = ['Unknown patient email.']
+            row['patient_id'] = str(patient_id or '')
+        if not row.get('doctor_id') and row.get('doctor_license'):
+            doctor_id = context['doctors'].get(row['doctor_license'])
+            if doctor_id is None:
+                errors['doctor_license'] = ['Unknown doctor license number.']
+            row['doctor_id'] = str(doctor_id or '')
+        return errors
+
+    def resolve(self, values, context):
+        errors = {}
+        if values['patient_id'] not in context['patient_ids']:
+            errors['patient_id'] = ['Unknown patient.']
+        if values['doctor_id'] not in context['doctor_ids']:
+            errors['doctor_id'] = ['Unknown doctor.']
+        # Stored as checked: minutes, like the form, so the slot unique index sees the same start time
+        values['appointment_time'] = values['appointment_time'].replace(second=0, microsecond=0)
+        if errors or values['status'] == 'cancelled':
+            return errors
+        # The same schedule rules as the form; start times are on the slot grid,
+        # so a row overlaps an earlier row of this import only by sharing its slot
+        slot = (values['doctor_id'], values['appointment_date'], values['appointment_time'])
+        conflict = slot_conflict(*slot, status=values['status'])
+        if conflict is None and slot in context['booked']:
+            conflict = 'An earlier row books the doctor at this time.'
+        if conflict:
+            return {'appointment_time': [conflict]}
+        context['booked'].add(slot)
+        return errors
+
+
+class EyeTestImporter(Importer):
+    model = EyeTestResult
+    form_class = EyeTestResultForm
+
+    def load_context(self):
+        return {
+            'appointments': dict(db.session.execute(select(Appointment.id, Appointment.patient_id)).all())
+        }
+
+    def prepare(self, row, context):
+        # The patient can be taken from the appointment
+        if not row.get('patient_id') and row.get('appointment_id', '').isdigit():
+            patient_id = context['appointments'].get(int(row['appointment_id']))
+            if patient_id is None:
+                return {'appointment_id': ['Unknown appointment.']}
+            row['patient_id'] = str(patient_id)
+        return {}
+
+    def resolve(self, values, context):
+        patient_id = context['appointments'].get(values['appointment_id'])
+        if patient_id is None:
+            return {'appointment_id': ['Unknown appointment.']}
+        if patient_id != values['patient_id']:
+            return {'patient_id': ['Patient does not match the appointment.']}
+        # Bulk inserts skip the ORM hook that caches these
+        values['logmar_left'] = snellen_to_logmar(values['visual_acuity_left'])
+        values['logmar_right'] = snellen_to_logmar(values['visual_acuity_right'])
+        return {}
+
+
+IMPORTERS = {
+    'patients': PatientImporter(),
+    'appointments': AppointmentImporter(),
+    'eye_tests': EyeTestImporter()
+}
+
+
+def _insert(model, batch, report):
+    # executemany inserts bypass the mapper hooks behind the dashboard counters
+    key = counter_key(model)
+    try:
+        db.session.execute(insert(model), [values for _, values in batch])
+        if key:
+            adjust_stats(**{key: len(batch)})
+        db.session.commit()
+        report.inserted += len(batch)
+    except IntegrityError:
+        # Fall back to row-at-a-time to find the offending rows
+        db.session.rollback()
+        for line, values in batch:
+            try:
+                db.session.execute(insert(model), [values])
+                if key:
+                    adjust_stats(**{key: 1})
+                db.session.commit()
+                report.inserted += 1
+            except IntegrityError as e:
+                db.session.rollback()
+                report.reject(line, {'database': [str(e.orig)]})
+
+
+def import_csv(entity, stream, batch_size=DEFAULT_BATCH_SIZE):
+    """Validate and insert the rows of a CSV text stream for ``entity``.
+
+    Rows are validated with the entity's form rules and inserted with one
+    executemany per ``batch_size`` rows, each batch in its own
+    transaction. Invalid rows are skipped and listed in the report.
+    """
+    importer = IMPORTERS[entity]
+    form = _row_form(importer.form_class)
+    columns = set(form._fields)
+    context = importer.load_context()
+    report = ImportReport()
+    started = time.perf_counter()
+
+    batch = []
+    # Line 1 is the header
+    for line, row in enumerate(csv.DictReader(stream), start=2):
+        row = {key.strip(): value.strip() for key, value in row.items() if key and value is not None}
+        errors = importer.prepare(row, context)
+        if not errors:
+            form.process(MultiDict(row))
+            if form.validate():
+                values = {name: value for name, value in form.data.items() if name in columns}
+                errors = importer.resolve(values, context)
+            else:
+                errors = form.errors
+        if errors:
+            report.reject(line, errors)
+            continue
+        batch.append((line, values))
+        if len(batch) >= batch_size:
+            _insert(importer.model, batch, report)
+            batch = []
+    if batch:
+        _insert(importer.model, batch, report)
+
+    if report.inserted:
+        # Nor does the activity feed see executemany inserts
+        activity_feed.invalidate()
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+@click.command('import-csv')
+@click.argument('entity', type=click.Choice(sorted(IMPORTERS)))
+@click.argument('source', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True)
+@click.option('--errors', 'errors_file', type=click.File('w'), help='Write rejected rows to this CSV.')
+@with_appcontext
+def import_csv_command(entity, source, batch_size, errors_file):
+    """Bulk import patients, appointments or eye_tests from a CSV file."""
+    report = import_csv(entity, source, batch_size)
+    rate = report.inserted / report.seconds if report.seconds else 0
+    click.echo(f"Inserted {report.inserted} row(s), rejected {report.rejected} in {report.seconds:.2f}s ({rate:,.0f} rows/s).")
+    if errors_file:
+        writer = csv.writer(errors_file)
+        writer.writerow(['line', 'field', 'error'])
+        for line, errors in report.errors:
+            for field, messages in errors.items():
+                for message in messages:
+                    writer.writerow([line, field, message])
+    elif report.errors:
+        for line, errors in report.errors[:20]:
+            click.echo(f"  line {line}: {errors}", err=True)
+    if report.rejected:
+        sys.exit(1)
+
+
+def import_upload(entity, title, back_endpoint):
+    """GET shows the upload form; POST imports the uploaded CSV and shows the report."""
+    report = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Please choose a CSV file to import.', 'error')
+        else:
+            stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig')
+            batch_size = current_app.config.get('IMPORT_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+            report = import_csv(entity, stream, batch_size)
+            flash(f'Imported {report.inserted} row(s); {report.rejected} row(s) rejected.',
+                  'success' if not report.rejected else 'warning')
+    return render_template('import.html', title=title, report=report, back_url=url_for(back_endpoint),
+                           columns=list(_row_form(IMPORTERS[entity].form_class)._fields))
@@ -0,0 +1,147 @@
+import re
+import sys
+from datetime import date, datetime, time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Patient, Doctor, Appointment, EyeTestResult, Prescription, Billing, Report
+from .pagination import encode_cursor
+from .reports import build_report
+
+
+def create_indexes(engine=None):
+    """Create every index declared on the models that the database lacks.
+
+    ``db.create_all()`` only adds indexes together with new tables, so
+    databases created before an index was declared need this pass. Safe to
+    run repeatedly. Returns the names created and ``(name, error)`` for
+    unique indexes the existing rows violate.
+    """
+    engine = engine or db.engine
+    inspector = inspect(engine)
+    created, failed = [], []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                try:
+                    index.create(bind=engine)
+                    created.append(index.name)
+                except IntegrityError as e:
+                    failed.append((index.name, str(e.orig)))
+    return created, failed
+
+
+def _sample_cursor(*columns):
+    # A cursor in the middle of the sort order, so list pages plan their seek predicate
+    samples = {datetime: datetime(2024, 1, 1, 9, 0), date: date(2024, 1, 1), time: time(9, 0)}
+    return encode_cursor([samples.get(c.type.python_type, 1) for c in columns])
+
+
+def _plan_checks():
+    # (label, request path or report type, tables allowed to be scanned in full)
+    everything = {'patient', 'doctor', 'appointment', 'dashboard_stat'}
+    return [
+        ('dashboard', '/', {'dashboard_stat'}),
+        ('activity feed', '/activity', set()),
+        ('patients list', '/patients/?after=' + _sample_cursor(Patient.created_at, Patient.id), set()),
+        ('doctors list', '/doctors/?after=' + _sample_cursor(Doctor.created_at, Doctor.id), set()),
+        ('appointments list', '/appointments/?after=' + _sample_cursor(
+            Appointment.appointment_date, Appointment.appointment_time, Appointment.id), set()),
+        ('eye tests list', '/eye_tests/?after=' + _sample_cursor(EyeTestResult.test_date, EyeTestResult.id), set()),
+        ('prescriptions list', '/prescriptions/?after=' + _sample_cursor(
+            Prescription.prescription_date, Prescription.id), set()),
+        ('billings list', '/billings/?after=' + _sample_cursor(Billing.created_at, Billing.id), set()),
+        ('reports list', '/reports/list?after=' + _sample_cursor(Report.generated_at, Report.id), set()),
+        ('patient view', '/patients/view/1', set()),
+        ('appointment view', '/appointments/view/1', set()),
+        ('billing view', '/billings/view/1', set()),
+        ('eye test view', '/eye_tests/view/1', set()),
+        ('prescription view', '/prescriptions/view/1', set()),
+        ('doctor view', '/doctors/view/1', set()),
+        ('availability', '/appointments/availability?doctor_id=1&date=2024-01-01', set()),
+        # Dropdown choices deliberately list every patient/doctor/appointment
+        ('add appointment form', '/appointments/add', everything),
+        ('add billing form', '/billings/add', everything),
+        ('report form', '/reports/', everything),
+        ('appointment summary', ('appointment_summary', {'start_date': date(2024, 1, 1), 'end_date': date(2024, 12, 31)}), set()),
+        ('billing summary', ('billing_summary', {'start_date': date(2024, 1, 1), 'end_date': date(2024, 12, 31)}), set()),
+        # These reports list every patient/doctor; the per-row counts must still be indexed
+        ('patient history', ('patient_history', {}), {'patient'}),
+        ('doctor performance', ('doctor_performance', {}), {'doctor'}),
+    ]
+
+
+_FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+
+
+def check_query_plans(app):
+    """Run the main routes and report builders, EXPLAIN every SELECT they issue.
+
+    Returns ``(label, sql, plan line)`` for each full table scan that is not
+    explicitly allowed for that route.
+    """
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            captured.append((statement, parameters))
+
+    client = app.test_client()
+    failures = []
+    for label, target, allowed in _plan_checks():
+        captured.clear()
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            if isinstance(target, tuple):
+                build_report(*target)
+            else:
+                client.get(target)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+
+        with db.engine.connect() as connection:
+            for statement, parameters in list(captured):
+                plan = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)
+                for row in plan:
+                    match = _FULL_SCAN.match(row[3])
+                    # Subqueries and CTEs (anon_1, ...) show up as scans too; only base tables count
+                    if match and match.group(1) in db.metadata.tables and match.group(1) not in allowed:
+                        failures.append((label, statement, row[3]))
+    return failures
+
+
+@click.command('create-indexes')
+@with_appcontext
+def create_indexes_command():
+    """Build any declared indexes missing from an existing database."""
+    created, failed = create_indexes()
+    for name in created:
+        click.echo(f"Created {name}")
+    click.echo(f"{len(created)} index(es) created.")
+    for name, error in failed:
+        # e.g. double-booked appointments predating uq_appointment_doctor_slot
+        click.echo(f"Could not create {name}: {error}. Resolve the duplicate rows and run again.", err=True)
+    if failed:
+        sys.exit(1)
+
+
+@click.command('check-query-plans')
+@with_appcontext
+def check_query_plans_command():
+    """Fail if a route query plans a full table scan (SQLite only)."""
+    if db.engine.dialect.name != 'sqlite':
+        click.echo("EXPLAIN QUERY PLAN checks only run against SQLite.")
+        return
+    failures = check_query_plans(current_app._get_current_object())
+    for label, statement, line in failures:
+        click.echo(f"{label}: {line}\n    {' '.join(statement.split())}")
+    if failures:
+        sys.exit(1)
+    click.echo("All checked queries use an index.")
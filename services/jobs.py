@@ -0,0 +1,233 @@
+import json
+import os
+import threading
+import time
+import zlib
+from datetime import date, datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import defer
+
+from models import db, Report
+from .changes import table_versions
+from .reports import build_report, params_hash, report_sources
+from .schema import register_backfill
+
+DEFAULT_WORKERS = 2
+DEFAULT_POLL_INTERVAL = 2.0
+DEFAULT_JOB_TIMEOUT = 3600
+PROGRESS_INTERVAL = 0.5  # seconds between progress writes of one job
+
+# Reports stored before the job queue existed are complete
+register_backfill('report', 'status', "'done'")
+register_backfill('report', 'progress', '100')
+
+
+def _versions(report_type):
+    return json.dumps(table_versions(db.session.connection(), *report_sources(report_type)), sort_keys=True)
+
+
+def request_report(report_type, params, generated_by):
+    """Return ``(report, reused)`` for ``report_type`` run with ``params``.
+
+    Reports are stored once per parameter set. The stored row is reused
+    while a run of it is queued or running, or when the change counters of
+    the tables its builder reads are the same as when it was built.
+    Otherwise the row is queued for the worker pool, keeping its previous
+    data until the new run finishes, and ``reused`` is False.
+    """
+    key = params_hash(report_type, params)
+    report = Report.query.options(defer(Report.data), defer(Report.data_gz)).filter_by(params_hash=key).first()
+    if report is None:
+        report = Report(report_type=report_type, params_hash=key)
+        db.session.add(report)
+    elif report.status in ('pending', 'running'):
+        return report, True
+    elif report.status == 'done' and report.source_versions == _versions(report_type):
+        return report, True
+
+    report.generated_by = generated_by
+    report.generated_at = datetime.utcnow()
+    report.parameters = json.dumps(params, default=str)
+    report.status = 'pending'
+    report.progress = 0
+    report.error = None
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # The same report was queued concurrently; use that one
+        db.session.rollback()
+        return Report.query.filter_by(params_hash=key).one(), True
+    report_workers.start(current_app._get_current_object())
+    report_workers.notify()
+    return report, False
+
+
+def claim_job():
+    """Mark the oldest queued report running and return its id, or None if there is none.
+
+    A job left running for longer than REPORT_JOB_TIMEOUT is assumed to
+    belong to a worker that died and is claimed again.
+    """
+    timeout = current_app.config.get('REPORT_JOB_TIMEOUT', DEFAULT_JOB_TIMEOUT)
+    stale = datetime.utcnow() - timedelta(seconds=timeout)
+    table = Report.__table__
+
+    def waiting(columns):
+        return (columns.status == 'pending') | ((columns.status == 'running') & (columns.started_at < stale))
+
+    queued = table.alias()
+    oldest = select(queued.c.id).where(waiting(queued.c)).order_by(queued.c.id).limit(1)
+    # Idle workers poll with this read alone, without taking the write lock
+    found = db.session.scalar(oldest)
+    db.session.rollback()
+    if found is None:
+        return None
+    # One UPDATE takes the write lock up front, so two workers, in any process, never claim the same job
+    report_id = db.session.execute(
+        update(table)
+        .where(table.c.id == oldest.scalar_subquery(), waiting(table.c))
+        .values(status='running', started_at=datetime.utcnow(), progress=0)
+        .returning(table.c.id)
+    ).scalar()
+    db.session.commit()
+    return report_id
+
+
+def _load_params(parameters):
+    params = json.loads(parameters)
+    for key in ('start_date', 'end_date'):
+        if params.get(key):
+            params[key] = date.fromisoformat(params[key])
+    return params
+
+
+def _progress_writer(report_id):
+    last_write, last_percent = 0.0, 0
+
+    def write(percent):
+        nonlocal last_write, last_percent
+        now = time.monotonic()
+        if percent <= last_percent or now - last_write < PROGRESS_INTERVAL:
+            return
+        last_write, last_percent = now, percent
+        # Own short transaction, so pollers see it while the builder's read transaction is still open
+        with db.engine.begin() as connection:
+            connection.execute(update(Report.__table__)
+                               .where(Report.__table__.c.id == report_id)
+                               .values(progress=percent))
+    return write
+
+
+def _finish(report_id, **values):
+    # Only a job still marked running is updated; the report may have been deleted meanwhile
+    table = Report.__table__
+    db.session.execute(update(table).where(table.c.id == report_id, table.c.status == 'running').values(**values))
+    db.session.commit()
+
+
+def run_job(report_id):
+    """Build a claimed report and store the result; returns True if it succeeded."""
+    report = db.session.get(Report, report_id, options=[defer(Report.data), defer(Report.data_gz)])
+    if report is None:
+        return False
+    started = time.perf_counter()
+    try:
+        # Counters and data are read in one transaction, so they describe the same snapshot
+        versions = _versions(report.report_type)
+        data = build_report(report.report_type, _load_params(report.parameters),
+                            progress=_progress_writer(report_id))
+        blob = zlib.compress(json.dumps(data).encode())
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception(f"Report {report_id} failed")
+        _finish(report_id, status='failed', error=str(e), duration=time.perf_counter() - started)
+        return False
+    # End the read transaction before writing; SQLite cannot upgrade a stale read snapshot
+    db.session.rollback()
+    _finish(report_id, status='done', progress=100, data_gz=blob, data=None, source_versions=versions,
+            duration=time.perf_counter() - started)
+    return True
+
+
+def run_queued_jobs():
+    """Run queued reports in this thread until the queue is empty; returns the number run."""
+    count = 0
+    while True:
+        report_id = claim_job()
+        if report_id is None:
+            return count
+        run_job(report_id)
+        count += 1
+
+
+class ReportWorkers:
+    """Threads that run queued report jobs for this process.
+
+    The queue is the report table, so the threads of every web process and
+    of ``flask report-worker`` share it. Started when a report is first
+    queued rather than at import, so CLI commands do not spawn them;
+    they then poll every REPORT_POLL_INTERVAL seconds for jobs queued by
+    other processes.
+    """
+
+    def __init__(self):
+        self._reset()
+        # Threads do not survive a fork; let a forked worker start its own
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._threads = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def start(self, app, count=None):
+        with self._lock:
+            if self._threads:
+                return
+            if count is None:
+                count = app.config.get('REPORT_WORKERS', DEFAULT_WORKERS)
+            for i in range(count):
+                thread = threading.Thread(target=self._run, args=(app,), name=f'report-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def notify(self):
+        self._wake.set()
+
+    def join(self):
+        for thread in list(self._threads):
+            thread.join()
+
+    def _run(self, app):
+        interval = app.config.get('REPORT_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)
+        while True:
+            try:
+                with app.app_context():
+                    count = run_queued_jobs()
+            except Exception:
+                app.logger.exception("Report worker failed to poll the job queue")
+                count = 0
+            if not count:
+                self._wake.wait(interval)
+                self._wake.clear()
+
+
+report_workers = ReportWorkers()
+
+
+@click.command('report-worker')
+@click.option('--threads', type=int, help='Worker threads (default REPORT_WORKERS).')
+@click.option('--once', is_flag=True, help='Run the queued reports and exit.')
+@with_appcontext
+def report_worker_command(threads, once):
+    """Run queued report jobs, e.g. with REPORT_WORKERS=0 in the web processes."""
+    if once:
+        click.echo(f"Ran {run_queued_jobs()} report job(s).")
+        return
+    report_workers.start(current_app._get_current_object(), threads)
+    report_workers.join()
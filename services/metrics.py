@@ -0,0 +1,193 @@
+import cProfile
+import io
+import pstats
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+
+from .cache import response_cache
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_N_PLUS_ONE_THRESHOLD = 10
+DEFAULT_PROFILE_SLOW_SECONDS = 1.0
+DEFAULT_PROFILE_KEEP = 20
+
+# Expanded IN lists differ only in their number of placeholders
+_IN_LIST = re.compile(r'\((?:\s*(?:\?|%\(\w+\)s|:\w+)\s*,)+\s*(?:\?|%\(\w+\)s|:\w+)\s*\)')
+
+
+def statement_shape(statement):
+    return _IN_LIST.sub('(?)', ' '.join(statement.split()))
+
+
+class Metrics:
+    """Per-endpoint request and SQL metrics of this process.
+
+    Every worker process keeps its own figures, so Prometheus should
+    scrape each process (or sum across them) rather than a load balancer.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.profiles = deque(maxlen=DEFAULT_PROFILE_KEEP)
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = Counter()  # (endpoint, method, status) -> count
+            self.buckets = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+            self.duration = Counter()
+            self.statements = Counter()
+            self.sql_seconds = Counter()
+            self.n_plus_one = Counter()
+            self.profiles.clear()
+
+    def observe(self, endpoint, method, status, seconds, statements, sql_seconds, repeated):
+        with self._lock:
+            self.requests[endpoint, method, status] += 1
+            buckets = self.buckets[endpoint]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+                    break
+            else:
+                buckets[-1] += 1
+            self.duration[endpoint] += seconds
+            self.statements[endpoint] += statements
+            self.sql_seconds[endpoint] += sql_seconds
+            self.n_plus_one[endpoint] += repeated
+
+    def add_profile(self, endpoint, path, seconds, report):
+        with self._lock:
+            self.profiles.append((endpoint, path, seconds, report))
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{_escape(value_)}"' for key, value_ in labels)
+                lines.append(f'{name}{{{label_text}}} {value}' if labels else f'{name} {value}')
+
+        with self._lock:
+            family('http_requests_total', 'counter', 'Requests handled, by endpoint, method and status.',
+                   [((('endpoint', e), ('method', m), ('status', s)), n)
+                    for (e, m, s), n in sorted(self.requests.items())])
+            lines.append('# HELP http_request_duration_seconds Request latency.')
+            lines.append('# TYPE http_request_duration_seconds histogram')
+            for endpoint, buckets in sorted(self.buckets.items()):
+                label = f'endpoint="{_escape(endpoint)}"'
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), buckets):
+                    cumulative += count
+                    lines.append(f'http_request_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f'http_request_duration_seconds_sum{{{label}}} {self.duration[endpoint]:.6f}')
+                lines.append(f'http_request_duration_seconds_count{{{label}}} {cumulative}')
+            family('http_request_sql_statements_total', 'counter', 'SQL statements executed while handling requests.',
+                   [((('endpoint', e),), n) for e, n in sorted(self.statements.items())])
+            family('http_request_sql_seconds_total', 'counter', 'Time spent in SQL statements while handling requests.',
+                   [((('endpoint', e),), f'{n:.6f}') for e, n in sorted(self.sql_seconds.items())])
+            family('http_request_n_plus_one_total', 'counter',
+                   'Statement shapes repeated more than N_PLUS_ONE_THRESHOLD times in one request.',
+                   [((('endpoint', e),), n) for e, n in sorted(self.n_plus_one.items())])
+
+        cache = response_cache.stats()
+        family('response_cache_entries', 'gauge', 'Rendered detail pages held in the response cache.',
+               [((), cache['entries'])])
+        for key in ('hits', 'misses', 'not_modified', 'evictions'):
+            family(f'response_cache_{key}_total', 'counter', f'Response cache {key.replace("_", " ")}.',
+                   [((), cache[key])])
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = Metrics()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'sql_statements' in g:
+        context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_metrics_started', None)
+    if started is None or not has_request_context() or 'sql_statements' not in g:
+        return
+    g.sql_seconds += time.perf_counter() - started
+    g.sql_statements[statement] += 1
+
+
+def _start_request():
+    g.request_started = time.perf_counter()
+    g.sql_seconds = 0.0
+    g.sql_statements = Counter()
+    rate = current_app.config.get('PROFILE_SAMPLE_RATE', 0)
+    if rate and random.random() < rate:
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def _finish_request(response):
+    if 'request_started' not in g:
+        return response
+    seconds = time.perf_counter() - g.request_started
+    endpoint = request.endpoint or 'unmatched'
+    threshold = current_app.config.get('N_PLUS_ONE_THRESHOLD', DEFAULT_N_PLUS_ONE_THRESHOLD)
+    # Shapes are worked out once per distinct statement, not per execution
+    shapes = Counter()
+    for statement, count in g.sql_statements.items():
+        shapes[statement_shape(statement)] += count
+    repeated = [(shape, count) for shape, count in shapes.items() if count > threshold]
+    for shape, count in repeated:
+        current_app.logger.warning(f"Possible N+1 in {endpoint}: {count} x {shape[:200]}")
+    metrics.observe(endpoint, request.method, response.status_code, seconds,
+                    sum(shapes.values()), g.sql_seconds, len(repeated))
+
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        if seconds >= current_app.config.get('PROFILE_SLOW_SECONDS', DEFAULT_PROFILE_SLOW_SECONDS):
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(30)
+            metrics.add_profile(endpoint, request.full_path, seconds, out.getvalue())
+    return response
+
+
+def metrics_view():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def profiles_view():
+    # Most recent first
+    reports = [f'== {endpoint} {path} {seconds:.3f}s ==\n{report}'
+               for endpoint, path, seconds, report in reversed(metrics.profiles)]
+    return Response('\n'.join(reports) or 'No slow requests profiled.\n', mimetype='text/plain')
+
+
+def install_metrics(app, engine):
+    """Time every request and its SQL, and serve the figures on /metrics.
+
+    /metrics/profiles lists cProfile reports of sampled requests that took
+    at least PROFILE_SLOW_SECONDS; PROFILE_SAMPLE_RATE (0 by default) is
+    the fraction of requests profiled.
+    """
+    metrics.profiles = deque(metrics.profiles, maxlen=app.config.get('PROFILE_KEEP', DEFAULT_PROFILE_KEEP))
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+    app.add_url_rule('/metrics/profiles', 'metrics_profiles', profiles_view)
@@ -0,0 +1,122 @@
+import base64
+import json
+from datetime import date, datetime, time
+
+from flask import current_app, request
+from sqlalchemy import literal, tuple_
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 200
+
+
+class KeysetPage:
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _encode_value(value):
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    return value
+
+
+def _decode_value(column, value):
+    if value is None:
+        return None
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is date:
+        return date.fromisoformat(value)
+    if python_type is time:
+        return time.fromisoformat(value)
+    return python_type(value)
+
+
+def encode_cursor(values):
+    raw = json.dumps([_encode_value(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if len(values) != len(columns):
+            return None
+        return [_decode_value(c, v) for c, v in zip(columns, values)]
+    except (ValueError, TypeError):
+        return None
+
+
+def _seek(columns, values, newer):
+    # Row-value comparison lets SQLite turn the cursor into an index range search
+    key = tuple_(*columns)
+    bound = tuple_(*[literal(v, c.type) for c, v in zip(columns, values)])
+    return key > bound if newer else key < bound
+
+
+def get_per_page():
+    default = current_app.config.get('PER_PAGE', DEFAULT_PER_PAGE)
+    maximum = current_app.config.get('MAX_PER_PAGE', MAX_PER_PAGE)
+    per_page = request.args.get('per_page', default, type=int)
+    return max(1, min(per_page, maximum))
+
+
+def keyset_paginate(query, columns, per_page=None):
+    """Return a newest-first page of ``query`` ordered by ``columns``.
+
+    The position is taken from the ``after`` / ``before`` request arguments,
+    which hold opaque cursors produced by a previous page.
+    """
+    per_page = per_page or get_per_page()
+    after = request.args.get('after')
+    before = request.args.get('before')
+
+    values = None
+    if before:
+        values = decode_cursor(before, columns)
+    elif after:
+        values = decode_cursor(after, columns)
+    backwards = bool(before) and values is not None
+
+    if values is not None:
+        query = query.filter(_seek(columns, values, newer=backwards))
+    if backwards:
+        query = query.order_by(*[c.asc() for c in columns])
+    else:
+        query = query.order_by(*[c.desc() for c in columns])
+
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    def cursor_for(row):
+        return encode_cursor([getattr(row, c.key) for c in columns])
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or backwards:
+            next_cursor = cursor_for(rows[-1])
+        if (backwards and has_more) or (not backwards and values is not None):
+            prev_cursor = cursor_for(rows[0])
+    return KeysetPage(rows, per_page, next_cursor, prev_cursor)
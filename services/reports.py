@@ -0,0 +1,209 @@
+import hashlib
+import importlib
+import json
+import threading
+import zlib
+
+from sqlalchemy import func, select
+
+from models import db, Patient, Doctor, Appointment, Prescription, Billing
+from .rollups import billing_totals
+
+PROGRESS_ROWS = 1000
+# report_type -> builder(params) returning the JSON-serialisable report data
+_builders = {}
+# report_type -> models the builder reads; a write to any of them makes stored reports stale
+_sources = {}
+# Per-thread progress callback(percent) of the report job being built
+_progress = threading.local()
+
+
+def report_builder(report_type, sources=()):
+    def register(builder):
+        _builders[report_type] = builder
+        _sources[report_type] = tuple(sources)
+        return builder
+    return register
+
+
+def lazy_report_builder(report_type, module, sources=()):
+    """Register ``report_type`` now, but import ``module`` only when it is first built.
+
+    The module registers the real builder with ``report_builder`` when
+    imported, replacing this placeholder.
+    """
+    def builder(params):
+        importlib.import_module(module, __package__)
+        if _builders[report_type] is builder:
+            raise ValueError(f"{module} did not register a builder for {report_type}")
+        return _builders[report_type](params)
+    report_builder(report_type, sources)(builder)
+
+
+def build_report(report_type, params, progress=None):
+    """Run the builder registered for ``report_type``.
+
+    ``params`` holds ``start_date``/``end_date`` (dates or None) and
+    ``patient_id``/``doctor_id`` (ints or None). Every builder issues a
+    single aggregate statement, so memory grows with the number of groups
+    rather than the number of rows. Builders that produce a row per
+    patient/doctor call ``progress(percent)`` as they go.
+    """
+    builder = _builders.get(report_type)
+    if builder is None:
+        raise ValueError(f"Unknown report type: {report_type}")
+    _progress.callback = progress
+    try:
+        return builder(params)
+    finally:
+        _progress.callback = None
+
+
+def report_types():
+    return set(_builders)
+
+
+def params_hash(report_type, params):
+    # Blank filters (None, 0, '') all mean "no filter", so they hash alike
+    normalised = {key: value for key, value in params.items() if value not in (None, 0, '')}
+    key = json.dumps([report_type, normalised], sort_keys=True, default=str)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def report_sources(report_type):
+    return _sources.get(report_type, ())
+
+
+def report_data(report):
+    """The decoded data of a stored ``Report``; None until its first run finishes."""
+    if report.data_gz is not None:
+        return json.loads(zlib.decompress(report.data_gz))
+    if report.data is not None:
+        return json.loads(report.data)
+    return None
+
+
+def report_sections(data):
+    """Report data as ``[(section, rows)]`` tables, for export.
+
+    Lists of rows are sections of their own, histograms (``edges`` and
+    ``counts``) become one row per bin, other dicts one row, and the
+    remaining top-level values share a ``summary`` row.
+    """
+    summary, sections = {}, []
+    for key, value in data.items():
+        if isinstance(value, list):
+            sections.append((key, value))
+        elif isinstance(value, dict) and set(value) == {'edges', 'counts'}:
+            edges = value['edges']
+            sections.append((key, [{'bin_start': start, 'bin_end': end, 'count': count}
+                                   for start, end, count in zip(edges, edges[1:], value['counts'])]))
+        elif isinstance(value, dict):
+            sections.append((key, [value]))
+        else:
+            summary[key] = value
+    if summary:
+        sections.insert(0, ('summary', [summary]))
+    return sections
+
+
+def _tracked(query):
+    # Executes a per-row report query, reporting progress when running as a job
+    callback = getattr(_progress, 'callback', None)
+    if callback is None:
+        return db.session.execute(query)
+    total = db.session.scalar(query.with_only_columns(func.count(), maintain_column_froms=True).order_by(None))
+    return _counting(db.session.execute(query), total, callback)
+
+
+def _counting(rows, total, callback):
+    for done, row in enumerate(rows, 1):
+        if done % PROGRESS_ROWS == 0:
+            callback(done * 100 // total)
+        yield row
+
+
+def _count_where(model, column, parent_id):
+    return (select(func.count())
+            .select_from(model)
+            .where(column == parent_id)
+            .scalar_subquery())
+
+
+@report_builder('patient_history', sources=(Patient, Appointment, Prescription, Billing))
+def patient_history(params):
+    query = select(
+        Patient.id,
+        Patient.first_name,
+        Patient.last_name,
+        _count_where(Appointment, Appointment.patient_id, Patient.id).label('appointments'),
+        _count_where(Prescription, Prescription.patient_id, Patient.id).label('prescriptions'),
+        _count_where(Billing, Billing.patient_id, Patient.id).label('billings')
+    ).order_by(Patient.id)
+    if params.get('patient_id'):
+        query = query.where(Patient.id == params['patient_id'])
+    return {
+        'patients': [
+            {
+                'id': row.id,
+                'name': f"{row.first_name} {row.last_name}",
+                'appointments': row.appointments,
+                'prescriptions': row.prescriptions,
+                'billings': row.billings
+            } for row in _tracked(query)
+        ]
+    }
+
+
+@report_builder('appointment_summary', sources=(Appointment,))
+def appointment_summary(params):
+    query = (select(Appointment.status, func.count())
+             .group_by(Appointment.status))
+    if params.get('start_date'):
+        query = query.where(Appointment.appointment_date >= params['start_date'])
+    if params.get('end_date'):
+        query = query.where(Appointment.appointment_date <= params['end_date'])
+    counts = dict(db.session.execute(query).all())
+    return {
+        'total_appointments': sum(counts.values()),
+        'scheduled': counts.get('scheduled', 0),
+        'completed': counts.get('completed', 0),
+        'cancelled': counts.get('cancelled', 0)
+    }
+
+
+@report_builder('billing_summary', sources=(Billing, Appointment))
+def billing_summary(params):
+    # Summed from the billing rollups; created_at dates, so the whole end day is included
+    totals = {row.status: row for row in billing_totals(params.get('start_date'), params.get('end_date'),
+                                                        params.get('doctor_id'))}
+    paid = totals.get('paid')
+    return {
+        'total_billings': sum(row.count for row in totals.values()),
+        'paid': paid.count if paid else 0,
+        'pending': totals['pending'].count if 'pending' in totals else 0,
+        'total_amount': round(paid.amount, 2) if paid else 0
+    }
+
+
+@report_builder('doctor_performance', sources=(Doctor, Appointment, Prescription))
+def doctor_performance(params):
+    query = select(
+        Doctor.id,
+        Doctor.first_name,
+        Doctor.last_name,
+        _count_where(Appointment, Appointment.doctor_id, Doctor.id).label('appointments'),
+        _count_where(Prescription, Prescription.doctor_id, Doctor.id).label('prescriptions')
+    ).order_by(Doctor.id)
+    if params.get('doctor_id'):
+        query = query.where(Doctor.id == params['doctor_id'])
+    return {
+        'doctors': [
+            {
+                'id': row.id,
+                'name': f"{row.first_name} {row.last_name}",
+                'appointments': row.appointments,
+                'prescriptions': row.prescriptions
+            } for row in _tracked(query)
+        ]
+    }
@@ -0,0 +1,212 @@
+from datetime import timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import Date, Select, and_, cast, delete, event, func, insert, literal, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm.attributes import get_history
+
+from models import db, Appointment, Billing, BillingRollup
+
+GRAINS = ('day', 'month')
+ROLLUP_KEYS = ('status', 'payment_method', 'doctor_id')
+ROLLUP_COLUMNS = ['grain', 'period_start', *ROLLUP_KEYS, 'count', 'amount']
+# Rollups are maintained with INSERT ... ON CONFLICT DO UPDATE
+INSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def _period_columns(dialect_name):
+    # created_at truncated to the day and to the month, as dates
+    if dialect_name == 'sqlite':
+        return (func.date(Billing.created_at, type_=Date),
+                func.date(Billing.created_at, 'start of month', type_=Date))
+    return cast(Billing.created_at, Date), cast(func.date_trunc('month', Billing.created_at), Date)
+
+
+def _grouped(connection, grain, *criteria, sign=1, doctor_id=None):
+    # Rollup rows (ROLLUP_COLUMNS order) for the billings matching ``criteria``, negated for sign=-1;
+    # ``doctor_id`` files them under that doctor rather than their appointment's
+    day, month = _period_columns(connection.dialect.name)
+    period = day if grain == 'day' else month
+    key = [period, func.coalesce(Billing.status, ''), func.coalesce(Billing.payment_method, '')]
+    doctor = func.coalesce(Appointment.doctor_id, 0) if doctor_id is None else literal(doctor_id)
+    return (select(literal(grain), *key, doctor, func.count() * sign, func.sum(Billing.amount) * sign)
+            .select_from(Billing)
+            .outerjoin(Appointment, Billing.appointment_id == Appointment.id)
+            .where(Billing.created_at.isnot(None), *criteria)
+            .group_by(*key, *([doctor] if doctor_id is None else [])))
+
+
+def _upsert(connection, rows):
+    # Adds ``rows`` (a _grouped select, or one row's values) to the rollups in one statement
+    table = BillingRollup.__table__
+    insert = INSERTS[connection.dialect.name](table)
+    statement = insert.from_select(ROLLUP_COLUMNS, rows) if isinstance(rows, Select) else insert.values(rows)
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=[table.c[name] for name in ('grain', 'period_start') + ROLLUP_KEYS],
+        set_={'count': table.c.count + statement.excluded['count'],
+              'amount': table.c.amount + statement.excluded.amount}
+    ))
+
+
+def _drop_empty(connection, *criteria):
+    # Groups whose last billing went away
+    table = BillingRollup.__table__
+    connection.execute(delete(table).where(table.c.count <= 0, *criteria))
+
+
+def _adjust(connection, grain, period_start, status, payment_method, doctor_id, count, amount):
+    table = BillingRollup.__table__
+    key = {'grain': grain, 'period_start': period_start, 'status': status or '',
+           'payment_method': payment_method or '', 'doctor_id': doctor_id or 0}
+    _upsert(connection, dict(key, count=count, amount=amount))
+    if count < 0:
+        _drop_empty(connection, *[table.c[name] == value for name, value in key.items()])
+
+
+def _apply(connection, created_at, status, payment_method, doctor_id, amount, sign):
+    if created_at is None:
+        return
+    day = created_at.date()
+    for grain, period_start in zip(GRAINS, (day, day.replace(day=1))):
+        _adjust(connection, grain, period_start, status, payment_method, doctor_id, sign, sign * (amount or 0))
+
+
+def _doctor_id(connection, appointment_id):
+    return connection.scalar(select(Appointment.doctor_id).where(Appointment.id == appointment_id))
+
+
+def _previous(target, attr):
+    history = get_history(target, attr)
+    return history.deleted[0] if history.deleted else getattr(target, attr)
+
+
+@event.listens_for(Billing, 'after_insert')
+def _billing_inserted(mapper, connection, target):
+    _apply(connection, target.created_at, target.status, target.payment_method,
+           _doctor_id(connection, target.appointment_id), target.amount, 1)
+
+
+@event.listens_for(Billing, 'after_update')
+def _billing_updated(mapper, connection, target):
+    fields = ('created_at', 'status', 'payment_method', 'appointment_id', 'amount')
+    if not any(get_history(target, name).has_changes() for name in fields):
+        return
+    old_appointment = _previous(target, 'appointment_id')
+    _apply(connection, _previous(target, 'created_at'), _previous(target, 'status'),
+           _previous(target, 'payment_method'), _doctor_id(connection, old_appointment),
+           _previous(target, 'amount'), -1)
+    _apply(connection, target.created_at, target.status, target.payment_method,
+           _doctor_id(connection, target.appointment_id), target.amount, 1)
+
+
+@event.listens_for(Billing, 'after_delete')
+def _billing_deleted(mapper, connection, target):
+    _apply(connection, target.created_at, target.status, target.payment_method,
+           _doctor_id(connection, target.appointment_id), target.amount, -1)
+
+
+@event.listens_for(Appointment, 'after_update')
+def _appointment_updated(mapper, connection, target):
+    # Billings are rolled up by their appointment's doctor, so follow a reassignment
+    history = get_history(target, 'doctor_id')
+    if not history.deleted or history.deleted[0] == target.doctor_id:
+        return
+    billings = Billing.appointment_id == target.id
+    for grain in GRAINS:
+        _upsert(connection, _grouped(connection, grain, billings, sign=-1, doctor_id=history.deleted[0]))
+        _upsert(connection, _grouped(connection, grain, billings, doctor_id=target.doctor_id))
+    _drop_empty(connection)
+
+
+def _shift_billings(sign, criteria):
+    connection = db.session.connection()
+    for grain in GRAINS:
+        _upsert(connection, _grouped(connection, grain, *criteria, sign=sign))
+    if sign < 0:
+        _drop_empty(connection)
+
+
+def subtract_billings(*criteria):
+    """Take the billings matching ``criteria`` out of the rollups.
+
+    For set-based deletes and updates, which bypass the mapper hooks; call
+    it in the same transaction, just before the statement.
+    """
+    _shift_billings(-1, criteria)
+
+
+def add_billings(*criteria):
+    """Count the billings matching ``criteria`` into the rollups, e.g. just after a set-based update."""
+    _shift_billings(1, criteria)
+
+
+def rebuild_billing_rollups(connection):
+    """Recompute every rollup row from the billing table; returns the number of rows written."""
+    table = BillingRollup.__table__
+    connection.execute(delete(table))
+    written = 0
+    for grain in GRAINS:
+        written += connection.execute(insert(table).from_select(ROLLUP_COLUMNS, _grouped(connection, grain))).rowcount
+    return written
+
+
+def install_billing_rollups(engine):
+    """Populate the rollups the first time, e.g. for a database that predates them."""
+    with engine.begin() as connection:
+        if connection.scalar(select(BillingRollup.grain).limit(1)) is None and \
+                connection.scalar(select(Billing.id).limit(1)) is not None:
+            rebuild_billing_rollups(connection)
+
+
+def _next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _range_condition(start, end):
+    # Whole months inside [start, end] come from month rows, the ragged ends from day rows
+    period = BillingRollup.period_start
+    end = end + timedelta(days=1) if end else None
+    months_from = start if start is None or start.day == 1 else _next_month(start)
+    months_to = end if end is None or end.day == 1 else end.replace(day=1)
+    if months_from is not None and months_to is not None and months_from >= months_to:
+        return and_(BillingRollup.grain == 'day', period >= start, period < end)
+
+    months = [BillingRollup.grain == 'month']
+    if months_from is not None:
+        months.append(period >= months_from)
+    if months_to is not None:
+        months.append(period < months_to)
+    parts = [and_(*months)]
+    if start is not None and start < months_from:
+        parts.append(and_(BillingRollup.grain == 'day', period >= start, period < months_from))
+    if end is not None and months_to < end:
+        parts.append(and_(BillingRollup.grain == 'day', period >= months_to, period < end))
+    return or_(*parts)
+
+
+def billing_totals(start=None, end=None, doctor_id=None, group_by=('status',)):
+    """Billing count and amount for ``created_at`` dates in ``[start, end]``, per ``group_by``.
+
+    ``group_by`` names rollup keys (status, payment_method, doctor_id).
+    Answered from the rollups, so a range of several years sums a few
+    hundred rows rather than every billing. Returns rows of the group
+    values followed by ``count`` and ``amount``.
+    """
+    keys = [getattr(BillingRollup, name) for name in group_by]
+    query = (select(*keys, func.sum(BillingRollup.count).label('count'),
+                    func.sum(BillingRollup.amount).label('amount'))
+             .where(_range_condition(start, end))
+             .group_by(*keys))
+    if doctor_id:
+        query = query.where(BillingRollup.doctor_id == doctor_id)
+    return db.session.execute(query).all()
+
+
+@click.command('rebuild-billing-rollups')
+@with_appcontext
+def rebuild_billing_rollups_command():
+    """Recompute the billing rollup tables from the billing table."""
+    with db.engine.begin() as connection:
+        count = rebuild_billing_rollups(connection)
+    click.echo(f"Wrote {count} rollup row(s).")
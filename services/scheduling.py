@@ -0,0 +1,238 @@
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, time as clock
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select
+
+from models import db, Doctor, Appointment, WorkingHours
+from .changes import subscribe
+
+DEFAULT_SLOT_MINUTES = 30
+DEFAULT_WORKING_HOURS = {weekday: ('09:00', '17:00') for weekday in range(5)}  # Monday to Friday
+DEFAULT_TTL = 60
+PRELOAD_DAYS = 14  # days of bookings loaded per doctor in one query
+MAX_SEARCH_DAYS = 90
+WEEKDAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+
+def _minutes(value):
+    if isinstance(value, str):
+        value = datetime.strptime(value, '%H:%M').time()
+    return value.hour * 60 + value.minute
+
+
+def _clock(minutes):
+    return clock(minutes // 60, minutes % 60)
+
+
+class SlotIndex:
+    """Per doctor/day sorted arrays of booked start times (minutes since midnight).
+
+    Free-slot and conflict checks are binary searches over these arrays.
+    Days are loaded ``PRELOAD_DAYS`` at a time per doctor and the whole
+    index is dropped when a transaction touching appointments or working
+    hours commits; a TTL bounds staleness for bookings made by other
+    worker processes.
+
+    Bookings start on the grid of SLOT_MINUTES from the doctor's opening
+    time (``on_grid``), so any two overlapping bookings share a start time
+    and the unique index on appointments stops concurrent double-booking
+    that these cached checks miss. Changing SLOT_MINUTES or a doctor's
+    opening time moves the grid: bookings made on the old grid are still
+    caught by ``conflicts`` but no longer by the unique index.
+    """
+
+    def __init__(self):
+        self._days = {}  # (doctor_id, day) -> ([start minutes], [appointment ids])
+        self._hours = {}  # doctor_id -> {weekday: (start minutes, end minutes)}
+        self._loaded_at = time.monotonic()
+        self._generation = 0  # bumped by invalidate(); loads that straddle one are not cached
+        self._lock = threading.Lock()
+
+    def slot_minutes(self):
+        return current_app.config.get('SLOT_MINUTES', DEFAULT_SLOT_MINUTES)
+
+    def _check_ttl(self):
+        if time.monotonic() - self._loaded_at >= current_app.config.get('SCHEDULE_CACHE_TTL', DEFAULT_TTL):
+            self.invalidate()
+
+    def invalidate(self):
+        with self._lock:
+            self._days = {}
+            self._hours = {}
+            self._generation += 1
+            self._loaded_at = time.monotonic()
+
+    def working_hours(self, doctor_id):
+        self._check_ttl()
+        hours = self._hours.get(doctor_id)
+        if hours is None:
+            generation = self._generation
+            rows = db.session.execute(
+                select(WorkingHours.weekday, WorkingHours.start_time, WorkingHours.end_time)
+                .where(WorkingHours.doctor_id == doctor_id)
+            ).all()
+            if rows:
+                # A day off is a row with no time between start and end (see set-working-hours --off)
+                hours = {row.weekday: (_minutes(row.start_time), _minutes(row.end_time))
+                         for row in rows if row.start_time < row.end_time}
+            else:
+                configured = current_app.config.get('WORKING_HOURS', DEFAULT_WORKING_HOURS)
+                hours = {int(weekday): (_minutes(start), _minutes(end)) for weekday, (start, end) in configured.items()}
+            with self._lock:
+                if generation == self._generation:
+                    self._hours[doctor_id] = hours
+        return hours
+
+    def _load(self, doctor_id, first_day):
+        # Returns first_day's bookings; the rows read are only cached if no commit invalidated the
+        # index meanwhile, otherwise they could hide that commit's bookings until the TTL
+        generation = self._generation
+        last_day = first_day + timedelta(days=PRELOAD_DAYS - 1)
+        rows = db.session.execute(
+            select(Appointment.id, Appointment.appointment_date, Appointment.appointment_time)
+            .where(Appointment.doctor_id == doctor_id,
+                   Appointment.appointment_date.between(first_day, last_day),
+                   Appointment.status != 'cancelled')
+            .order_by(Appointment.appointment_date, Appointment.appointment_time)
+        )
+        days = {first_day + timedelta(days=n): ([], []) for n in range(PRELOAD_DAYS)}
+        for row in rows:
+            starts, ids = days[row.appointment_date]
+            starts.append(_minutes(row.appointment_time))
+            ids.append(row.id)
+        with self._lock:
+            if generation != self._generation:
+                return days[first_day]
+            for day, booked in days.items():
+                self._days.setdefault((doctor_id, day), booked)
+            return self._days[doctor_id, first_day]
+
+    def booked(self, doctor_id, day):
+        self._check_ttl()
+        booked = self._days.get((doctor_id, day))
+        if booked is None:
+            booked = self._load(doctor_id, day)
+        return booked
+
+    def conflicts(self, doctor_id, day, start, exclude_id=None):
+        """Ids of live appointments overlapping a slot starting at ``start`` minutes."""
+        length = self.slot_minutes()
+        starts, ids = self.booked(doctor_id, day)
+        # Equal-length slots overlap when their starts are less than one slot apart
+        lo = bisect_right(starts, start - length)
+        hi = bisect_left(starts, start + length)
+        return [id for id in ids[lo:hi] if id != exclude_id]
+
+    def within_hours(self, doctor_id, day, start):
+        hours = self.working_hours(doctor_id).get(day.weekday())
+        return hours is not None and hours[0] <= start and start + self.slot_minutes() <= hours[1]
+
+    def on_grid(self, doctor_id, day, start):
+        hours = self.working_hours(doctor_id).get(day.weekday())
+        return hours is not None and (start - hours[0]) % self.slot_minutes() == 0
+
+    def free_slots(self, doctor_id, day):
+        """Free slot start times on ``day``, on the grid of SLOT_MINUTES from opening time."""
+        hours = self.working_hours(doctor_id).get(day.weekday())
+        if hours is None:
+            return []
+        length = self.slot_minutes()
+        starts, _ = self.booked(doctor_id, day)
+        free = []
+        i = 0
+        for start in range(hours[0], hours[1] - length + 1, length):
+            # Both sequences ascend, so one pointer walks the bookings
+            while i < len(starts) and starts[i] <= start - length:
+                i += 1
+            if i == len(starts) or starts[i] >= start + length:
+                free.append(start)
+        return free
+
+    def next_free(self, doctor_id, after, count=10, max_days=MAX_SEARCH_DAYS):
+        """The first ``count`` free slots at or after the ``after`` datetime, as datetimes."""
+        found = []
+        day = after.date()
+        for _ in range(max_days):
+            slots = self.free_slots(doctor_id, day)
+            if day == after.date():
+                slots = slots[bisect_left(slots, _minutes(after)):]
+            for start in slots:
+                found.append(datetime.combine(day, _clock(start)))
+                if len(found) >= count:
+                    return found
+            day += timedelta(days=1)
+        return found
+
+
+slot_index = SlotIndex()
+
+
+@subscribe
+def _invalidate_changed(changed_models):
+    if changed_models & {Appointment, WorkingHours, Doctor}:
+        slot_index.invalidate()
+
+
+def slot_conflict(doctor_id, day, at, status='scheduled', exclude_id=None):
+    """Why ``doctor_id`` cannot be booked at ``day``/``at``, or None if the slot is free."""
+    if status == 'cancelled':
+        return None
+    start = _minutes(at)
+    if not slot_index.within_hours(doctor_id, day, start):
+        return "The doctor is not working at this time."
+    if not slot_index.on_grid(doctor_id, day, start):
+        length = slot_index.slot_minutes()
+        opening = _clock(slot_index.working_hours(doctor_id)[day.weekday()][0]).strftime('%H:%M')
+        return f"Appointments start every {length} minutes from {opening}."
+    if slot_index.conflicts(doctor_id, day, start, exclude_id):
+        return "The doctor already has an appointment at this time."
+    return None
+
+
+@click.command('set-working-hours')
+@click.argument('doctor_id', type=int)
+@click.argument('weekday', type=click.Choice(WEEKDAYS))
+@click.argument('start', required=False)
+@click.argument('end', required=False)
+@click.option('--off', is_flag=True, help='Mark the doctor as not working on this weekday.')
+@with_appcontext
+def set_working_hours_command(doctor_id, weekday, start, end, off):
+    """Set a doctor's hours for one weekday, e.g. ``set-working-hours 3 mon 08:30 16:00``."""
+    if db.session.get(Doctor, doctor_id) is None:
+        raise click.BadParameter(f'No doctor with id {doctor_id}.', param_hint='DOCTOR_ID')
+    if not db.session.scalar(select(WorkingHours.id).filter_by(doctor_id=doctor_id).limit(1)):
+        # First override: start from the configured defaults so other weekdays keep them
+        for day, (day_start, day_end) in slot_index.working_hours(doctor_id).items():
+            db.session.add(WorkingHours(doctor_id=doctor_id, weekday=day,
+                                        start_time=_clock(day_start), end_time=_clock(day_end)))
+        db.session.flush()
+    weekday = WEEKDAYS.index(weekday)
+    row = db.session.scalar(select(WorkingHours).filter_by(doctor_id=doctor_id, weekday=weekday))
+    if off:
+        # Kept as an empty row rather than deleted: a doctor without rows falls back to WORKING_HOURS
+        if row is None:
+            row = WorkingHours(doctor_id=doctor_id, weekday=weekday)
+            db.session.add(row)
+        row.start_time = row.end_time = clock(0)
+        db.session.commit()
+        click.echo(f"Doctor {doctor_id} is off on {WEEKDAYS[weekday]}.")
+        return
+    if not start or not end:
+        raise click.UsageError('START and END are required unless --off is given.')
+    try:
+        start, end = datetime.strptime(start, '%H:%M').time(), datetime.strptime(end, '%H:%M').time()
+    except ValueError:
+        raise click.BadParameter('Times must be HH:MM.')
+    if start >= end:
+        raise click.BadParameter('START must be before END.')
+    if row is None:
+        row = WorkingHours(doctor_id=doctor_id, weekday=weekday)
+        db.session.add(row)
+    row.start_time, row.end_time = start, end
+    db.session.commit()
+    click.echo(f"Doctor {doctor_id} works {start:%H:%M}-{end:%H:%M} on {WEEKDAYS[weekday]}.")
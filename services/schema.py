@@ -0,0 +1,84 @@
+import sys
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import inspect
+
+from models import db
+from .indexes import create_indexes
+from .rollups import install_billing_rollups
+from .search import install_search
+
+# SQL used to fill a column added to an existing table, keyed by (table, column)
+COLUMN_BACKFILL = {
+    (table, 'updated_at'): 'created_at'
+    for table in ('patient', 'doctor', 'appointment', 'eye_test_result', 'prescription', 'billing')
+}
+
+
+def register_backfill(table, column, fill):
+    COLUMN_BACKFILL[table, column] = fill
+
+
+def add_missing_columns(engine, metadata, backfill=COLUMN_BACKFILL):
+    """ALTER TABLE ... ADD COLUMN for model columns an existing database lacks.
+
+    ``db.create_all()`` only creates missing tables. Added columns are
+    nullable with no server default; ``backfill`` maps ``(table, column)``
+    to an SQL expression, or a callable taking the connection, used to
+    fill existing rows. Callables run after every column has been added,
+    so they may write through the full table. Returns the
+    ``table.column`` names added.
+    """
+    inspector = inspect(engine)
+    added = []
+    fills = []
+    with engine.begin() as connection:
+        for table in metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}')
+                fill = backfill.get((table.name, column.name))
+                if callable(fill):
+                    # Values only Python can compute; called with the connection once the schema is complete
+                    fills.append(fill)
+                elif fill:
+                    connection.exec_driver_sql(f'UPDATE {table.name} SET {column.name} = {fill}')
+                added.append(f'{table.name}.{column.name}')
+        for fill in fills:
+            fill(connection)
+    return added
+
+
+def create_database(engine, metadata):
+    """Create missing tables, columns and indexes, the search index and the billing rollups.
+
+    Safe to re-run, so it doubles as the upgrade step for an existing
+    database. Returns the ``table.column`` names added and
+    ``(index name, error)`` for unique indexes the existing rows violate.
+    """
+    metadata.create_all(engine)
+    added = add_missing_columns(engine, metadata)
+    # create_all only indexes tables it creates; older databases get the rest here
+    _, failed = create_indexes(engine)
+    install_search(engine)
+    install_billing_rollups(engine)
+    return added, failed
+
+
+@click.command('create-db')
+@with_appcontext
+def create_db_command():
+    """Create the database schema, or bring an existing database up to date."""
+    added, failed = create_database(db.engine, db.metadata)
+    click.echo(f"Database ready; added column(s): {', '.join(added)}." if added else "Database ready.")
+    for name, error in failed:
+        # e.g. double-booked appointments predating uq_appointment_doctor_slot
+        click.echo(f"Could not create {name}: {error}. Resolve the duplicate rows and run again.", err=True)
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,240 @@
+import re
+import weakref
+from contextlib import contextmanager
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import or_, text
+from sqlalchemy.exc import OperationalError
+
+from models import db, Patient
+
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+DEFAULT_CANDIDATES = 1000
+
+# Engine -> whether its database has the FTS5 tables installed
+_fts_engines = weakref.WeakKeyDictionary()
+
+# Column weights for bm25(): name, email, phone, address, medical_history, clinical
+_WEIGHTS = '10.0, 5.0, 5.0, 1.0, 1.0, 0.5'
+
+_DIGITS = "replace(replace(replace(replace(replace(replace({0}, ' ', ''), '-', ''), '(', ''), ')', ''), '.', ''), '+', '')"
+
+# Eye test findings and prescription notes for one patient, as a single text column
+_CLINICAL = """(SELECT coalesce(group_concat(body, ' '), '') FROM (
+    SELECT coalesce(fundus_examination, '') || ' ' || coalesce(other_findings, '') AS body
+    FROM eye_test_result WHERE patient_id = {0}
+    UNION ALL
+    SELECT coalesce(notes, '') FROM prescription WHERE patient_id = {0}))"""
+
+_PATIENT_ROW = """{0}.first_name || ' ' || {0}.last_name, {0}.email, {0}.phone, {0}.address,
+    coalesce({0}.medical_history, '')"""
+
+DDL = [
+    # prefix='2 3' keeps short prefix queries from walking the whole term list
+    "CREATE VIRTUAL TABLE IF NOT EXISTS patient_fts USING fts5("
+    "name, email, phone, address, medical_history, clinical, "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    # Trigrams match any 3+ digit fragment of a phone number, not just its prefix
+    "CREATE VIRTUAL TABLE IF NOT EXISTS patient_phone_fts USING fts5(digits, tokenize='trigram')",
+
+    f"""CREATE TRIGGER IF NOT EXISTS patient_fts_insert AFTER INSERT ON patient BEGIN
+        INSERT INTO patient_fts (rowid, name, email, phone, address, medical_history, clinical)
+        VALUES (new.id, {_PATIENT_ROW.format('new')}, {_CLINICAL.format('new.id')});
+        INSERT INTO patient_phone_fts (rowid, digits) VALUES (new.id, {_DIGITS.format('new.phone')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS patient_fts_update
+    AFTER UPDATE OF first_name, last_name, email, phone, address, medical_history ON patient BEGIN
+        DELETE FROM patient_fts WHERE rowid = old.id;
+        DELETE FROM patient_phone_fts WHERE rowid = old.id;
+        INSERT INTO patient_fts (rowid, name, email, phone, address, medical_history, clinical)
+        VALUES (new.id, {_PATIENT_ROW.format('new')}, {_CLINICAL.format('new.id')});
+        INSERT INTO patient_phone_fts (rowid, digits) VALUES (new.id, {_DIGITS.format('new.phone')});
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS patient_fts_delete AFTER DELETE ON patient BEGIN
+        DELETE FROM patient_fts WHERE rowid = old.id;
+        DELETE FROM patient_phone_fts WHERE rowid = old.id;
+    END""",
+]
+
+for _table, _columns in (('eye_test_result', 'patient_id, fundus_examination, other_findings'),
+                         ('prescription', 'patient_id, notes')):
+    DDL += [
+        f"""CREATE TRIGGER IF NOT EXISTS {_table}_fts_insert AFTER INSERT ON {_table} BEGIN
+            UPDATE patient_fts SET clinical = {_CLINICAL.format('new.patient_id')} WHERE rowid = new.patient_id;
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {_table}_fts_update AFTER UPDATE OF {_columns} ON {_table} BEGIN
+            UPDATE patient_fts SET clinical = {_CLINICAL.format('old.patient_id')} WHERE rowid = old.patient_id;
+            UPDATE patient_fts SET clinical = {_CLINICAL.format('new.patient_id')} WHERE rowid = new.patient_id;
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {_table}_fts_delete AFTER DELETE ON {_table} BEGIN
+            UPDATE patient_fts SET clinical = {_CLINICAL.format('old.patient_id')} WHERE rowid = old.patient_id;
+        END""",
+    ]
+
+REBUILD = [
+    "DELETE FROM patient_fts",
+    "DELETE FROM patient_phone_fts",
+    f"""INSERT INTO patient_fts (rowid, name, email, phone, address, medical_history, clinical)
+        SELECT p.id, {_PATIENT_ROW.format('p')}, {_CLINICAL.format('p.id')} FROM patient AS p""",
+    f"INSERT INTO patient_phone_fts (rowid, digits) SELECT id, {_DIGITS.format('phone')} FROM patient",
+    "INSERT INTO patient_fts (patient_fts) VALUES ('optimize')",
+    "INSERT INTO patient_phone_fts (patient_phone_fts) VALUES ('optimize')",
+]
+
+
+TRIGGERS = re.findall(r'CREATE TRIGGER IF NOT EXISTS (\w+)', '\n'.join(DDL))
+
+
+@contextmanager
+def search_index_suspended():
+    """Drop the sync triggers for a bulk load and rebuild the index once afterwards.
+
+    Rebuilding is much cheaper than updating a patient's clinical column
+    for every eye test and prescription inserted. Writes from other
+    connections in the meantime are only indexed by the rebuild, so use
+    it for offline loads.
+    """
+    if not has_search_index(db.engine):
+        yield
+        return
+    with db.engine.begin() as connection:
+        for name in TRIGGERS:
+            connection.exec_driver_sql(f'DROP TRIGGER IF EXISTS {name}')
+    try:
+        yield
+    finally:
+        with db.engine.begin() as connection:
+            for statement in DDL + REBUILD:
+                connection.exec_driver_sql(statement)
+
+
+def has_search_index(engine):
+    """Whether ``engine``'s database has the FTS5 index, checked once per engine on first use."""
+    if engine not in _fts_engines:
+        installed = False
+        if engine.dialect.name == 'sqlite':
+            with engine.connect() as connection:
+                installed = connection.exec_driver_sql(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patient_fts'").first() is not None
+        _fts_engines[engine] = installed
+    return _fts_engines[engine]
+
+
+def install_search(engine):
+    """Create the FTS5 tables and sync triggers; populate them the first time.
+
+    Returns False when the database is not SQLite or lacks FTS5, in which
+    case ``search_patients`` falls back to LIKE queries.
+    """
+    if engine.dialect.name != 'sqlite':
+        return False
+    with engine.begin() as connection:
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patient_fts'").first()
+        try:
+            for statement in DDL:
+                connection.exec_driver_sql(statement)
+        except OperationalError:
+            # SQLite compiled without FTS5 or the trigram tokenizer (3.34+)
+            _fts_engines[engine] = False
+            return False
+        if not exists:
+            for statement in REBUILD:
+                connection.exec_driver_sql(statement)
+    _fts_engines[engine] = True
+    return True
+
+
+def rebuild_search_index():
+    with db.engine.begin() as connection:
+        for statement in REBUILD:
+            connection.exec_driver_sql(statement)
+
+
+_PHONE_RUN = re.compile(r'(?<!\w)\+?\d[\d\s().-]*\d(?!\w)')
+_WORD = re.compile(r'\w+')
+
+
+def parse_query(term):
+    """Split a search box entry into an FTS5 text query and a phone digit fragment.
+
+    Digit runs of three or more (punctuation allowed, e.g. ``555-12``) are
+    matched anywhere in the phone number; every other word is a prefix match.
+    """
+    phone = None
+    for match in _PHONE_RUN.finditer(term):
+        digits = re.sub(r'\D', '', match.group())
+        if len(digits) >= 3 and (phone is None or len(digits) > len(phone)):
+            phone, span = digits, match.span()
+    if phone:
+        term = term[:span[0]] + ' ' + term[span[1]:]
+    # Quoting keeps FTS5 operators (AND, NEAR, -, :) in user input literal
+    words = ['"{}"*'.format(word.replace('"', '')) for word in _WORD.findall(term.lower())]
+    return ' '.join(words), phone
+
+
+def _fts_search(words, phone, limit, candidates):
+    # Ranking every match of a broad prefix ("jo") is what makes FTS slow on large
+    # tables, so bm25 only orders the newest ``candidates`` matches
+    params = {'words': words, 'phone': phone, 'trigram': f'"{phone}"', 'limit': limit, 'candidates': candidates}
+    if words:
+        phone_join = ''
+        if phone:
+            # Applied before the cap, so a phone fragment is checked against every name match.
+            # Probing the trigram index once per matching row is far slower than instr().
+            phone_join = "JOIN patient_phone_fts AS ph ON ph.rowid = f.rowid AND instr(ph.digits, :phone) > 0"
+        sql = f"""SELECT c.id FROM (
+                SELECT f.rowid AS id, bm25(patient_fts, {_WEIGHTS}) AS score FROM patient_fts AS f {phone_join}
+                WHERE patient_fts MATCH :words ORDER BY f.rowid DESC LIMIT :candidates) AS c
+                ORDER BY c.score LIMIT :limit"""
+    else:
+        sql = ("SELECT rowid AS id FROM patient_phone_fts WHERE patient_phone_fts MATCH :trigram "
+               "ORDER BY rowid DESC LIMIT :limit")
+    ids = db.session.scalars(text(sql), params).all()
+    patients = {p.id: p for p in db.session.execute(
+        db.select(Patient.id, Patient.first_name, Patient.last_name, Patient.email, Patient.phone)
+        .where(Patient.id.in_(ids)))}
+    return [patients[id] for id in ids if id in patients]
+
+
+def _like_search(words, phone, limit):
+    query = db.select(Patient.id, Patient.first_name, Patient.last_name, Patient.email, Patient.phone)
+    for word in _WORD.findall(words):
+        pattern = f'{word}%'
+        query = query.where(or_(Patient.first_name.ilike(pattern), Patient.last_name.ilike(pattern),
+                                Patient.email.ilike(pattern)))
+    if phone:
+        query = query.where(Patient.phone.contains(phone))
+    return db.session.execute(query.order_by(Patient.last_name, Patient.first_name).limit(limit)).all()
+
+
+def search_patients(term, limit=SEARCH_LIMIT):
+    """Ranked patients matching ``term`` as ``{id, name, email, phone}`` dicts.
+
+    With the FTS5 index, only the newest SEARCH_CANDIDATES matches are
+    ranked, so a very broad term returns the best of the recent patients.
+    """
+    words, phone = parse_query(term or '')
+    if not words and not phone:
+        return []
+    limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+    if has_search_index(db.engine):
+        rows = _fts_search(words, phone, limit, current_app.config.get('SEARCH_CANDIDATES', DEFAULT_CANDIDATES))
+    else:
+        rows = _like_search(words, phone, limit)
+    return [{'id': row.id, 'name': f"{row.first_name} {row.last_name}", 'email': row.email, 'phone': row.phone}
+            for row in rows]
+
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index_command():
+    """Repopulate the patient full-text index from the patient, eye test and prescription tables."""
+    if not has_search_index(db.engine):
+        click.echo("Full-text search is not available on this database.")
+        return
+    rebuild_search_index()
+    click.echo("Patient search index rebuilt.")
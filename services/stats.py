@@ -0,0 +1,133 @@
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event, func, select, update
+from sqlalchemy.orm.attributes import get_history
+
+from models import db, Patient, Doctor, Appointment, Billing, DashboardStat
+
+DEFAULT_RECONCILE_INTERVAL = 3600
+
+COUNTED_MODELS = {
+    'patients': Patient,
+    'doctors': Doctor,
+    'appointments': Appointment
+}
+
+
+def _adjust(connection, key, delta):
+    if delta:
+        connection.execute(
+            update(DashboardStat.__table__)
+            .where(DashboardStat.__table__.c.key == key)
+            .values(value=DashboardStat.__table__.c.value + delta)
+        )
+
+
+def _count_hooks(key, model):
+    @event.listens_for(model, 'after_insert')
+    def after_insert(mapper, connection, target):
+        _adjust(connection, key, 1)
+
+    @event.listens_for(model, 'after_delete')
+    def after_delete(mapper, connection, target):
+        _adjust(connection, key, -1)
+
+
+for _key, _model in COUNTED_MODELS.items():
+    _count_hooks(_key, _model)
+
+
+def _paid_amount(status, amount):
+    return (amount or 0) if status == 'paid' else 0
+
+
+def _previous(target, attr):
+    history = get_history(target, attr)
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(target, attr)
+
+
+@event.listens_for(Billing, 'after_insert')
+def _billing_inserted(mapper, connection, target):
+    _adjust(connection, 'revenue', _paid_amount(target.status, target.amount))
+
+
+@event.listens_for(Billing, 'after_update')
+def _billing_updated(mapper, connection, target):
+    before = _paid_amount(_previous(target, 'status'), _previous(target, 'amount'))
+    after = _paid_amount(target.status, target.amount)
+    _adjust(connection, 'revenue', after - before)
+
+
+@event.listens_for(Billing, 'after_delete')
+def _billing_deleted(mapper, connection, target):
+    _adjust(connection, 'revenue', -_paid_amount(target.status, target.amount))
+
+
+def counter_key(model):
+    """The dashboard counter that counts ``model``'s rows, or None."""
+    for key, counted in COUNTED_MODELS.items():
+        if counted is model:
+            return key
+    return None
+
+
+def adjust_stats(**deltas):
+    """Add ``deltas`` (e.g. ``appointments=-3, revenue=-120.0``) to the counters in the current transaction.
+
+    The mapper hooks only see changes made through the unit of work;
+    set-based statements report what they changed here instead, so the
+    counters commit atomically with the rows.
+    """
+    connection = db.session.connection()
+    for key, delta in deltas.items():
+        _adjust(connection, key, delta)
+
+
+def reconcile_stats():
+    """Recompute every counter from the base tables.
+
+    A full count of every counted table, for repairs and the periodic
+    check: the dashboard reconciles on its own every
+    STATS_RECONCILE_INTERVAL, and ``flask reconcile-stats`` on demand.
+    """
+    columns = [
+        select(func.count()).select_from(model).scalar_subquery().label(key)
+        for key, model in COUNTED_MODELS.items()
+    ]
+    columns.append(
+        select(func.coalesce(func.sum(Billing.amount), 0))
+        .where(Billing.status == 'paid')
+        .scalar_subquery()
+        .label('revenue')
+    )
+    row = db.session.execute(select(*columns)).one()
+
+    now = datetime.utcnow()
+    values = row._asdict()
+    for key, value in values.items():
+        db.session.merge(DashboardStat(key=key, value=value, reconciled_at=now))
+    db.session.commit()
+    return values
+
+
+def dashboard_stats():
+    stats = {s.key: s for s in DashboardStat.query.all()}
+    interval = current_app.config.get('STATS_RECONCILE_INTERVAL', DEFAULT_RECONCILE_INTERVAL)
+    cutoff = datetime.utcnow() - timedelta(seconds=interval)
+    expected = set(COUNTED_MODELS) | {'revenue'}
+    if set(stats) != expected or any(s.reconciled_at is None or s.reconciled_at < cutoff for s in stats.values()):
+        return reconcile_stats()
+    return {key: stat.value for key, stat in stats.items()}
+
+
+@click.command('reconcile-stats')
+@with_appcontext
+def reconcile_stats_command():
+    """Recompute the dashboard counters from the base tables."""
+    for key, value in reconcile_stats().items():
+        click.echo(f"{key}: {value}")
@@ -0,0 +1,112 @@
+from datetime import date, datetime
+
+from sqlalchemy import func, select, update
+
+from models import db, Appointment, Billing
+from .rollups import add_billings, subtract_billings
+from .stats import adjust_stats
+
+# Target status -> statuses a row may move from. Reviving cancelled rows is left to the edit
+# forms, which re-check the schedule.
+APPOINTMENT_TRANSITIONS = {
+    'completed': ('scheduled',),
+    'cancelled': ('scheduled',)
+}
+BILLING_TRANSITIONS = {
+    'paid': ('pending',),
+    'cancelled': ('pending',)
+}
+
+# Keeps the IN (...) list of a checkbox selection well under SQLite's bound parameter limit
+MAX_SELECTION = 500
+
+
+def parse_day(value, name='date'):
+    """``value`` (YYYY-MM-DD) as a date; None when blank."""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f'Invalid {name}; expected YYYY-MM-DD.') from None
+
+
+def _ids(ids):
+    ids = sorted({int(id) for id in ids})
+    if len(ids) > MAX_SELECTION:
+        raise ValueError(f'At most {MAX_SELECTION} rows can be changed at once.')
+    return ids
+
+
+def _from_statuses(transitions, status):
+    if status not in transitions:
+        raise ValueError(f"Cannot bulk change status to {status!r}; expected one of {', '.join(transitions)}.")
+    return transitions[status]
+
+
+def appointment_selection(status, ids=None, doctor_id=None, day=None):
+    """Criteria for the appointments a move to ``status`` would change.
+
+    Either explicit ``ids`` (a checkbox selection) or a doctor's day, e.g.
+    closing all of ``doctor_id``'s appointments on ``day``.
+    """
+    criteria = [Appointment.status.in_(_from_statuses(APPOINTMENT_TRANSITIONS, status))]
+    if ids:
+        criteria.append(Appointment.id.in_(_ids(ids)))
+    elif doctor_id is not None and day is not None:
+        criteria += [Appointment.doctor_id == doctor_id, Appointment.appointment_date == day]
+    else:
+        raise ValueError('Select appointments, or a doctor and a date.')
+    return criteria
+
+
+def billing_selection(status, ids):
+    if not ids:
+        raise ValueError('Select at least one billing.')
+    return [Billing.status.in_(_from_statuses(BILLING_TRANSITIONS, status)), Billing.id.in_(_ids(ids))]
+
+
+def count_selected(model, criteria):
+    """How many rows a transition would change, for the confirmation prompt."""
+    return db.session.scalar(select(func.count()).select_from(model).where(*criteria))
+
+
+def set_appointment_status(status, criteria, commit=True):
+    """Move the selected appointments to ``status`` in one UPDATE; returns the number changed."""
+    changed = db.session.execute(
+        update(Appointment).where(*criteria)
+        .values(status=status, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if commit:
+        db.session.commit()
+    return changed
+
+
+def set_billing_status(status, criteria, payment_date=None, payment_method=None, commit=True):
+    """Move the selected billings to ``status`` in one UPDATE; returns the number changed.
+
+    Marking bills paid also records ``payment_date`` (default today) and,
+    when given, ``payment_method``. The billing rollups are moved in the same
+    transaction, as is the dashboard revenue.
+    """
+    values = {'status': status, 'updated_at': datetime.utcnow()}
+    if status == 'paid':
+        values['payment_date'] = payment_date or date.today()
+        if payment_method:
+            # Otherwise each bill keeps the method already recorded on it
+            values['payment_method'] = payment_method
+    subtract_billings(*criteria)
+    changed = db.session.execute(
+        update(Billing).where(*criteria).values(**values)
+        .returning(Billing.id, Billing.amount)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if changed:
+        add_billings(Billing.id.in_([id for id, _ in changed]))
+        if status == 'paid':
+            # Bills only move here from pending, so all of it is new revenue
+            adjust_stats(revenue=sum(amount for _, amount in changed))
+    if commit:
+        db.session.commit()
+    return len(changed)
@@ -0,0 +1,34 @@
+// Typeahead for select fields whose option lists are too large to inline.
+// The server tags those selects with data-lookup-url (see services/choices.py).
+document.querySelectorAll('select[data-lookup-url]').forEach(function (select) {
+    var input = document.createElement('input');
+    input.type = 'search';
+    input.className = 'form-control mb-1';
+    input.placeholder = 'Type to search...';
+    select.parentNode.insertBefore(input, select);
+
+    var blank = select.querySelector('option[value="0"]');
+    var timer = null;
+
+    function load(term) {
+        fetch(select.dataset.lookupUrl + '?q=' + encodeURIComponent(term))
+            .then(function (response) { return response.json(); })
+            .then(function (data) {
+                var current = select.value;
+                select.innerHTML = '';
+                if (blank) {
+                    select.appendChild(blank);
+                }
+                data.results.forEach(function (item) {
+                    var option = new Option(item.text, item.id);
+                    option.selected = String(item.id) === current;
+                    select.appendChild(option);
+                });
+            });
+    }
+
+    input.addEventListener('input', function () {
+        clearTimeout(timer);
+        timer = setTimeout(function () { load(input.value); }, 250);
+    });
+});
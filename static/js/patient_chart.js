@@ -0,0 +1,38 @@
+// Plots the columnar series from /patients/<id>/chart (see services/charts.py).
+(function () {
+    var container = document.getElementById('patient-chart');
+    if (!container || typeof Chart === 'undefined') {
+        return;
+    }
+
+    function line(canvas, labels, datasets, yTitle, reverse) {
+        return new Chart(canvas, {
+            type: 'line',
+            data: { labels: labels, datasets: datasets },
+            options: {
+                spanGaps: true,
+                scales: { y: { reverse: !!reverse, title: { display: true, text: yTitle } } }
+            }
+        });
+    }
+
+    fetch(container.dataset.chartUrl)
+        .then(function (response) { return response.json(); })
+        .then(function (data) {
+            var tests = data.eye_tests;
+            if (!tests.date.length) {
+                container.querySelector('[data-chart-empty]').hidden = false;
+                container.querySelectorAll('canvas').forEach(function (c) { c.hidden = true; });
+                return;
+            }
+            line(document.getElementById('iop-chart'), tests.date, [
+                { label: 'IOP left', data: tests.iop_left },
+                { label: 'IOP right', data: tests.iop_right }
+            ], 'mmHg');
+            // Lower logMAR is better vision, so the axis is flipped to read "up is better"
+            line(document.getElementById('acuity-chart'), tests.date, [
+                { label: 'Acuity left', data: tests.logmar_left },
+                { label: 'Acuity right', data: tests.logmar_right }
+            ], 'logMAR', true);
+        });
+})();
@@ -0,0 +1,41 @@
+// Search-as-you-type over /patients/search (see services/search.py).
+(function () {
+    var input = document.getElementById('patient-search');
+    var list = document.getElementById('patient-search-results');
+    if (!input) {
+        return;
+    }
+    var timer = null;
+    var latest = 0;
+
+    function render(results) {
+        list.innerHTML = '';
+        results.forEach(function (patient) {
+            var link = document.createElement('a');
+            link.className = 'list-group-item list-group-item-action';
+            link.href = patient.url;
+            link.textContent = patient.name + ' — ' + patient.email + ' — ' + patient.phone;
+            list.appendChild(link);
+        });
+    }
+
+    input.addEventListener('input', function () {
+        clearTimeout(timer);
+        var term = input.value.trim();
+        if (!term) {
+            render([]);
+            return;
+        }
+        timer = setTimeout(function () {
+            var request = ++latest;
+            fetch(input.dataset.searchUrl + '?q=' + encodeURIComponent(term))
+                .then(function (response) { return response.json(); })
+                .then(function (data) {
+                    // Ignore responses that arrive after a newer query was sent
+                    if (request === latest) {
+                        render(data.results);
+                    }
+                });
+        }, 150);
+    });
+})();
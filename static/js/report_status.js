@@ -0,0 +1,25 @@
+// Polls /reports/view/<id>/status while a report job runs (see services/jobs.py).
+(function () {
+    var container = document.getElementById('report-status');
+    if (!container) {
+        return;
+    }
+    var bar = container.querySelector('.progress-bar');
+
+    function poll() {
+        fetch(container.dataset.statusUrl)
+            .then(function (response) { return response.json(); })
+            .then(function (job) {
+                if (job.status === 'done' || job.status === 'failed') {
+                    window.location.reload();
+                    return;
+                }
+                bar.style.width = job.progress + '%';
+                bar.textContent = job.progress + '%';
+                setTimeout(poll, 1000);
+            })
+            .catch(function () { setTimeout(poll, 5000); });
+    }
+
+    setTimeout(poll, 1000);
+})();
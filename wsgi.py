@@ -0,0 +1,11 @@
+"""WSGI entry point, e.g. ``gunicorn wsgi:app``.
+
+Without --preload every worker imports this module after the fork and
+builds its own app. With --preload the app is built once in the master
+and forked; each worker then drops the inherited connection pool and
+opens its own connections. Run ``flask --app app create-db`` once per
+deploy, before starting the workers.
+"""
+from app import create_app
+
+app = create_app()